@@ -6,44 +6,89 @@ from typing import Dict, Iterable, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from collections import defaultdict, deque
 
 # -------- defaults (can be overridden via run_clustering args) --------
 DEFAULT_JACCARD_KEEP_THRESHOLD = 0.70
 DEFAULT_OUT_DIR = "minhash_outputs"
 
-# --- helper: build clusters (connected components) via BFS ---
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components as _sp_connected_components
+except ImportError:  # union-find fallback below
+    _sp_connected_components = None
+
+# --- helper: build clusters (connected components) over integer ids ---
+class _UnionFind:
+    """Union-find over ids 0..n-1 (path halving; the smaller root wins)."""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, u: int) -> int:
+        parent = self.parent
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+
+    def union(self, u: int, v: int) -> None:
+        u, v = self.find(u), self.find(v)
+        if u != v:
+            self.parent[max(u, v)] = min(u, v)
+
+    def roots(self) -> np.ndarray:
+        parent = np.array(self.parent, dtype=np.int64)
+        while True:
+            nxt = parent[parent]
+            if np.array_equal(nxt, parent):
+                return parent
+            parent = nxt
+
+def _union_find_labels(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Component root of each of n nodes, given edges src[i] -- dst[i]."""
+    uf = _UnionFind(n)
+    for u, v in zip(src.tolist(), dst.tolist()):
+        uf.union(u, v)
+    return uf.roots()
+
+def _pair_nodes(df_pairs: pd.DataFrame) -> np.ndarray:
+    # node-set iteration order is what the old BFS used to number clusters
+    return np.array(list(set(df_pairs["a"]).union(set(df_pairs["b"]))), dtype=object)
+
+def cluster_labels(df_pairs: pd.DataFrame, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Connected components over edges with jaccard >= threshold.
+
+    Returns (nodes, labels): every filename appearing in df_pairs and its component
+    number. Components are numbered 0.. in the order the BFS in build_clusters used to
+    discover them (iteration order of the node set), so cluster ids stay as before.
+    """
+    nodes = _pair_nodes(df_pairs)
+    if len(nodes) == 0:
+        return nodes, np.zeros(0, dtype=np.int64)
+    node_id = pd.Index(nodes)
+    mask = (df_pairs["jaccard"] >= threshold).to_numpy()
+    src = node_id.get_indexer(df_pairs["a"].to_numpy()[mask])
+    dst = node_id.get_indexer(df_pairs["b"].to_numpy()[mask])
+
+    n = len(nodes)
+    if _sp_connected_components is not None:
+        graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n, n))
+        _, raw = _sp_connected_components(graph, directed=False)
+    else:
+        raw = _union_find_labels(n, src, dst)
+    # renumber by first appearance in node order
+    return nodes, pd.factorize(raw)[0].astype(np.int64)
+
 def build_clusters(df_pairs: pd.DataFrame, threshold: float) -> List[List[str]]:
     """
     Build connected components using edges with jaccard >= threshold.
     Returns a list of components; each component is a list of filenames.
     """
-    adj = defaultdict(set)
-    for _, row in df_pairs.iterrows():
-        if row["jaccard"] >= threshold:
-            a, b = row["a"], row["b"]
-            adj[a].add(b)
-            adj[b].add(a)
-
-    nodes = set(df_pairs["a"]).union(set(df_pairs["b"]))
-    return list(_connected_components(adj, nodes))
-
-def _connected_components(adj: Dict[str, set], nodes: Iterable[str]):
-    seen = set()
-    for n in nodes:
-        if n in seen:
-            continue
-        comp = []
-        q = deque([n])
-        seen.add(n)
-        while q:
-            u = q.popleft()
-            comp.append(u)
-            for v in adj[u]:
-                if v not in seen:
-                    seen.add(v)
-                    q.append(v)
-        yield comp
+    nodes, labels = cluster_labels(df_pairs, threshold)
+    order = np.argsort(labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    return [list(g) for g in np.split(nodes[order], bounds)] if len(nodes) else []
 
 # --- quality scoring helpers (unchanged, just wrapped) ---
 _junk_path_re = re.compile(
@@ -114,6 +159,68 @@ def file_quality_score(row: pd.Series, raw_text: Optional[str] = None,
 
     return float(score)
 
+def _as_float(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+
+    def conv(v):
+        try:
+            return float(v)
+        except Exception:
+            return 0.0
+    return np.array([conv(v) for v in values], dtype=float)
+
+def sweet_spot_scores(values: pd.Series, low=50, high=5000) -> np.ndarray:
+    """sweet_spot_score over a column; same values as the scalar version (NaN scores 1.0)."""
+    n = _as_float(values)
+    out = np.ones(len(n))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(n > high, np.maximum(0.0, 1.0 - (np.log1p(n - high) / np.log1p(high))), out)
+        out = np.where(n < low, (n / low) * 0.5, out)
+    return np.where(n <= 0, 0.0, out)
+
+def file_quality_scores(df: pd.DataFrame, content_lookup: Optional[Dict[str, str]] = None) -> np.ndarray:
+    """
+    file_quality_score for every row of df (with a 'filename' column), vectorized.
+    Raw-text penalties are applied only to files found in content_lookup.
+    """
+    def col(key):
+        return df[key] if key in df.columns else pd.Series(0.0, index=df.index)
+
+    names = df["filename"]
+    score = 0.0 + 3.0 * sweet_spot_scores(col("num_tokens"))
+    score = score + 2.0 * sweet_spot_scores(col("num_shingles"))
+    is_str = names.map(lambda p: isinstance(p, str)).to_numpy(dtype=bool)
+    junk = np.zeros(len(df), dtype=bool)
+    junk[is_str] = names[is_str].str.replace("\\", "/", regex=False).str.contains(_junk_path_re).to_numpy(dtype=bool)
+    score = np.where(junk, score - 2.0, score)
+
+    if content_lookup:
+        num_tokens = col("num_tokens").to_numpy()
+        for i, p in enumerate(names.tolist()):
+            raw = content_lookup.get(p)
+            if raw is not None:
+                try:
+                    nt = float(num_tokens[i])
+                except Exception:
+                    nt = 0.0
+                score[i] -= 2.0 * hex_num_ratio_from_tokens(nt, raw)
+                score[i] -= 1.0 * non_ascii_ratio(raw)
+    return score
+
+# Representative: best score, then more shingles, more tokens, shorter path, name.
+# NaN keys sort last, so the choice is deterministic. The old per-cluster tuple max compared
+# NaN as unordered, which made the pick depend on member order: with NaN num_tokens and tied
+# scores, the representative can differ from what versions before this ranking returned.
+_RANK_KEYS = ["score", "_ns", "_nt", "_len", "filename"]
+_RANK_ASCENDING = [False, False, False, True, True]
+
+def _add_rank_columns(scored: pd.DataFrame, content_lookup: Optional[Dict[str, str]]) -> None:
+    scored["score"] = file_quality_scores(scored, content_lookup)
+    scored["_ns"] = scored["num_shingles"] if "num_shingles" in scored.columns else 0
+    scored["_nt"] = scored["num_tokens"] if "num_tokens" in scored.columns else 0
+    scored["_len"] = scored["filename"].str.len()
+
 # -------- main entry (call this from your notebook) --------
 def run_clustering(
     df_files: Optional[pd.DataFrame] = None,
@@ -156,50 +263,36 @@ def run_clustering(
 
     # Ensure every file appears at least as a singleton cluster
     all_paths = set(df_files["filename"])
-    pair_nodes = set(df_pairs["a"]).union(set(df_pairs["b"]))
-    clusters = build_clusters(df_pairs, jaccard_keep_threshold)
-
-    singleton_paths = sorted(all_paths - pair_nodes)
-    for p in singleton_paths:
-        clusters.append([p])
-
-    if content_lookup is None:
-        content_lookup = {}
-
-    file_index = df_files.set_index("filename")
-    keep_rows, drop_rows, cluster_rows = [], [], []
-
-    for cid, comp in enumerate(clusters, start=1):
-        scored = []
-        for p in comp:
-            if p not in file_index.index:
-                continue
-            row = file_index.loc[p]
-            raw = content_lookup.get(p)  # None if unknown
-            s = file_quality_score(row, raw_text=raw)
-            scored.append((p, s, row.get("num_shingles", 0), row.get("num_tokens", 0), len(p)))
-
-        if not scored:
-            continue
-
-        scored.sort(key=lambda t: (-t[1], -t[2], -t[3], t[4], t[0]))
-        keep = scored[0][0]
-        drops = [p for p, *_ in scored[1:]]
-
-        keep_rows.append({"cluster_id": cid, "filename": keep, "score": float(scored[0][1])})
-        for p, s, ns, nt, _ in scored[1:]:
-            drop_rows.append({"cluster_id": cid, "filename": p, "score": float(s)})
-
-        cluster_rows.append({
-            "cluster_id": cid,
-            "size": len(comp),
-            "kept": keep,
-            "dropped_count": len(drops),
-        })
-
-    df_keep  = pd.DataFrame(keep_rows).sort_values(["cluster_id", "filename"]).reset_index(drop=True)
-    df_drop  = pd.DataFrame(drop_rows).sort_values(["cluster_id", "filename"]).reset_index(drop=True)
-    df_clust = pd.DataFrame(cluster_rows).sort_values("cluster_id").reset_index(drop=True)
+    nodes, labels = cluster_labels(df_pairs, jaccard_keep_threshold)
+    singleton_paths = sorted(all_paths - set(nodes))
+    n_pair_clusters = int(labels.max()) + 1 if len(labels) else 0
+    members = pd.DataFrame({
+        "filename": np.concatenate([nodes, np.array(singleton_paths, dtype=object)]),
+        "cluster_id": np.concatenate([labels, n_pair_clusters + np.arange(len(singleton_paths))]) + 1,
+    })
+    clusters = range(n_pair_clusters + len(singleton_paths))
+    sizes = members["cluster_id"].value_counts()
+
+    # Score files that are in df_files; clusters with none of them are skipped
+    files = df_files.drop_duplicates("filename")
+    scored = members.merge(files, on="filename", how="inner")
+    _add_rank_columns(scored, content_lookup)
+    scored = scored.sort_values(["cluster_id"] + _RANK_KEYS, ascending=[True] + _RANK_ASCENDING, kind="mergesort")
+    is_keep = ~scored["cluster_id"].duplicated()
+    out_cols = ["cluster_id", "filename", "score"]
+    df_keep = scored.loc[is_keep, out_cols].astype({"score": float})
+    df_drop = scored.loc[~is_keep, out_cols].astype({"score": float})
+
+    df_clust = pd.DataFrame({
+        "cluster_id": df_keep["cluster_id"].to_numpy(),
+        "size": sizes.reindex(df_keep["cluster_id"]).to_numpy(),
+        "kept": df_keep["filename"].to_numpy(),
+        "dropped_count": df_drop["cluster_id"].value_counts().reindex(df_keep["cluster_id"], fill_value=0).to_numpy(),
+    })
+
+    df_keep  = df_keep.sort_values(["cluster_id", "filename"]).reset_index(drop=True)
+    df_drop  = df_drop.sort_values(["cluster_id", "filename"]).reset_index(drop=True)
+    df_clust = df_clust.sort_values("cluster_id").reset_index(drop=True)
 
     print(f"[info] clusters formed   : {len(clusters)}")
     print(f"[info] kept files        : {len(df_keep)}")
@@ -217,6 +310,81 @@ def run_clustering(
 
     return df_keep, df_drop, df_clust
 
+# -------- threshold sweep --------
+def sweep_thresholds(
+    df_files: pd.DataFrame,
+    df_pairs: pd.DataFrame,
+    thresholds: Iterable[float],
+    *,
+    content_lookup: Optional[Dict[str, str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Clustering at several jaccard_keep_threshold values in one pass.
+
+    Edges are sorted by Jaccard once and merged into a union-find in descending order,
+    taking a snapshot at each threshold. Cluster ids, kept and dropped files match what
+    run_clustering(..., jaccard_keep_threshold=t) returns for each t.
+
+    Returns
+    -------
+    (df_summary, df_assign)
+      df_summary : one row per threshold (descending) with n_edges, n_clusters, kept,
+                   dropped and largest_cluster (files of df_files in the biggest cluster).
+      df_assign  : threshold, filename, cluster_id, kept for every file of df_files.
+    """
+    pair_nodes = _pair_nodes(df_pairs)
+    singletons = sorted(set(df_files["filename"]) - set(pair_nodes))
+    nodes = np.concatenate([pair_nodes, np.array(singletons, dtype=object)])
+    node_id = pd.Index(nodes)
+
+    order = np.argsort(-df_pairs["jaccard"].to_numpy(dtype=float), kind="stable")
+    weights = df_pairs["jaccard"].to_numpy(dtype=float)[order]
+    src = node_id.get_indexer(df_pairs["a"].to_numpy()[order]).tolist()
+    dst = node_id.get_indexer(df_pairs["b"].to_numpy()[order]).tolist()
+
+    # Rank every scored file once; a cluster keeps its best-ranked member
+    scored = df_files.drop_duplicates("filename").copy()
+    _add_rank_columns(scored, content_lookup)
+    scored = scored.sort_values(_RANK_KEYS, ascending=_RANK_ASCENDING, kind="mergesort")
+    scored_ids = node_id.get_indexer(scored["filename"].to_numpy())
+    rank = np.full(len(nodes), np.iinfo(np.int64).max, dtype=np.int64)
+    rank[scored_ids] = np.arange(len(scored_ids))
+    scored_ids = np.sort(scored_ids)
+
+    uf = _UnionFind(len(nodes))
+    k = 0
+    summary_rows, assign_frames = [], []
+    for t in sorted(set(float(x) for x in thresholds), reverse=True):
+        while k < len(weights) and weights[k] >= t:
+            uf.union(src[k], dst[k])
+            k += 1
+        cid = pd.factorize(uf.roots())[0]
+        best = np.full(cid.max() + 1 if len(cid) else 0, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(best, cid, rank)
+        kept = rank[scored_ids] == best[cid[scored_ids]]
+        sizes = np.bincount(cid[scored_ids]) if len(scored_ids) else np.zeros(0, dtype=np.int64)
+
+        summary_rows.append({
+            "threshold": t,
+            "n_edges": k,
+            "n_clusters": int((sizes > 0).sum()),
+            "kept": int(kept.sum()),
+            "dropped": int(len(kept) - kept.sum()),
+            "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+        })
+        assign_frames.append(pd.DataFrame({
+            "threshold": t,
+            "filename": nodes[scored_ids],
+            "cluster_id": cid[scored_ids] + 1,
+            "kept": kept,
+        }))
+
+    df_summary = pd.DataFrame(summary_rows,
+                              columns=["threshold", "n_edges", "n_clusters", "kept", "dropped", "largest_cluster"])
+    df_assign = (pd.concat(assign_frames, ignore_index=True) if assign_frames
+                 else pd.DataFrame(columns=["threshold", "filename", "cluster_id", "kept"]))
+    return df_summary, df_assign
+
 # ----- optional CLI for script use (safe in notebook; only runs if __main__) -----
 if __name__ == "__main__":
     import argparse
@@ -226,8 +394,22 @@ if __name__ == "__main__":
     p.add_argument("--threshold", type=float, default=DEFAULT_JACCARD_KEEP_THRESHOLD)
     p.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
     p.add_argument("--no-save", action="store_true")
+    p.add_argument("--sweep", default=None,
+                   help="Comma-separated thresholds; writes threshold_sweep.csv instead of clustering once")
     args = p.parse_args()
 
+    if args.sweep:
+        df_summary, _ = sweep_thresholds(
+            pd.read_csv(args.files_csv),
+            pd.read_csv(args.pairs_csv),
+            [float(x) for x in args.sweep.split(",")],
+        )
+        print(df_summary.to_string(index=False))
+        if not args.no_save:
+            os.makedirs(args.out_dir, exist_ok=True)
+            df_summary.to_csv(os.path.join(args.out_dir, "threshold_sweep.csv"), index=False)
+        raise SystemExit(0)
+
     run_clustering(
         df_files=None,
         df_pairs=None,
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import sys
 from pathlib import Path
 
+from src.util.jsonl_io import write_jsonl as write_jsonl_sharded
+
 # ---------- Helpers ----------
 
 CRYPTOL_EXTS = {".cry", ".saw"}
@@ -183,11 +184,8 @@ def iter_source_files(inputs):
                 if sub.is_file() and sub.suffix.lower() in CRYPTOL_EXTS:
                     yield sub
 
-def write_jsonl(rows, out_path: Path):
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+def write_jsonl(rows, out_path: Path, compression=None, max_shard_bytes=None):
+    write_jsonl_sharded(rows, out_path, compression=compression, max_shard_bytes=max_shard_bytes)
 
 # ---------- Build Datasets ----------
 def strip_cryptol_comments_with_counts(s: str):
@@ -290,7 +288,7 @@ def strip_cryptol_comments_with_counts(s: str):
 
     return "".join(out), {"line": line_count, "block": block_count}
 
-def build_datasets(inputs, out_dir: Path):
+def build_datasets(inputs, out_dir: Path, compression=None, max_shard_bytes=None):
     out_dir.mkdir(parents=True, exist_ok=True)
 
     rows_with = []
@@ -331,9 +329,10 @@ def build_datasets(inputs, out_dir: Path):
             "variant": "hybrid"
         })
 
-    write_jsonl(rows_with, out_dir / "dataset_with_comments.jsonl")
-    write_jsonl(rows_without, out_dir / "dataset_without_comments.jsonl")
-    write_jsonl(rows_hybrid, out_dir / "dataset_hybrid.jsonl")
+    shard_kw = {"compression": compression, "max_shard_bytes": max_shard_bytes}
+    write_jsonl(rows_with, out_dir / "dataset_with_comments.jsonl", **shard_kw)
+    write_jsonl(rows_without, out_dir / "dataset_without_comments.jsonl", **shard_kw)
+    write_jsonl(rows_hybrid, out_dir / "dataset_hybrid.jsonl", **shard_kw)
 
     print("Wrote:",
           out_dir / "dataset_with_comments.jsonl",
@@ -346,9 +345,14 @@ def main():
     ap = argparse.ArgumentParser(description="Build Cryptol/SAW datasets with three comment-variants.")
     ap.add_argument("inputs", nargs="+", help="Files and/or directories to scan (.cry, .saw).")
     ap.add_argument("--out-dir", required=True, help="Directory to write JSONL datasets.")
+    ap.add_argument("--compression", choices=("gzip", "zstd"), default=None,
+                    help="Write compressed shards plus an index instead of single JSONL files.")
+    ap.add_argument("--max-shard-mb", type=float, default=None,
+                    help="Max uncompressed MB per shard.")
     args = ap.parse_args()
 
-    build_datasets(args.inputs, Path(args.out_dir))
+    max_shard_bytes = int(args.max_shard_mb * (1 << 20)) if args.max_shard_mb else None
+    build_datasets(args.inputs, Path(args.out_dir), compression=args.compression, max_shard_bytes=max_shard_bytes)
 
 if __name__ == "__main__":
     main()
@@ -18,6 +18,10 @@ except ImportError:
 import time
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as _FutTimeout
 
+from src.util.jsonl_io import write_jsonl as write_jsonl_sharded
+from src.util import cryptol_tokenizer
+from src.util.comment_lexer import scan_comments
+
 # persistent decisions (optional)
 _DECISION_CACHE: Dict[str, bool] = {}
 _DECISION_CACHE_PATH: Optional[Path] = None
@@ -218,29 +222,12 @@ def guess_lang_from_ext(path: Path) -> str:
     return EXT_LANG.get(path.suffix.lower(), 'text')
 
 # ---------- Comment extraction/stripping ----------
-BLOCK_C_STYLES = [
-    (re.compile(r'/\*.*?\*/', re.S), '/*', '*/'),
-]
-
-LINE_COMMENT_PATTERNS = [
-    (re.compile(r'(^|\s)//[^\n]*', re.M), '//'),
-    (re.compile(r'(^|\s)#(?!\!).*', re.M), '#'),
-    (re.compile(r'(^|\s)--[^\n]*', re.M), '--'),
-    (re.compile(r'(^|\s);[^\n]*', re.M), ';'),
-]
-
-def extract_comments_raw(text: str) -> List[Tuple[str, Tuple[int,int], str]]:
+# One linear pass per file (src/util/comment_lexer.py): non-overlapping spans, strings and
+# nested Cryptol/SAW block comments understood. `lang` is a guess_lang_from_ext value.
+
+def extract_comments_raw(text: str, lang: Optional[str] = None) -> List[Tuple[str, Tuple[int,int], str]]:
     """Return list of (comment_text, (start,end), kind) spans (kind in {'block','//','#','--',';'})."""
-    spans = []
-    for rx, start_tok, end_tok in BLOCK_C_STYLES:
-        for m in rx.finditer(text):
-            spans.append((m.group(0), (m.start(), m.end()), 'block'))
-    for rx, tok in LINE_COMMENT_PATTERNS:
-        k = tok
-        for m in rx.finditer(text):
-            spans.append((m.group(0), (m.start(), m.end()), k))
-    spans.sort(key=lambda x: x[1][0])
-    return spans
+    return scan_comments(text, lang)
 
 def group_consecutive_slashslash(text: str, spans: List[Tuple[str, Tuple[int,int], str]]) -> List[Tuple[str, Tuple[int,int], str]]:
     """Group consecutive '//' line comments touching line-by-line into a single multi-line comment span."""
@@ -254,29 +241,23 @@ def group_consecutive_slashslash(text: str, spans: List[Tuple[str, Tuple[int,int
             continue
         # Start a group of //
         start, end = s, e
-        chunk = [txt]
         i += 1
         while i < len(spans) and spans[i][2] == '//':
             s2, e2 = spans[i][1]
-            inter = text[end:s2]
-            if set(inter) <= set([' ', '\t', '\n']):  # no code between
-                end = e2
-                chunk.append(spans[i][0])
-                i += 1
-            else:
+            if text[end:s2].strip(' \t\n'):  # code between
                 break
-        grouped_txt = ''.join(chunk)
-        grouped.append((grouped_txt, (start, end), '//'))
-    grouped.sort(key=lambda x: x[1][0])
+            end = e2
+            i += 1
+        grouped.append((text[start:end], (start, end), '//'))
     return grouped
 
-def extract_comments(text: str) -> List[Tuple[str, Tuple[int,int], str]]:
-    raw = extract_comments_raw(text)
+def extract_comments(text: str, lang: Optional[str] = None) -> List[Tuple[str, Tuple[int,int], str]]:
+    raw = extract_comments_raw(text, lang)
     return group_consecutive_slashslash(text, raw)
 
-def strip_comments(text: str) -> Tuple[str, List[Tuple[str, Tuple[int,int], str]]]:
+def strip_comments(text: str, lang: Optional[str] = None) -> Tuple[str, List[Tuple[str, Tuple[int,int], str]]]:
     """Remove comments and return (code_without_comments, list_of_removed (text, (s,e), kind))."""
-    spans = extract_comments(text)
+    spans = extract_comments(text, lang)
     if not spans:
         return text, []
     out = []
@@ -284,7 +265,9 @@ def strip_comments(text: str) -> Tuple[str, List[Tuple[str, Tuple[int,int], str]
     idx = 0
     for ctext, (s, e), kind in spans:
         if s > idx:
-            out.append(text[idx:s])
+            seg = text[idx:s]
+            # drop the indentation/spacing that only separated code from a trailing line comment
+            out.append(seg if kind == 'block' else seg.rstrip(' \t'))
         removed.append((ctext, (s, e), kind))
         newlines = ctext.count('\n')
         out.append('\n' * newlines)
@@ -297,7 +280,7 @@ import re as _re
 HEXBYTE_RE = _re.compile(r'\b0x[0-9a-fA-F]+\b')
 HEXNUM_RE = _re.compile(r'\b[0-9a-fA-F]{8,}\b')
 
-def compute_basic_metrics(text: str) -> Dict[str, float]:
+def compute_basic_metrics(text: str, sha1: Optional[str] = None) -> Dict[str, float]:
     lines = text.split('\n')
     n_lines = len(lines)
     n_bytes = len(text.encode('utf-8', errors='ignore'))
@@ -311,8 +294,8 @@ def compute_basic_metrics(text: str) -> Dict[str, float]:
     enc_total_matched = enc_base64_hits + enc_hexbytes_hits + enc_unicode_hits
     enc_max_run = max([len(m.group(0)) for m in _re.finditer(r'[A-Za-z0-9+/=]{1,}', text)] or [0])
     enc_fraction = enc_total_matched / max(1, len(text))
-    lang_tokens = _re.findall(r'[A-Za-z_][A-Za-z0-9_]*', text)
-    num_tokens_lang = len(lang_tokens)
+    # shared Cryptol tokenizer (comments stripped), memoized by content sha1
+    num_tokens_lang = len(cryptol_tokenizer.tokenize(text, sha1=sha1))
     hexnum_ratio = len(HEXNUM_RE.findall(text)) / max(1, num_tokens_lang)
     num_tokens_model = len(_re.findall(r'\S+', text))
     # simple character-shingle count as proxy
@@ -450,8 +433,9 @@ def apply_hybrid_policy(
     show_progress: bool = True,
     agent_timeout_s: int = 60,
     max_comment_len: int = 4000,
+    lang: Optional[str] = None,
 ) -> str:
-    spans = extract_comments(original_text)
+    spans = extract_comments(original_text, lang)
     if not spans:
         return original_text
 
@@ -511,7 +495,7 @@ def build_records_for_file(
         return None
     text = text.strip("\n") + "\n"
     lang = guess_lang_from_ext(file_path)
-    code_wo, removed = strip_comments(text)
+    code_wo, removed = strip_comments(text, lang)
 
     if variant == 'with_comments':
         content = text
@@ -523,7 +507,7 @@ def build_records_for_file(
         content = apply_hybrid_policy(
             text, str(file_path), code_wo, comments_index_fh,
             batch_size=agent_batch_size, show_progress=show_agent_progress,
-            agent_timeout_s=agent_timeout_s, max_comment_len=max_comment_len
+            agent_timeout_s=agent_timeout_s, max_comment_len=max_comment_len, lang=lang
         )
     else:
         raise ValueError(f"Unknown variant: {variant}")
@@ -542,8 +526,8 @@ def build_records_for_file(
     records: List[Dict] = []
     total_parts = len(chunks)
     for idx, chunk in enumerate(chunks, start=1):
-        metrics = compute_basic_metrics(chunk)
         sha1 = hashlib.sha1(chunk.encode("utf-8", errors="ignore")).hexdigest()
+        metrics = compute_basic_metrics(chunk, sha1=sha1)
         rec = {
             'filename': str(file_path),
             'lang': lang,
@@ -594,6 +578,9 @@ def build_datasets(
     prompt_reserve_tokens: int = 512,
     chunk_overlap_tokens: int = 64,
     chars_per_token: float = 4.0,
+    # output layout (see src/util/jsonl_io.py)
+    compression: Optional[str] = None,
+    max_shard_bytes: Optional[int] = None,
 ) -> Dict[str, List[Dict]]:
     out_dir.mkdir(parents=True, exist_ok=True)
     # 1) load persistent agent decisions (safe no-op if path is None/missing)
@@ -635,9 +622,7 @@ def build_datasets(
             if v not in results:
                 results[v] = []
             jpath = out_dir / f'dataset_{v}.jsonl'
-            with jpath.open('w', encoding='utf-8') as f:
-                for r in results[v]:
-                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            write_jsonl_sharded(results[v], jpath, compression=compression, max_shard_bytes=max_shard_bytes)
 
     if save_parquet and pd is not None:
         for v, recs in results.items():
@@ -671,9 +656,12 @@ def build_datasets_from_sources(
     prompt_reserve_tokens: int = 512,
     chunk_overlap_tokens: int = 64,
     chars_per_token: float = 4.0,
+    compression: Optional[str] = None,
+    max_shard_bytes: Optional[int] = None,
 ) -> Dict[str, List[Dict]]:
     """
     High-level API for notebooks: pass metrics and/or jsonl, optional root_dir.
+    compression/max_shard_bytes write zstd/gzip shards plus an index per variant.
     """
     inputs: List[Path] = []
     root = Path(root_dir) if root_dir else None
@@ -706,6 +694,8 @@ def build_datasets_from_sources(
         prompt_reserve_tokens=prompt_reserve_tokens,
         chunk_overlap_tokens=chunk_overlap_tokens,
         chars_per_token=chars_per_token,
+        compression=compression,
+        max_shard_bytes=max_shard_bytes,
     )
 
 # ---------- CLI ----------
@@ -721,6 +711,8 @@ def main():
     ap.add_argument('--root_dir', type=str, default='', help='Prepend this root to relative filenames when reading files')
     ap.add_argument('--agent_batch_size', type=int, default=10)
     ap.add_argument('--no_agent_progress', action='store_true')
+    ap.add_argument('--compression', type=str, default=None, choices=('gzip', 'zstd'))
+    ap.add_argument('--max_shard_mb', type=float, default=None)
     args = ap.parse_args()
 
     root = args.root_dir if args.root_dir else None
@@ -734,6 +726,8 @@ def main():
         root_dir=root,
         agent_batch_size=args.agent_batch_size,
         show_agent_progress=not args.no_agent_progress,
+        compression=args.compression,
+        max_shard_bytes=int(args.max_shard_mb * (1 << 20)) if args.max_shard_mb else None,
     )
     print({k: len(v) for k, v in results.items()})
 
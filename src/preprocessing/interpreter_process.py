@@ -1,8 +1,12 @@
 from __future__ import annotations
-import os, io, json, tempfile, pathlib
-from typing import Optional, Tuple
+import os, io, json, tempfile, pathlib, queue, threading, re, hashlib, posixpath, warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 import pandas as pd
 
+from src.util.file_kv_cache import FileKVCache
+
 # pip install cryptol
 import cryptol
 
@@ -40,9 +44,9 @@ def write_cryptol_tempfile(
         suffix=suffix,
         delete=False,
     ) as tf:
+        # No fsync: the server reads the file right after close, and the page cache
+        # already makes it visible (bind mounts included).
         tf.write(code)
-        tf.flush()
-        os.fsync(tf.fileno())
         host_path = pathlib.Path(tf.name)
 
     # Inside the container we assume mount -> /home/cryptol/files
@@ -54,15 +58,33 @@ def load_with_cryptol_server(
     container_relpath: str,
     server_url: Optional[str] = None,
     reset_server: bool = True,
+    connection=None,
+    cache: Optional["VerificationCache"] = None,
 ) -> dict:
     """
     Connect to Cryptol Remote API and :load the given file path.
     Returns a dict with 'load_ok' plus optional details (file_deps, errors).
+
+    If `connection` is given (e.g. from CryptolServerPool) it is reset and reused
+    instead of opening a new connection; server_url/reset_server are then ignored.
+    If `cache` is given, an up-to-date cached result is returned without contacting
+    the server (marked 'cached': True), and fresh results are added to it.
     """
-    kwargs = {}
-    if server_url:
-        kwargs["url"] = server_url
-    cry = cryptol.connect(reset_server=reset_server, **kwargs)
+    if cache is not None:
+        if connection is not None:
+            cache.detect_version(connection)
+        hit = cache.lookup(container_relpath, server_url=server_url)
+        if hit is not None:
+            return hit
+
+    if connection is not None:
+        cry = connection
+        cry.reset()
+    else:
+        kwargs = {}
+        if server_url:
+            kwargs["url"] = server_url
+        cry = cryptol.connect(reset_server=reset_server, **kwargs)
 
     result: dict = {"load_ok": False, "file": container_relpath, "error": "None"}
 
@@ -81,9 +103,410 @@ def load_with_cryptol_server(
     except Exception as e:
         result["error"] = e
 
+    if cache is not None:
+        cache.store(container_relpath, result)
     return result
 
 
+def error_info(error: Any) -> Optional[Dict[str, str]]:
+    """Structured, JSON-friendly form of a load error: {'type', 'message'} or None."""
+    if error is None or error == "None":
+        return None
+    if isinstance(error, BaseException):
+        return {"type": type(error).__name__, "message": str(error)}
+    if isinstance(error, dict) and "type" in error:
+        return error
+    return {"type": "error", "message": str(error)}
+
+
+# ---------------------------------------------------------------------------
+# Verification cache
+# ---------------------------------------------------------------------------
+
+VERIFY_CACHE_VERSION = 1
+CONTAINER_PREFIX = "files/"
+CRYPTOL_MODULE_EXTS = (".cry", ".md", ".tex")
+_IMPORT_RE = re.compile(
+    r"^[ \t]*import[ \t]+(?:submodule[ \t]+)?([A-Za-z_][\w']*(?:::[A-Za-z_][\w']*)*)",
+    re.MULTILINE,
+)
+
+
+def textual_imports(code: str) -> List[str]:
+    """Module names imported by `code` (`import A::B`, `import A::B as C`, `import A (x)`)."""
+    return list(dict.fromkeys(_IMPORT_RE.findall(code)))
+
+
+def resolve_cryptol_module(
+    name: str,
+    from_dir: pathlib.Path,
+    root: pathlib.Path,
+) -> Optional[pathlib.Path]:
+    """Find `A::B::C` as A/B/C.cry (or literate .md/.tex) in from_dir or its parents, up to root."""
+    rel = pathlib.Path(*name.split("::"))
+    d = from_dir
+    while True:
+        for ext in CRYPTOL_MODULE_EXTS:
+            cand = d / (str(rel) + ext)
+            if cand.is_file():
+                return cand
+        if d == root or root not in d.parents:
+            return None
+        d = d.parent
+
+
+def _sha1_file(path: pathlib.Path) -> Optional[str]:
+    try:
+        return hashlib.sha1(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+class VerificationCache:
+    """
+    Persistent cache of Cryptol load results, stored in a FileKVCache.
+
+    Key   : cache version, Cryptol version, container directory, sha1 of the code.
+            (The basename is left out: temp files get random names, and imports resolve
+            relative to the directory, not the file name.)
+    Value : the load result plus the sha1 of every module it imports, transitively,
+            resolved to files under the host mount. A hit is only returned if all of
+            those files are unchanged and no previously unresolved import now resolves;
+            anything else (stdlib, Prelude) is covered by the Cryptol version.
+
+    Results caused by transport problems (connection refused, timeouts) are not stored.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        host_mount_dir: str,
+        cryptol_version: Optional[str] = None,
+        server_url: Optional[str] = None,
+    ):
+        self.kv = FileKVCache(path)
+        self.mount = pathlib.Path(host_mount_dir).resolve()
+        self.cryptol_version = cryptol_version
+        self.server_url = server_url
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # --- version ---
+    def detect_version(self, connection=None, server_url: Optional[str] = None) -> str:
+        """Ask the server for its version once; later calls return the cached string."""
+        with self._lock:
+            if self.cryptol_version is not None:
+                return self.cryptol_version
+            try:
+                if connection is None:
+                    url = server_url or self.server_url
+                    connection = cryptol.connect(reset_server=False, **({"url": url} if url else {}))
+                info = connection.version().result()
+                if isinstance(info, dict):
+                    self.cryptol_version = f"{info.get('version')}+{info.get('commit hash', '')}"
+                else:
+                    self.cryptol_version = str(info)
+            except Exception as e:
+                warnings.warn(
+                    f"Could not determine the Cryptol server version ({e}); cache entries "
+                    "will not be invalidated by a server upgrade."
+                )
+                self.cryptol_version = "unknown"
+            return self.cryptol_version
+
+    # --- paths ---
+    def host_path(self, container_relpath: str) -> Optional[pathlib.Path]:
+        if not container_relpath.startswith(CONTAINER_PREFIX):
+            return None
+        return self.mount / container_relpath[len(CONTAINER_PREFIX):]
+
+    def _key(self, container_relpath: str, code_sha1: str) -> str:
+        directory = posixpath.dirname(container_relpath)
+        return f"v{VERIFY_CACHE_VERSION}|{self.cryptol_version}|{directory}|{code_sha1}"
+
+    def resolve_module(self, name: str, from_dir: pathlib.Path) -> Optional[pathlib.Path]:
+        return resolve_cryptol_module(name, from_dir, self.mount)
+
+    def dependency_closure(
+        self,
+        host_path: pathlib.Path,
+        code: str,
+        extra_imports: Sequence[str] = (),
+    ) -> Tuple[Dict[str, str], List[List[str]]]:
+        """
+        ({mount-relative path: sha1} for every resolvable import, transitively,
+         [[module, mount-relative dir]] for imports that did not resolve).
+        """
+        deps: Dict[str, str] = {}
+        missing: List[List[str]] = []
+        root = host_path.resolve()
+        stack = [(root, list(dict.fromkeys(textual_imports(code) + list(extra_imports))))]
+        seen = {root}
+        while stack:
+            path, names = stack.pop()
+            for name in names:
+                found = self.resolve_module(name, path.parent)
+                if found is None:
+                    missing.append([name, path.parent.relative_to(self.mount).as_posix()])
+                    continue
+                found = found.resolve()
+                if found in seen:
+                    continue
+                seen.add(found)
+                sha = _sha1_file(found)
+                if sha is None:
+                    continue
+                deps[found.relative_to(self.mount).as_posix()] = sha
+                try:
+                    text = found.read_text(encoding="utf-8", errors="replace")
+                except OSError:
+                    continue
+                stack.append((found, textual_imports(text)))
+        return deps, missing
+
+    # --- lookup / store ---
+    def lookup(self, container_relpath: str, server_url: Optional[str] = None) -> Optional[dict]:
+        host = self.host_path(container_relpath)
+        if host is None:
+            return None
+        code_sha1 = _sha1_file(host)
+        if code_sha1 is None:
+            return None
+        self.detect_version(server_url=server_url)
+        entry = self.kv.get(self._key(container_relpath, code_sha1))
+        if entry is False or not self._still_valid(entry):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return {**entry["result"], "file": container_relpath, "cached": True}
+
+    def _still_valid(self, entry: dict) -> bool:
+        for rel, sha in entry.get("deps", {}).items():
+            if _sha1_file(self.mount / rel) != sha:
+                return False
+        for name, rel_dir in entry.get("missing", []):
+            if self.resolve_module(name, self.mount / rel_dir) is not None:
+                return False
+        return True
+
+    def store(self, container_relpath: str, result: dict) -> None:
+        host = self.host_path(container_relpath)
+        if host is None or is_transport_error(result.get("error")):
+            return
+        try:
+            code = host.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return
+        code_sha1 = hashlib.sha1(host.read_bytes()).hexdigest()
+        server_deps = result.get("file_deps")
+        extra = [d for d in server_deps if isinstance(d, str)] if isinstance(server_deps, list) else []
+        deps, missing = self.dependency_closure(host, code, extra)
+        self.detect_version()
+        self.kv.set(self._key(container_relpath, code_sha1), {
+            "result": {
+                "load_ok": bool(result.get("load_ok")),
+                "error": error_info(result.get("error")) or "None",
+                "file_deps": server_deps,
+            },
+            "deps": deps,
+            "missing": missing,
+        })
+
+
+def is_transport_error(error: Any) -> bool:
+    """True for connection/timeout failures, as opposed to Cryptol rejecting the file."""
+    if not isinstance(error, BaseException):
+        return False
+    if isinstance(error, (OSError, TimeoutError)):
+        return True
+    return type(error).__module__.split(".")[0] in {"requests", "urllib3", "http"}
+
+
+class CryptolServerPool:
+    """
+    A fixed set of long-lived Cryptol Remote API connections shared by worker threads.
+
+    Each connection is used by one thread at a time and reset (not reconnected) before
+    every load. `server_urls` may be one URL (N connections to one server) or a list
+    (connection i goes to server i % len(urls), e.g. one cryptol-remote-api per core).
+    With a VerificationCache, unchanged files are answered without a server round trip.
+    """
+
+    def __init__(
+        self,
+        server_urls: Union[None, str, Sequence[str]] = None,
+        size: Optional[int] = None,
+        reset_server: bool = True,
+        cache: Optional[VerificationCache] = None,
+    ):
+        if server_urls is None or isinstance(server_urls, str):
+            urls = [server_urls]
+        else:
+            urls = list(server_urls)
+        self.size = size or len(urls)
+        self.urls = urls
+        self.cache = cache
+        self._reset_server = reset_server
+        self._idle: "queue.Queue[Tuple[int, Any]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._reset_done: set = set()
+        self._replaced: Dict[int, Any] = {}
+        for i in range(self.size):
+            self._idle.put((i, self._connect(i)))
+
+    def _connect(self, i: int):
+        url = self.urls[i % len(self.urls)]
+        kwargs = {"url": url} if url else {}
+        with self._lock:
+            # Clear server state once per server, not once per connection.
+            reset = self._reset_server and url not in self._reset_done
+            self._reset_done.add(url)
+        return cryptol.connect(reset_server=reset, **kwargs)
+
+    @contextmanager
+    def slot(self) -> Iterator[Tuple[int, Any]]:
+        """
+        Borrow (index, connection) for the duration of the block. The index is
+        stable per connection, e.g. for per-worker scratch file names.
+        """
+        i, conn = self._idle.get()
+        try:
+            yield i, conn
+        finally:
+            with self._lock:
+                conn = self._replaced.pop(i, conn)
+            self._idle.put((i, conn))
+
+    def reconnect(self, i: int):
+        """
+        Open a fresh connection for slot `i`, e.g. after a transport error inside
+        slot(); it is returned and replaces the broken one when the slot is released.
+        """
+        conn = self._connect(i)
+        with self._lock:
+            self._replaced[i] = conn
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection for the duration of the block."""
+        with self.slot() as (_, conn):
+            yield conn
+
+    def load(self, container_relpath: str) -> dict:
+        i, conn = self._idle.get()
+        try:
+            try:
+                return load_with_cryptol_server(container_relpath, connection=conn, cache=self.cache)
+            except Exception as e:
+                # Load errors are reported in the result; anything raised means the
+                # connection itself is broken (e.g. reset failed). Reconnect once.
+                print(f"[warn] Cryptol connection {i} unusable ({e}); reconnecting")
+                conn = self._connect(i)
+                return load_with_cryptol_server(container_relpath, connection=conn, cache=self.cache)
+        finally:
+            self._idle.put((i, conn))
+
+    def verify_code(
+        self,
+        code: str,
+        host_mount_dir: str,
+        prefer_name: Optional[str] = None,
+    ) -> dict:
+        """Write `code` to a temp file under the mount, load it, delete it."""
+        host_path, container_relpath = write_cryptol_tempfile(
+            code=code,
+            host_mount_dir=host_mount_dir,
+            prefer_name=prefer_name,
+        )
+        try:
+            return self.load(container_relpath)
+        finally:
+            try:
+                host_path.unlink()
+            except OSError:
+                pass
+
+    def verify_df(
+        self,
+        df: pd.DataFrame,
+        host_mount_dir: str,
+        workers: Optional[int] = None,
+        progress_every: int = 50,
+    ) -> pd.DataFrame:
+        """
+        Load every row's 'content' and return one result row per input row (same order):
+        filename, load_ok, file_deps, error ({'type','message'} or None).
+        """
+        names = df["filename"].tolist() if "filename" in df.columns else [None] * len(df)
+        codes = df["content"].tolist()
+        done = 0
+        done_lock = threading.Lock()
+
+        def _one(i: int) -> dict:
+            nonlocal done
+            try:
+                info = self.verify_code(codes[i], host_mount_dir, prefer_name=names[i])
+            except Exception as e:  # connection dropped mid-load, etc.
+                info = {"load_ok": False, "error": e}
+            with done_lock:
+                done += 1
+                if progress_every and done % progress_every == 0:
+                    print(f"[info] Verified {done} of {len(codes)} files")
+            return {
+                "filename": names[i],
+                "load_ok": bool(info.get("load_ok")),
+                "file_deps": info.get("file_deps"),
+                "error": error_info(info.get("error")),
+            }
+
+        with ThreadPoolExecutor(max_workers=min(workers or self.size, self.size)) as ex:
+            rows = list(ex.map(_one, range(len(codes))))
+        return pd.DataFrame(rows, columns=["filename", "load_ok", "file_deps", "error"])
+
+    def close(self) -> None:
+        while True:
+            try:
+                _, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.reset()
+            except Exception:
+                pass
+
+    def __enter__(self) -> "CryptolServerPool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def verify_df(
+    df: pd.DataFrame,
+    host_mount_dir: str,
+    server_url: Union[None, str, Sequence[str]] = None,
+    workers: int = 4,
+    cache_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Verify all rows of `df` over a temporary pool of `workers` connections.
+    With `cache_path`, results are cached across runs (see VerificationCache).
+    """
+    cache = None
+    if cache_path:
+        first_url = server_url if server_url is None or isinstance(server_url, str) else server_url[0]
+        cache = VerificationCache(cache_path, host_mount_dir, server_url=first_url)
+    with CryptolServerPool(server_url, size=workers, cache=cache) as pool:
+        results = pool.verify_df(df, host_mount_dir, workers=workers)
+    if cache is not None:
+        print(f"[info] Verification cache: {cache.hits} hits, {cache.misses} misses")
+    return results
+
+
 def verify_df_row_with_cryptol(
     df: pd.DataFrame,
     idx: int,
@@ -138,3 +561,7 @@ def verify_df_row_with_cryptol(
 #     server_url=os.environ.get("CRYPTOL_SERVER_URL"),
 # )
 # print(json.dumps(confirm, indent=2))
+#
+# Whole DataFrame, 8 connections:
+# results_df = verify_df(df[df["filetype"] == "cry"], host_mount_dir="/path/host/mount",
+#                        server_url=os.environ.get("CRYPTOL_SERVER_URL"), workers=8)
@@ -1,6 +1,13 @@
 import re, hashlib
+import types
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any, Callable
 
+import numpy as np
+
+from src.util import cryptol_tokenizer
+
 # Encoded-data (StarCoder-style)
 _ENC_BASE64_RE   = re.compile(r"[A-Za-z0-9+/=\n]{64,}")
 _ENC_HEXBYTES_RE = re.compile(r"(?:\b(?:0x|\\x)?[0-9A-Fa-f]{2}(?:,|\b\s*)){8,}")
@@ -13,23 +20,41 @@ _BINARY_CHUNK = re.compile(rb"[\x00-\x08\x0B\x0C\x0E-\x1F]")
 _HEX_LONG_RE = re.compile(r"0x[0-9A-Fa-f]{4,}")
 _NUM_LONG_RE = re.compile(r"\b\d{6,}\b")
 
+# Column order of compute_file_metrics rows
+_METRIC_COLUMNS = [
+    "filename", "sha1", "bytes", "lines", "avg_line_len", "max_line_len",
+    "non_ascii_ratio", "binary_like",
+    "enc_total_matched", "enc_max_run", "enc_fraction",
+    "enc_hits_base64", "enc_hits_hexbytes", "enc_hits_unicode",
+    "num_tokens_lang", "k_shingle", "num_shingles", "hexnum_ratio",
+    "num_tokens_model", "junk_path",
+]
+
 # Junk path
 _JUNK_PATH = ["SAW-course/src/intr/", "SAW-course/src/lab2A/", "SAW-course/src/lab2E/"]
 
-def count_model_tokens(text: str, model_tokenizer: Any) -> int | None:
+def count_model_tokens(text: str, model_tokenizer: Any, *, errors: str = "warn") -> int | None:
     """
     Try to count tokens using a generic tokenizer-like object.
 
     Supported shapes:
+      - tiktoken.Encoding: encode(text, disallowed_special=()), so special-token text
+        counts as plain text (same as the batched path)
       - HF-style: tokenizer.encode(text, add_special_tokens=False|True)
       - Callable: tokenizer(text) -> list[int] or dict(input_ids=...)
+
+    Returns None when there is no tokenizer or it has an unsupported shape. If the
+    tokenizer fails, errors="warn" warns and returns None; errors="raise" re-raises.
     """
     if model_tokenizer is None:
         return None
 
     try:
+        if _is_tiktoken(model_tokenizer):
+            ids = model_tokenizer.encode(text, disallowed_special=())
+
         # HuggingFace / Qwen / LLaMA etc: has .encode(...)
-        if hasattr(model_tokenizer, "encode"):
+        elif hasattr(model_tokenizer, "encode"):
             try:
                 ids = model_tokenizer.encode(text, add_special_tokens=False)
             except TypeError:
@@ -50,9 +75,102 @@ def count_model_tokens(text: str, model_tokenizer: Any) -> int | None:
         # At this point ids should be a list[int]
         return len(ids) if ids is not None else None
 
-    except Exception:
+    except Exception as e:
+        if errors == "raise":
+            raise
+        warnings.warn(f"model tokenizer {tokenizer_name(model_tokenizer)} failed: {type(e).__name__}: {e}")
         return None
 
+def _is_tiktoken(model_tokenizer: Any) -> bool:
+    # tiktoken.Encoding is the tokenizer shape with encode_batch
+    return hasattr(model_tokenizer, "encode_batch") and hasattr(model_tokenizer, "encode")
+
+def tokenizer_name(model_tokenizer: Any) -> str:
+    """
+    Stable name for cache keys: HF name_or_path, tiktoken encoding name; for a bound method
+    the owner's name plus the method; otherwise module.qualname of the function or type.
+    """
+    for attr in ("name_or_path", "name"):
+        v = getattr(model_tokenizer, attr, None)
+        if isinstance(v, str) and v:
+            return v
+    owner = getattr(model_tokenizer, "__self__", None)
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        return f"{tokenizer_name(owner)}.{model_tokenizer.__name__}"
+    target = model_tokenizer if hasattr(model_tokenizer, "__qualname__") else type(model_tokenizer)
+    module = getattr(target, "__module__", None) or getattr(getattr(target, "__objclass__", None), "__module__", "")
+    return f"{module}.{target.__qualname__}"
+
+def _batch_token_lengths(texts: list[str], model_tokenizer: Any) -> list[int] | None:
+    """One backend call for all texts, or None if the tokenizer has no batch API."""
+    # tiktoken.Encoding: special-token text is counted as plain text (as in count_model_tokens)
+    if _is_tiktoken(model_tokenizer):
+        return [len(ids) for ids in model_tokenizer.encode_batch(texts, disallowed_special=())]
+    # HuggingFace (fast tokenizers run the batch in Rust)
+    if callable(model_tokenizer) and (hasattr(model_tokenizer, "is_fast") or hasattr(model_tokenizer, "batch_encode_plus")):
+        enc = model_tokenizer(texts, add_special_tokens=False,
+                              return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in enc["input_ids"]]
+    return None
+
+def count_model_tokens_batch(
+    texts: list[str],
+    model_tokenizer: Any,
+    *,
+    batch_size: int = 64,
+    cache=None,
+    errors: str = "warn",
+    name: str | None = None,
+) -> list[int | None]:
+    """
+    count_model_tokens for many texts, batching calls to HF fast tokenizers (__call__ on a
+    list) and tiktoken (encode_batch); other tokenizers are called per text.
+
+    cache : optional FileKVCache or dict; counts are stored under
+            "<name>|<sha1 of text>" so re-runs skip tokenization.
+    name  : cache namespace; defaults to tokenizer_name(model_tokenizer). Required with a
+            cache when that name isn't unique (lambdas, functions defined inside functions).
+    errors: a failing batch is retried text by text; a failing text then warns and
+            counts as None ("warn") or raises ("raise").
+    """
+    if model_tokenizer is None:
+        return [None] * len(texts)
+
+    name = name or tokenizer_name(model_tokenizer)
+    if cache is not None and "<" in name:
+        raise ValueError(f"tokenizer name {name!r} is not unique enough for a persistent cache; pass name=")
+    keys = [f"{name}|{hashlib.sha1(t.encode('utf-8', errors='ignore')).hexdigest()}" for t in texts]
+    found: dict[str, int | None] = {}
+    todo = []  # first index of each distinct uncached text
+    for i, key in enumerate(keys):
+        if key in found:
+            continue
+        hit = cache.get(key) if cache is not None else None
+        if hit is None or hit is False:
+            found[key] = None
+            todo.append(i)
+        else:
+            found[key] = hit
+
+    for start in range(0, len(todo), batch_size):
+        idx = todo[start:start + batch_size]
+        batch = [texts[i] for i in idx]
+        try:
+            lengths = _batch_token_lengths(batch, model_tokenizer)
+        except Exception as e:
+            warnings.warn(f"batched tokenization with {name} failed ({type(e).__name__}: {e}); retrying per text")
+            lengths = None
+        if lengths is None:
+            lengths = [count_model_tokens(t, model_tokenizer, errors=errors) for t in batch]
+        for i, n in zip(idx, lengths):
+            found[keys[i]] = n
+            if n is not None and cache is not None:
+                if isinstance(cache, dict):
+                    cache[keys[i]] = n
+                else:
+                    cache.set(keys[i], n)
+    return [found[k] for k in keys]
+
 
 def normalize_newlines(s: str) -> str:
     return s.replace("\r\n", "\n").replace("\r", "\n")
@@ -110,19 +228,10 @@ def hex_num_ratio(text: str, token_count_hint: int | None = None) -> float:
     denom = max(1, token_count_hint or 0)
     return min(1.0, (long_hex + long_num) / denom)
 
-# Default very-light Cryptol-ish tokenizer (you can pass your own)
-_DEFAULT_TOKENIZER = re.compile(r"""
-    0x[0-9A-Fa-f]+ | 0b[01]+ | 0o[0-7]+ | \d+ |
-    "(?:[^"\\]|\\.)*" |
-    [A-Za-z_][A-Za-z_0-9']* |
-    <<<|>>>|<<|>>|\^\^|::|->|==|<=|>=|!=|<-|\.\.|\.\.\.|<\||\|> |
-    [{}()\[\];,:\.@!#\^+\-*/=<>\|`]
-""", re.X)
-
+# Default very-light Cryptol-ish tokenizer (you can pass your own); shared with
+# similiar_process and memoized by content sha1
 def default_tokenize(code: str) -> list[str]:
-    # strip line/block comments first
-    code = re.sub(r'--.*?$|//.*?$|/\*.*?\*/', '', code, flags=re.S|re.M)
-    return _DEFAULT_TOKENIZER.findall(code)
+    return list(cryptol_tokenizer.tokenize(code))
 
 # ---------- main metrics function ----------
 def compute_file_metrics(
@@ -131,20 +240,25 @@ def compute_file_metrics(
     *,
     k_shingle: int = 5,
     lang_tokenize = None,              # callable: (str)->list[str]
-    model_tokenizer = None             # HuggingFace tokenizer or any object with encode(add_special_tokens=False)
+    model_tokenizer = None,            # HuggingFace tokenizer or any object with encode(add_special_tokens=False)
+    model_token_cache = None,          # FileKVCache/dict of counts, see count_model_tokens_batch
+    model_tokenizer_name: str | None = None,  # cache namespace (name= of count_model_tokens_batch)
 ) -> dict:
     """
     Return a flat dict of per-file metrics suitable for a pandas DataFrame row.
     Does not make keep/drop decisions—just measures.
     """
 
-    num_tokens_model = count_model_tokens(text, model_tokenizer) if model_tokenizer is not None else None
-
-    lang_tokenize = lang_tokenize or default_tokenize
+    if model_tokenizer is None:
+        num_tokens_model = None
+    elif model_token_cache is not None:
+        num_tokens_model = count_model_tokens_batch([text], model_tokenizer, cache=model_token_cache,
+                                                    name=model_tokenizer_name)[0]
+    else:
+        num_tokens_model = count_model_tokens(text, model_tokenizer)
 
     # Normalize once for stable hashing & line stats
     norm = normalize_newlines(text)
-    sha1 = sha1_text(norm)
 
     # Bytes (encoded) and line stats
     n_bytes = len(norm.encode("utf-8", errors="ignore"))
@@ -154,12 +268,25 @@ def compute_file_metrics(
     is_binary = looks_binary(norm)
     na_ratio  = non_ascii_ratio(norm)
 
+    return _assemble_metrics(
+        filename, norm, n_bytes, (n_lines, avg_line_len, max_line_len), is_binary, na_ratio,
+        k_shingle=k_shingle, lang_tokenize=lang_tokenize, num_tokens_model=num_tokens_model,
+    )
+
+def _assemble_metrics(filename, norm, n_bytes, lines, is_binary, na_ratio, *,
+                      k_shingle, lang_tokenize, num_tokens_model) -> dict:
+    lang_tokenize = lang_tokenize or default_tokenize
+    sha1 = sha1_text(norm)
+    n_lines, avg_line_len, max_line_len = lines
+
     # Encoded data coverage
     enc = encoded_data_metrics(norm)
 
     # Language tokens & shingles
-    toks = lang_tokenize(norm)
-    num_tokens_lang = len(toks)
+    if lang_tokenize is default_tokenize:
+        num_tokens_lang = len(cryptol_tokenizer.tokenize(norm, sha1=sha1))
+    else:
+        num_tokens_lang = len(lang_tokenize(norm))
     num_shingles    = max(0, num_tokens_lang - k_shingle + 1)
 
     # Hex/long-number concentration (per token)
@@ -200,3 +327,83 @@ def compute_file_metrics(
         "junk_path": junk_path,
     }
 
+# ---------- corpus-level metrics ----------
+# Byte-level equivalents of looks_binary / non_ascii_ratio / line_stats over one UTF-8 buffer.
+_CONTROL_BYTE = np.zeros(256, dtype=bool)
+_CONTROL_BYTE[[*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20)]] = True
+
+def _byte_metrics(norm: str):
+    """(n_bytes, line_stats, is_binary, non_ascii_ratio) from one encode, or None if the
+    encoder dropped characters (lone surrogates) and char counts can't be derived from bytes."""
+    raw = norm.encode("utf-8", errors="ignore")
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    cont = (buf & 0xC0) == 0x80              # UTF-8 continuation bytes
+    n_chars = len(buf) - int(np.count_nonzero(cont))
+    if n_chars != len(norm):
+        return None
+
+    is_binary = bool(_CONTROL_BYTE[buf].any())
+    na_ratio = (int(np.count_nonzero(buf >= 0xC0)) / n_chars) if n_chars else 0.0
+
+    if not n_chars:
+        lines = (0, 0.0, 0)
+    else:
+        nl = np.flatnonzero(buf == 0x0A)
+        starts = np.concatenate(([0], nl + 1))
+        ends = np.concatenate((nl, [len(buf)]))
+        cont_cum = np.concatenate(([0], np.cumsum(cont)))
+        char_lens = (ends - starts) - (cont_cum[ends] - cont_cum[starts])
+        n_lines = len(starts)
+        lines = (n_lines, (n_chars - len(nl)) / n_lines, int(char_lens.max()))
+    return len(raw), lines, is_binary, na_ratio
+
+def _corpus_chunk(args) -> list[dict]:
+    items, k_shingle, lang_tokenize = args
+    out = []
+    for filename, text in items:
+        norm = normalize_newlines(text)
+        stats = _byte_metrics(norm)
+        if stats is None:
+            out.append(compute_file_metrics(filename, text, k_shingle=k_shingle, lang_tokenize=lang_tokenize))
+            continue
+        n_bytes, lines, is_binary, na_ratio = stats
+        out.append(_assemble_metrics(filename, norm, n_bytes, lines, is_binary, na_ratio,
+                                     k_shingle=k_shingle, lang_tokenize=lang_tokenize, num_tokens_model=None))
+    return out
+
+def compute_corpus_metrics(
+    df,
+    *,
+    filename_col: str = "filename",
+    content_col: str = "content",
+    workers: int = 1,
+    chunksize: int = 256,
+    k_shingle: int = 5,
+    lang_tokenize = None,
+    model_tokenizer = None,
+    model_token_cache = None,
+    model_batch_size: int = 64,
+    model_tokenizer_name: str | None = None,
+):
+    """
+    compute_file_metrics for every row of df, returned as a DataFrame (same columns and
+    values as building it from per-file dicts). Each text is encoded to UTF-8 once and the
+    byte/line/character stats come from numpy over that buffer. With workers > 1 chunks of
+    files run on a process pool (lang_tokenize must then be picklable). Model tokens are
+    counted in this process in batches of model_batch_size (count_model_tokens_batch).
+    """
+    import pandas as pd
+    items = list(zip(df[filename_col].tolist(), df[content_col].tolist()))
+    chunks = [(items[i:i + chunksize], k_shingle, lang_tokenize) for i in range(0, len(items), chunksize)]
+    if workers <= 1 or len(chunks) <= 1:
+        rows = [r for c in chunks for r in _corpus_chunk(c)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            rows = [r for rs in ex.map(_corpus_chunk, chunks) for r in rs]
+    if model_tokenizer is not None:
+        counts = count_model_tokens_batch([t for _, t in items], model_tokenizer,
+                                          batch_size=model_batch_size, cache=model_token_cache,
+                                          name=model_tokenizer_name)
+        for row, n in zip(rows, counts):
+            row["num_tokens_model"] = n
+    return pd.DataFrame.from_records(rows, columns=_METRIC_COLUMNS)
@@ -1,8 +1,9 @@
 # remove_copyrights.py
-import json
 import re
 from pathlib import Path
 
+from src.util.jsonl_io import ShardedJsonlWriter, iter_records
+
 # Robust copyright matchers
 COPYRIGHT_BLOCK = re.compile(r"/\*.*?copyright.*?\*/", re.IGNORECASE | re.DOTALL)
 COPYRIGHT_LINE  = re.compile(r"^[ \t]*//.*copyright.*?$", re.IGNORECASE | re.MULTILINE)
@@ -15,18 +16,15 @@ def strip_copyrights_from_row(row: dict) -> dict:
         row["content"] = s
     return row
 
-def process_jsonl(input_path: str, output_path: str = None):
+def process_jsonl(input_path: str, output_path: str = None, compression: str = None, max_shard_bytes: int = None):
+    # input may be a plain .jsonl or a sharded output (see src/util/jsonl_io.py)
     input_path = Path(input_path)
     if output_path is None:
         output_path = input_path.with_name(f"{input_path.stem}_nocopyright.jsonl")
 
-    with input_path.open("r", encoding="utf-8") as infile, \
-         Path(output_path).open("w", encoding="utf-8") as outfile:
-        for line in infile:
-            if not line.strip():
-                continue
-            row = json.loads(line)
-            outfile.write(json.dumps(strip_copyrights_from_row(row), ensure_ascii=False) + "\n")
+    with ShardedJsonlWriter(output_path, compression=compression, max_shard_bytes=max_shard_bytes) as outfile:
+        for row in iter_records(input_path):
+            outfile.write(strip_copyrights_from_row(row))
 
     print(f"Processed file written to: {output_path}")
 
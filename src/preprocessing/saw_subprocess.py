@@ -1,11 +1,291 @@
 import os
+import re
 import sys
 import shutil
+import gzip
+import time
+import hashlib
+import functools
+import signal
 import subprocess
+import threading
+import argparse
 import pandas as pd
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Mapping, Union, Sequence, Dict, Any
+from typing import Optional, Mapping, Union, Sequence, Dict, Any, List
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Only SawResultCache needs FileKVCache. This script also runs on its own inside the SAW
+# container (e.g. /workspace/saw_subprocess.py), where src/ isn't importable.
+try:
+    from src.util.file_kv_cache import FileKVCache
+except ImportError:
+    try:
+        from file_kv_cache import FileKVCache  # copied next to this script
+    except ImportError:
+        FileKVCache = None
+
+KILL_GRACE_SECONDS = 2.0
+
+
+def _rlimits(mem_limit: Optional[int], cpu_limit: Optional[int]) -> List[tuple]:
+    limits = []
+    if resource is None:
+        if mem_limit or cpu_limit:
+            print("[WARN] resource module unavailable; running SAW without memory/CPU limits")
+        return limits
+    if mem_limit:
+        limits.append((resource.RLIMIT_AS, (mem_limit, mem_limit)))
+    if cpu_limit:
+        limits.append((resource.RLIMIT_CPU, (cpu_limit, cpu_limit)))
+    return limits
+
+
+def _spawn(cmd: List[str], mem_limit: Optional[int], cpu_limit: Optional[int], **popen_kwargs) -> subprocess.Popen:
+    """
+    Start `cmd` in its own session (so the whole process group can be killed) with
+    optional address-space/CPU rlimits, inherited by any solver it forks.
+
+    The limits are set in the child between fork and exec (preexec_fn), so SAW's runtime
+    starts under them. If one cannot be set, the child never runs and Popen raises
+    subprocess.SubprocessError instead of running the job unlimited.
+    """
+    limits = _rlimits(mem_limit, cpu_limit)
+    preexec_fn = None
+    if limits:
+        def preexec_fn():
+            # only setrlimit here: the child is a copy of a multi-threaded parent
+            for which, value in limits:
+                resource.setrlimit(which, value)
+    return subprocess.Popen(
+        cmd,
+        start_new_session=hasattr(os, "killpg"),
+        preexec_fn=preexec_fn,
+        **popen_kwargs,
+    )
+
+
+def _kill_process_group(proc: subprocess.Popen, grace: float = KILL_GRACE_SECONDS) -> None:
+    """SIGTERM the job's process group, then SIGKILL whatever is left after `grace` seconds."""
+    if not hasattr(os, "killpg"):
+        proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        return
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+# ---------------------------------------------------------------------------
+# Output capture and proof-goal extraction
+# ---------------------------------------------------------------------------
+
+SAW_TS_RE = re.compile(r"^\[(\d{1,2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?\]\s?(.*)$")
+SAW_VERIFYING_RE = re.compile(r"^Verifying\s+(\S+)")
+SAW_SUCCEEDED_RE = re.compile(r"^Proof succeeded!\s+(\S+)")
+SAW_SUBGOAL_FAILED_RE = re.compile(r"^Subgoal failed:\s+(\S+)\s*(.*)$")
+SAW_PROOF_FAILED_RE = re.compile(r"^Proof failed")
+MAX_CAPTURED_LINE = 4000
+
+
+class BoundedCapture:
+    """First `head` and last `tail` lines of a stream, plus how many were dropped in between."""
+
+    def __init__(self, head: int = 200, tail: int = 200):
+        self.head_n = head
+        self.head: List[str] = []
+        self.tail: deque = deque(maxlen=tail)
+        self.total = 0
+
+    def add(self, line: str) -> None:
+        self.total += 1
+        if len(line) > MAX_CAPTURED_LINE:
+            line = line[:MAX_CAPTURED_LINE] + " ...[line truncated]\n"
+        if len(self.head) < self.head_n:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+
+    @property
+    def omitted(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self) -> str:
+        if not self.omitted:
+            return "".join(self.head) + "".join(self.tail)
+        return "".join(self.head) + f"... [{self.omitted} lines omitted] ...\n" + "".join(self.tail)
+
+
+class SawGoalTracker:
+    """
+    Follows SAW's timestamped log lines ("[12:01:02.345] Verifying foo ...") and records
+    each proof goal with its status and duration, plus the first failing goal.
+    """
+
+    def __init__(self):
+        self.goals: List[Dict[str, Any]] = []
+        self.failing_goal: Optional[str] = None
+        self.failure_message: Optional[str] = None
+        self._open: Dict[str, Dict[str, Any]] = {}
+        self._last_ts: Optional[float] = None
+        self._day = 0.0
+
+    def _timestamp(self, m) -> float:
+        frac = m.group(4) or "0"
+        ts = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3)) + float("0." + frac)
+        if self._last_ts is not None and ts + self._day < self._last_ts - 3600:
+            self._day += 86400.0  # clock wrapped past midnight
+        self._last_ts = ts + self._day
+        return self._last_ts
+
+    def feed(self, line: str) -> None:
+        m = SAW_TS_RE.match(line.rstrip("\n"))
+        if m:
+            ts, msg = self._timestamp(m), m.group(5)
+        else:
+            ts, msg = None, line.strip()
+        if (g := SAW_VERIFYING_RE.match(msg)):
+            goal = {"name": g.group(1), "status": "running", "seconds": None, "_start": ts}
+            self.goals.append(goal)
+            self._open[goal["name"]] = goal
+        elif (g := SAW_SUCCEEDED_RE.match(msg)):
+            self._close(g.group(1), "ok", ts)
+        elif (g := SAW_SUBGOAL_FAILED_RE.match(msg)):
+            self._close(g.group(1), "failed", ts)
+            if self.failing_goal is None:
+                self.failing_goal = g.group(1)
+                self.failure_message = g.group(2) or None
+        elif SAW_PROOF_FAILED_RE.match(msg) and self._open:
+            name = next(reversed(self._open))
+            self._close(name, "failed", ts)
+            if self.failing_goal is None:
+                self.failing_goal = name
+
+    def _close(self, name: str, status: str, ts: Optional[float]) -> None:
+        goal = self._open.pop(name, None)
+        if goal is None:
+            goal = {"name": name, "status": status, "seconds": None, "_start": None}
+            self.goals.append(goal)
+        goal["status"] = status
+        if ts is not None and goal["_start"] is not None:
+            goal["seconds"] = round(ts - goal["_start"], 3)
+
+    def facts(self) -> Dict[str, Any]:
+        goals = [{k: v for k, v in g.items() if k != "_start"} for g in self.goals]
+        return {
+            "goals": goals,
+            "n_goals": len(goals),
+            "failing_goal": self.failing_goal,
+            "failure_message": self.failure_message,
+        }
+
+
+def parse_saw_goals(text: str) -> Dict[str, Any]:
+    """Goal facts (see SawGoalTracker) from a complete SAW log."""
+    tracker = SawGoalTracker()
+    for line in text.splitlines():
+        tracker.feed(line)
+    return tracker.facts()
+
+
+def _spill_path(log_dir: Union[str, Path], saw_path: Path) -> Path:
+    digest = hashlib.sha1(str(saw_path).encode("utf-8")).hexdigest()[:10]
+    return Path(log_dir) / f"{saw_path.stem}-{digest}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.log.gz"
+
+
+def _run_bounded(
+    result: Dict[str, Any],
+    cmd: List[str],
+    run_cwd: Path,
+    env: Dict[str, str],
+    saw_path: Path,
+    stream: bool,
+    timeout: Optional[float],
+    mem_limit: Optional[int],
+    cpu_limit: Optional[int],
+    head_lines: int,
+    tail_lines: int,
+    log_dir: Optional[Union[str, Path]],
+) -> Dict[str, Any]:
+    """
+    Run SAW keeping only a bounded head/tail of each stream in memory. The full
+    output (stderr lines prefixed with "[stderr] ") goes to a gzip file under
+    `log_dir` if given, and goal facts are extracted on the fly.
+    """
+    proc = _spawn(
+        cmd, mem_limit, cpu_limit,
+        cwd=str(run_cwd),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if stream else subprocess.PIPE,
+        text=True,
+        errors="replace",
+        bufsize=1,
+    )
+    spill = None
+    if log_dir:
+        Path(log_dir).mkdir(parents=True, exist_ok=True)
+        spill_path = _spill_path(log_dir, saw_path)
+        spill = gzip.open(spill_path, "wt", encoding="utf-8")
+        result["log_path"] = str(spill_path)
+    lock = threading.Lock()
+    tracker = SawGoalTracker()
+    out, err = BoundedCapture(head_lines, tail_lines), BoundedCapture(head_lines, tail_lines)
+
+    def _pump(pipe, capture: BoundedCapture, prefix: str) -> None:
+        for line in pipe:
+            with lock:
+                capture.add(line)
+                tracker.feed(line)
+                if spill is not None:
+                    spill.write(prefix + line)
+                if stream:
+                    sys.stdout.write(line)
+
+    readers = [threading.Thread(target=_pump, args=(proc.stdout, out, ""), daemon=True)]
+    if not stream:
+        readers.append(threading.Thread(target=_pump, args=(proc.stderr, err, "[stderr] "), daemon=True))
+    for t in readers:
+        t.start()
+    timed_out = False
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+    # Kill on timeout, and reap stray solvers after a normal exit, so the pipes close.
+    _kill_process_group(proc, grace=KILL_GRACE_SECONDS if timed_out else 0)
+    proc.wait()
+    for t in readers:
+        t.join()
+    if spill is not None:
+        spill.close()
+
+    result.update(tracker.facts())
+    result["stdout_lines"] = out.total
+    result["stderr_lines"] = err.total
+    result["output_truncated"] = bool(out.omitted or err.omitted)
+    if timed_out:
+        return _timeout_result(result, out.text(), err.text(), timeout)
+    result["returncode"] = proc.returncode
+    result["stdout"] = out.text()
+    result["stderr"] = err.text()
+    result["load_ok"] = (result["returncode"] == 0)
+    return result
+
 
 def run_saw_script(
     filename: str,
@@ -15,6 +295,12 @@ def run_saw_script(
     saw_exe: str = "saw",
     stream: bool = False,
     timeout: Optional[float] = None,
+    mem_limit: Optional[int] = None,
+    cpu_limit: Optional[int] = None,
+    capture: str = "full",
+    head_lines: int = 200,
+    tail_lines: int = 200,
+    log_dir: Optional[Union[str, Path]] = None,
 ) -> Dict[str, Any]:
     """
     Run a SAW (.saw) script with the 'saw' CLI and never raise on process errors.
@@ -34,7 +320,18 @@ def run_saw_script(
       - If 'stream=True', output is echoed live to stdout; 'stderr' is merged into 'stdout'.
       - No exceptions are raised for process failures; only "file_not_found" or "saw_not_found"
         are reported via the 'error' field with load_ok=False and returncode=-1.
+      - SAW runs in its own process group; on timeout (error="timeout") the whole group,
+        including solver children, is killed. mem_limit (bytes) and cpu_limit (seconds)
+        set RLIMIT_AS / RLIMIT_CPU for SAW and everything it starts.
+      - capture="full" keeps all output in memory (as before). capture="bounded" keeps only
+        the first `head_lines` and last `tail_lines` lines of each stream ("output_truncated"
+        tells whether anything was dropped) and, with `log_dir`, writes the complete output
+        to a per-run gzip file ("log_path").
+      - Both modes add proof-goal facts parsed from SAW's log: "goals" (name, status,
+        seconds), "n_goals", "failing_goal" and "failure_message".
     """
+    if capture not in ("full", "bounded"):
+        raise ValueError(f"Unknown capture mode {capture!r}; use 'full' or 'bounded'")
     result: Dict[str, Any] = {
         "filename": filename,
         "load_ok": False,
@@ -62,59 +359,362 @@ def run_saw_script(
     result["cwd"] = str(run_cwd)
 
     env = os.environ.copy()
-    CRYPTOL_PATH = "/workspace/cryptol-specs:/workspace/cryptol"
-    env["CRYPTOLPATH"] = CRYPTOL_PATH + f":{cryptol_path}" if cryptol_path else CRYPTOL_PATH
+    env["CRYPTOLPATH"] = _cryptol_path_value(cryptol_path)
     if extra_env:
         env.update(extra_env)
 
-    try:
-        if stream:
-            # Stream output live; merge stderr into stdout
-            proc = subprocess.Popen(
-                [saw_exe, str(saw_path)],
-                cwd=str(run_cwd),
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-            )
-            buffer = []
+    cmd = [saw_exe, str(saw_path)]
+    if capture == "bounded":
+        return _run_bounded(
+            result, cmd, run_cwd, env, saw_path,
+            stream=stream,
+            timeout=timeout,
+            mem_limit=mem_limit,
+            cpu_limit=cpu_limit,
+            head_lines=head_lines,
+            tail_lines=tail_lines,
+            log_dir=log_dir,
+        )
+    if stream:
+        # Stream output live; merge stderr into stdout
+        proc = _spawn(
+            cmd, mem_limit, cpu_limit,
+            cwd=str(run_cwd),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        timed_out = threading.Event()
+
+        def _on_timeout():
+            timed_out.set()
+            _kill_process_group(proc)
+
+        # proc.wait(timeout) only runs after stdout closes, so enforce the deadline separately.
+        timer = threading.Timer(timeout, _on_timeout) if timeout else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        buffer = []
+        try:
             assert proc.stdout is not None
             for line in proc.stdout:
                 sys.stdout.write(line)
                 buffer.append(line)
-            proc.wait(timeout=timeout)
-            result["returncode"] = proc.returncode
-            result["stdout"] = "".join(buffer)
-            result["stderr"] = ""  # merged
-        else:
-            cp = subprocess.run(
-                [saw_exe, str(saw_path)],
-                cwd=str(run_cwd),
-                env=env,
-                text=True,
-                capture_output=True,
-                timeout=timeout,
-                check=False,  # <-- never raises
-            )
-            result["returncode"] = cp.returncode
-            result["stdout"] = cp.stdout or ""
-            result["stderr"] = cp.stderr or ""
-        result["load_ok"] = (result["returncode"] == 0)
-        return result
-    except subprocess.TimeoutExpired as te:
-        result["error"] = "timeout"
-        result["stdout"] = te.stdout or ""
-        result["stderr"] = (te.stderr or "") + f"\nTimed out after {timeout} seconds."
-        result["returncode"] = -1
-        return result
+            proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        stdout, stderr = "".join(buffer), ""  # merged
+        if timed_out.is_set():
+            return _timeout_result(result, stdout, stderr, timeout)
+    else:
+        proc = _spawn(
+            cmd, mem_limit, cpu_limit,
+            cwd=str(run_cwd),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_process_group(proc)
+            stdout, stderr = proc.communicate()
+            return _timeout_result(result, stdout or "", stderr or "", timeout)
+
+    # The script is done; don't let solvers it started outlive it.
+    _kill_process_group(proc, grace=0)
+    result["returncode"] = proc.returncode
+    result["stdout"] = stdout or ""
+    result["stderr"] = stderr or ""
+    result["load_ok"] = (result["returncode"] == 0)
+    result.update(parse_saw_goals(result["stdout"] + "\n" + result["stderr"]))
+    return result
+
+
+def _timeout_result(result: Dict[str, Any], stdout: str, stderr: str, timeout: Optional[float]) -> Dict[str, Any]:
+    if "goals" not in result:
+        result.update(parse_saw_goals(stdout + "\n" + stderr))
+    result["error"] = "timeout"
+    result["stdout"] = stdout
+    result["stderr"] = stderr + f"\nTimed out after {timeout} seconds."
+    result["returncode"] = -1
+    return result
+
+
+def run_saw_scripts(
+    paths: Sequence[str],
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    mem_limit: Optional[int] = None,
+    cpu_limit: Optional[int] = None,
+    log_path: Optional[Union[str, Path]] = None,
+    cache: Optional["SawResultCache"] = None,
+    **kwargs,
+) -> List[Dict[str, Any]]:
+    """
+    Run many SAW scripts concurrently; returns results in the order of `paths`.
+
+    Each job is its own `saw` process group with optional memory (bytes, RLIMIT_AS)
+    and CPU-time (seconds) limits; on timeout the whole group is killed. Results are
+    appended to `log_path` (JSONL) as each job finishes; the log is never rewritten.
+    Extra kwargs (cryptol_path, cwd, extra_env, saw_exe) go to run_saw_script.
+    With `cache`, scripts whose content and dependencies are unchanged are not re-run.
+    """
+    run_fn = cache.run if cache is not None else run_saw_script
+    if kwargs.get("stream") and (max_workers or 2) > 1:
+        print("[WARN] stream=True with several workers interleaves their output")
+    results: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+    log_f = None
+    if log_path:
+        Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+        log_f = open(log_path, "a", encoding="utf-8")
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as ex:
+            futures = {
+                ex.submit(run_fn, p, timeout=timeout, mem_limit=mem_limit, cpu_limit=cpu_limit, **kwargs): i
+                for i, p in enumerate(paths)
+            }
+            for n, fut in enumerate(as_completed(futures), 1):
+                i = futures[fut]
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    print(f"[ERROR] Failed on {paths[i]}: {e}")
+                    res = {"filename": paths[i], "load_ok": False, "error": str(e)}
+                results[i] = res
+                if log_f is not None:
+                    log_f.write(json.dumps(res) + "\n")
+                    log_f.flush()
+                status = "ok" if res.get("load_ok") else (res.get("error") or f"rc={res.get('returncode')}")
+                print(f"[{n}/{len(paths)}] {paths[i]}: {status}")
+    finally:
+        if log_f is not None:
+            log_f.close()
+    if cache is not None:
+        print(f"[INFO] SAW cache: {cache.hits} hits, {cache.misses} runs")
+    return results
 
 def load_saw_results(filepath: str) -> pd.DataFrame:
+    """Results log as a DataFrame; the log is append-only, so the latest row per filename wins."""
     p = Path(filepath).expanduser()
     if not p.exists():
         return pd.DataFrame([])
-    return pd.read_json(p, lines=True, orient="records")
+    df = pd.read_json(p, lines=True, orient="records")
+    if "filename" in df.columns:
+        df = df.drop_duplicates("filename", keep="last").reset_index(drop=True)
+    return df
+
+# ---------------------------------------------------------------------------
+# Result cache
+# ---------------------------------------------------------------------------
+
+SAW_CACHE_VERSION = 2  # 2: limits in the key, signal-killed runs not cached
+DEFAULT_CRYPTOL_PATH = "/workspace/cryptol-specs:/workspace/cryptol"
+_CRYPTOL_MODULE_IMPORT_RE = re.compile(
+    r"^[ \t]*import[ \t]+(?:submodule[ \t]+)?([A-Za-z_][\w']*(?:::[A-Za-z_][\w']*)*)",
+    re.MULTILINE,
+)
+# SAW dependency statements: include "helpers.saw"; import "spec.cry"; llvm_load_module
+# "x.bc"; java_load_class "p.Cls". Kept here (LLVM/Java mirror sft_saw's prompt-builder
+# patterns) so this script needs neither src/ nor pydantic.
+_SAW_INCLUDE_RE = re.compile(r'^\s*include\s+"([^"\n]+)"', re.MULTILINE)
+_SAW_IMPORT_RE = re.compile(r'^\s*import\s+"([^"\n]+)"', re.MULTILINE)
+_SAW_LLVM_RE = re.compile(r'llvm_load_module\s*"([^"\n]+\.bc)"')
+_SAW_JAVA_RE = re.compile(r'java_load_class\s*"([^"\n]+)"')
+# Results that say nothing about the script itself are never cached.
+_UNCACHEABLE_ERRORS = {"timeout", "file_not_found", "saw_not_found"}
+
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    """False for environment failures, and for runs killed by a signal (SIGXCPU from
+    cpu_limit, SIGKILL from the OOM killer, ...): a re-run with more headroom may pass."""
+    if result.get("error") in _UNCACHEABLE_ERRORS:
+        return False
+    rc = result.get("returncode")
+    return not (isinstance(rc, int) and rc < 0)
+
+
+def _cryptol_path_value(cryptol_path: Union[str, Sequence[str], None]) -> str:
+    if not cryptol_path:
+        return DEFAULT_CRYPTOL_PATH
+    if not isinstance(cryptol_path, str):
+        cryptol_path = os.pathsep.join(cryptol_path)
+    return DEFAULT_CRYPTOL_PATH + f":{cryptol_path}"
+
+
+def _sha1_file(path: Path) -> Optional[str]:
+    try:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def saw_version(saw_exe: str = "saw") -> str:
+    """First line of `saw --version` (cached per executable), or 'unknown'."""
+    try:
+        cp = subprocess.run([saw_exe, "--version"], capture_output=True, text=True, timeout=30)
+        out = (cp.stdout or cp.stderr).strip()
+        return out.splitlines()[0] if out else "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def saw_dependencies(
+    saw_path: Union[str, Path],
+    cwd: Optional[Union[str, Path]] = None,
+    cryptol_path: Union[str, Sequence[str], None] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Files a SAW script depends on, transitively, mapped to their sha1 (None if missing):
+
+      * include "x.saw"           (followed recursively)
+      * llvm_load_module "x.bc"   (the bitcode itself)
+      * java_load_class "p.Cls"   (p/Cls.class under cwd, Cls.java next to the script)
+      * import "x.cry"            (and the Cryptol modules it imports via CRYPTOLPATH)
+
+    Paths are relative to the script's directory, so moving a script together with
+    its dependencies keeps the same key. Relative targets are resolved against the
+    working directory SAW runs in, then the script's directory.
+    """
+    saw_path = Path(saw_path).resolve()
+    base = saw_path.parent
+    run_cwd = Path(cwd).resolve() if cwd else base
+    search = [Path(d) for d in _cryptol_path_value(cryptol_path).split(":") if d]
+    deps: Dict[str, Optional[str]] = {}
+
+    def _rel(p: Path) -> str:
+        return os.path.relpath(p, base)
+
+    def _find(target: str, *dirs: Path) -> Optional[Path]:
+        for d in dirs:
+            cand = (d / target).resolve()
+            if cand.is_file():
+                return cand
+        return None
+
+    def _add(p: Optional[Path], fallback: str) -> bool:
+        key = _rel(p) if p is not None else f"<missing>/{fallback}"
+        if key in deps:
+            return False
+        deps[key] = _sha1_file(p) if p is not None else None
+        return p is not None
+
+    def _cryptol(path: Path) -> None:
+        try:
+            text = path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return
+        for name in _CRYPTOL_MODULE_IMPORT_RE.findall(text):
+            rel = Path(*name.split("::"))
+            found = None
+            for d in [path.parent] + search:
+                for ext in (".cry", ".md", ".tex"):
+                    cand = d / (str(rel) + ext)
+                    if cand.is_file():
+                        found = cand.resolve()
+                        break
+                if found is not None:
+                    break
+            if found is None:
+                continue  # Prelude / stdlib: covered by the SAW version
+            if _add(found, name):
+                _cryptol(found)
+
+    def _saw(path: Path) -> None:
+        try:
+            text = path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return
+        for target in _SAW_INCLUDE_RE.findall(text):
+            found = _find(target, run_cwd, path.parent)
+            if _add(found, target):
+                _saw(found)
+        for target in _SAW_LLVM_RE.findall(text):
+            _add(_find(target, run_cwd, path.parent), target)
+        for cls in _SAW_JAVA_RE.findall(text):
+            class_file = cls.replace(".", "/") + ".class"
+            found = _find(class_file, run_cwd, path.parent)
+            if found is not None:
+                _add(found, class_file)
+            java = _find(cls.rsplit(".", 1)[-1] + ".java", path.parent)
+            if java is not None:
+                _add(java, cls)
+            if found is None and java is None:
+                _add(None, class_file)
+        for target in _SAW_IMPORT_RE.findall(text):
+            found = _find(target, run_cwd, path.parent, *search)
+            if _add(found, target):
+                _cryptol(found)
+
+    _saw(saw_path)
+    return deps
+
+
+class SawResultCache:
+    """
+    Persistent SAW results keyed by what determines them: the script's sha1, the
+    sha1 of every dependency (see saw_dependencies), the CRYPTOLPATH, the memory and
+    CPU limits, and `saw --version`. The filename is not part of the key, so renamed
+    or moved scripts still hit, and editing a spec re-runs exactly the scripts that
+    load it. Timeouts and signal-killed runs are never stored, so the timeout itself
+    is not part of the key.
+    """
+
+    def __init__(self, path: Union[str, Path], saw_exe: str = "saw"):
+        if FileKVCache is None:
+            raise ImportError("SawResultCache needs src/util/file_kv_cache.py (or a copy next to this script)")
+        self.kv = FileKVCache(path)
+        self.saw_exe = saw_exe
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(
+        self,
+        filename: str,
+        cwd: Optional[Union[str, Path]] = None,
+        cryptol_path: Union[str, Sequence[str], None] = None,
+        mem_limit: Optional[int] = None,
+        cpu_limit: Optional[int] = None,
+    ) -> Optional[str]:
+        script_sha1 = _sha1_file(Path(filename))
+        if script_sha1 is None:
+            return None
+        material = {
+            "version": SAW_CACHE_VERSION,
+            "saw": saw_version(self.saw_exe),
+            "script": script_sha1,
+            "deps": saw_dependencies(filename, cwd=cwd, cryptol_path=cryptol_path),
+            "cryptol_path": _cryptol_path_value(cryptol_path),
+            "mem_limit": mem_limit or None,
+            "cpu_limit": cpu_limit or None,
+        }
+        return hashlib.sha1(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def run(self, filename: str, **kwargs) -> Dict[str, Any]:
+        """run_saw_script(filename, **kwargs), answered from the cache when nothing changed."""
+        key = self.key_for(filename, cwd=kwargs.get("cwd"), cryptol_path=kwargs.get("cryptol_path"),
+                           mem_limit=kwargs.get("mem_limit"), cpu_limit=kwargs.get("cpu_limit"))
+        if key is not None:
+            hit = self.kv.get(key)
+            if hit is not False:
+                self.hits += 1
+                return {**hit, "filename": filename, "cached": True}
+        self.misses += 1
+        result = run_saw_script(filename, saw_exe=self.saw_exe, **kwargs)
+        if key is not None and _cacheable(result):
+            self.kv.set(key, result)
+        return result
+
 
 def get_dummy_saw_result(filename: str, error: str) -> Dict[str, Any]:
     return {
@@ -128,54 +728,58 @@ def get_dummy_saw_result(filename: str, error: str) -> Dict[str, Any]:
         "error": error,
     }
 
+SKIP_FILES = [
+    "saw-script/examples/chacha20/chacha20.saw",
+    "saw-script/saw-python/tests/saw-in-progress/HMAC/spec/SHA256.saw",
+]
+
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run SAW scripts in parallel, appending results to a JSONL log.")
+    ap.add_argument("--files", default="sawfiles.txt", help="Text file with one .saw path per line")
+    ap.add_argument("--out", default="/workspace/saw_results.jsonl")
+    ap.add_argument("--cwd", default="/workspace/saw-script")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--mem-limit-gb", type=float, default=None)
+    ap.add_argument("--cpu-limit", type=int, default=None, help="CPU seconds per job")
+    ap.add_argument("--capture", choices=["full", "bounded"], default="bounded")
+    ap.add_argument("--log-dir", default="/workspace/saw_logs", help="Full gzip logs per run (bounded capture)")
+    ap.add_argument("--cache", default="/workspace/saw_results_cache.jsonl",
+                    help="Result cache keyed by script/dependency hashes and saw version ('' to disable)")
+    args = ap.parse_args()
+
     # --- Load list of SAW files ---
-    with open("sawfiles.txt", "r") as f:
+    with open(args.files, "r") as f:
         saw_files = [line.strip() for line in f if line.strip()]
 
-    output_path = "/workspace/saw_results.jsonl"
-    results = []
+    output_path = args.out
 
-    # --- Check if previous results exist ---
-    processed_files = set()
-    if os.path.exists(output_path):
-        print(f"[INFO] Resuming from existing results: {output_path}")
-        with open(output_path, "r") as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    results.append(record)
-                    if "filename" in record:
-                        processed_files.add(record["filename"])
-                except json.JSONDecodeError:
-                    continue  # skip corrupted lines
-
-    # --- Process files incrementally ---
+    todo = []
     for fpath in saw_files:
-        if fpath in processed_files:
-            print(f"[SKIP] Already processed: {fpath}")
-            continue
-
-        print(f"[RUN] Processing {fpath}")
-        try:
-            if fpath in ["saw-script/examples/chacha20/chacha20.saw", "saw-script/saw-python/tests/saw-in-progress/HMAC/spec/SHA256.saw"]:
-                res = get_dummy_saw_result(fpath, None)
-            else:
-                res = run_saw_script(fpath, stream=True, cwd="/workspace/saw-script", timeout=60)
-
-
-        except Exception as e:
-            print(f"[ERROR] Failed on {fpath}: {e}")
-            res = {"filename": fpath, "error": str(e)}
-
-        # --- Append to file immediately ---
-        with open(output_path, "a") as out_f:
-            out_f.write(json.dumps(res) + "\n")
+        if fpath in SKIP_FILES:
+            with open(output_path, "a") as out_f:
+                out_f.write(json.dumps(get_dummy_saw_result(fpath, None)) + "\n")
+        else:
+            todo.append(fpath)
 
-        # --- Keep in-memory list updated too (optional) ---
-        results.append(res)
+    cache = None
+    if args.cache:
+        if FileKVCache is None:
+            print("[WARN] file_kv_cache not importable; running without the result cache")
+        else:
+            cache = SawResultCache(args.cache)
 
-    # --- Optional final conversion to DataFrame ---
-    df = pd.DataFrame(results)
-    df.to_json(output_path, lines=True, orient="records")
-    print(f"[DONE] Results saved to {output_path}")
\ No newline at end of file
+    # --- Process files in parallel, appending each result as it finishes ---
+    run_saw_scripts(
+        todo,
+        max_workers=args.workers,
+        timeout=args.timeout,
+        mem_limit=int(args.mem_limit_gb * (1 << 30)) if args.mem_limit_gb else None,
+        cpu_limit=args.cpu_limit,
+        log_path=output_path,
+        cache=cache,
+        cwd=args.cwd,
+        capture=args.capture,
+        log_dir=args.log_dir if args.capture == "bounded" else None,
+    )
+    print(f"[DONE] Results saved to {output_path}")
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-make_alpaca_instructions.py
+sft_instruct_preprocess.py
 
 Generate Alpaca-format rows (instruction/input/output) from source code files
 by asking the OpenAI API to write a *spec-writing* instruction for each file.
@@ -10,19 +10,25 @@ Output: JSONL with fields:
   - input       : str   (empty or a trimmed excerpt of the code)
   - output      : str   (left empty "" so you can fill later)
 
-Optionally, generate a Batch API requests.jsonl for large-scale offline runs.
+Results are cached in a FileKVCache keyed by filename, both for online calls and
+for the offline Batch API mode (prepare -> submit -> collect).
 
 Usage:
-  python make_alpaca_instructions.py \
-      --src ./my_sources \
-      --out alpaca_instructions.jsonl \
-      --model gpt-4.1-mini \
-      --include-ext .cry .saw .c .h \
-      --input-mode excerpt \
-      --max-chars 6000 \
-      --batch-file requests.jsonl   # optional: create Batch API jobs file
+  # online, up to 8 requests in flight
+  python -m src.preprocessing.sft_instruct_preprocess generate \
+      --input data/sft_input.jsonl --out data/alpaca_instructions.jsonl \
+      --cache cache/sft_instructions.jsonl --model gpt-4.1-mini --workers 8 --tpm 200000
+
+  # Batch API
+  python -m src.preprocessing.sft_instruct_preprocess prepare \
+      --input data/sft_input.jsonl --batch-dir data/batches --cache cache/sft_instructions.jsonl
+  python -m src.preprocessing.sft_instruct_preprocess submit --batch-dir data/batches
+  python -m src.preprocessing.sft_instruct_preprocess collect \
+      --batch-dir data/batches --cache cache/sft_instructions.jsonl --wait
 """
 import re
+import asyncio
+import threading
 import tiktoken
 import argparse
 import json
@@ -30,11 +36,13 @@ import os
 import dotenv
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterable, List, Dict, Any, Tuple, Optional
 import pandas as pd
 from pydantic import BaseModel
 from src.util.file_kv_cache import FileKVCache
+from src.util.jsonl_io import read_dataframe, write_jsonl as write_jsonl_sharded
 from . import sft_cryptol
 from . import sft_saw
 dotenv.load_dotenv()
@@ -269,12 +277,13 @@ def alpaca_df_to_qwen_messages(
 
     return pd.DataFrame(records)
 
-def write_jsonl(rows: Iterable[Dict[str, Any]], path: str) -> None:
-    p = Path(path)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    with p.open("w", encoding="utf-8") as f:
-        for row in rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+def write_jsonl(
+    rows: Iterable[Dict[str, Any]],
+    path: str,
+    compression: Optional[str] = None,
+    max_shard_bytes: Optional[int] = None,
+) -> None:
+    write_jsonl_sharded(rows, path, compression=compression, max_shard_bytes=max_shard_bytes)
 
 # ----- CLI helpers (optional) -----
 def from_alpaca_jsonl_to_qwen_messages(in_path: str, out_path: str, **kwargs) -> None:
@@ -282,7 +291,7 @@ def from_alpaca_jsonl_to_qwen_messages(in_path: str, out_path: str, **kwargs) ->
     Read an Alpaca JSONL with fields {instruction,input,output,(filename?),(filetype?)}
     and write Qwen chat messages JSONL.
     """
-    df = pd.read_json(in_path, orient="records", lines=True)
+    df = read_dataframe(in_path)
     chat_df = alpaca_df_to_qwen_messages(df, **kwargs)
     write_jsonl(chat_df.to_dict(orient="records"), out_path)
 
@@ -300,6 +309,58 @@ def build_user_prompt(filename: str, lang: str, code: str, input_mode: str) -> T
     user = USER_TEMPLATE.format(filename=filename, lang=lang, code=code_for_prompt)
     return user, alpaca_input
 
+FILE_SEARCH_TOOLS = [{
+    "type": "file_search",
+    "vector_store_ids": ["vs_691cd78f3e088191a660732e83652938"],
+    "max_num_results": 3,
+}]
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    """Process-wide OpenAI client, created on first use and shared by all calls/threads."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI()
+    return _client
+
+def route_model(model: str, tokens: int) -> str:
+    """Fall back to the larger-context model when the prompt exceeds the model's limit."""
+    return "gpt-5-2025-08-07" if model in TOKEN_LIMITS.keys() and tokens > TOKEN_LIMITS[model] else model
+
+def retry_after_seconds(e: Exception, attempt: int) -> float:
+    """
+    How long to wait after a rate-limit error: the `retry-after(-ms)` header if the
+    server sent one, else the "Please try again in Xs" hint, else exponential backoff.
+    """
+    response = getattr(e, "response", None)
+    try:
+        headers = response.headers if response is not None else {}
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000.0
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            return float(retry_after)
+    except Exception:
+        pass
+    m = re.search(r"Please try again in ([0-9.]+)(ms|s)", str(e))
+    if m:
+        wait = float(m.group(1))
+        return (wait / 1000.0 if m.group(2) == "ms" else wait) + 1.0
+    return float(min(60, 2 ** attempt))
+
+def _parse_response(response, source_code: str) -> Dict[str, Any]:
+    parsed = response.output_parsed.model_dump()
+    # For code, you optionally append source_code into the instruction.
+    if source_code and isinstance(parsed, dict) and "instruction" in parsed:
+        parsed["instruction"] += f"\n\n# Source code:\n{source_code}"
+    return parsed
+
 def call_openai_structured(
         model: str, 
         system: str, 
@@ -314,54 +375,27 @@ def call_openai_structured(
     For code-spec generation we use AlpacaRow; for text Q&A generation
     we use QAPairList.
     """
-    from openai import OpenAI, RateLimitError
-    client = OpenAI()
-    tools = [{
-        "type": "file_search",
-        "vector_store_ids": ["vs_691cd78f3e088191a660732e83652938"],
-        "max_num_results": 3,
-    }]
+    from openai import RateLimitError
+    client = get_openai_client()
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+    tokens = count_tokens_for_messages(messages)
     last_err = None
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            tokens = count_tokens_for_messages(
-                [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user},
-                ],
-            )
             response = client.responses.parse(
-                model= "gpt-5-2025-08-07" if model in TOKEN_LIMITS.keys() and tokens > TOKEN_LIMITS[model] else model,
-                input=[
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user},
-                ],
+                model=route_model(model, tokens),
+                input=messages,
                 text_format=text_format,
-                tools=tools,
+                tools=FILE_SEARCH_TOOLS,
             )
             print(f"Response:\n\n{response}")
-            parsed = response.output_parsed.model_dump()
-            # For code, you optionally append source_code into the instruction.
-            if source_code and isinstance(parsed, dict) and "instruction" in parsed:
-                parsed["instruction"] += f"\n\n# Source code:\n{source_code}"
-            return parsed
+            return _parse_response(response, source_code)
         except RateLimitError as e:
-            # (unchanged retry logic...)
-            wait_seconds = None
-            try:
-                retry_after = e.response.headers.get("retry-after") if e.response else None
-                if retry_after is not None:
-                    wait_seconds = float(retry_after)
-            except Exception:
-                pass
-            if wait_seconds is None:
-                m = re.search(r"Please try again in ([0-9.]+)s", str(e))
-                if m:
-                    time.sleep(1)
-                    wait_seconds = float(m.group(1))
-            if wait_seconds is None:
-                wait_seconds = min(60, 2 ** attempt)
-
+            last_err = e
+            wait_seconds = retry_after_seconds(e, attempt)
             print(f"Rate limit hit: {e}")
             print(f"Sleeping for {wait_seconds:.2f} seconds before retry #{attempt+1}...")
             time.sleep(wait_seconds)
@@ -371,27 +405,22 @@ def call_openai_structured(
                 raise
             sleep_s = BACKOFF_BASE ** (attempt - 1)
             time.sleep(sleep_s)
-    raise last_err  # should not get here
+    raise last_err
 
-def build_prompt_call_openai_structured(
-    model: str,
+def build_prompt(
     input_mode: str,
     filename: str,
     lang: str,
     code: str,
-) -> Dict[str, Any]:
-    system_prompt = ""
+) -> Tuple[str, str, str, type[BaseModel]]:
+    """
+    Build the request for one file: (system, user, source_code, text_format).
+    `source_code` is appended to the returned instruction (SAW only).
+    """
     if lang == "cryptol":
         # Existing Cryptol branch
         user, _ = build_user_prompt(filename, lang, code, input_mode=input_mode)
-        system_prompt = sft_cryptol.SYSTEM_PROMPT_CRYPTOL
-        result = call_openai_structured(
-            model,
-            system_prompt,
-            user,
-            text_format=AlpacaRow,
-        )
-        return result
+        return sft_cryptol.SYSTEM_PROMPT_CRYPTOL, user, "", AlpacaRow
 
     elif lang == "text":
         # NEW: scraped Markdown web page -> multiple Q&A pairs
@@ -407,49 +436,266 @@ def build_prompt_call_openai_structured(
             f"{code}\n"
             "-----8<----- END PAGE (Markdown) -----8<-----\n"
         )
-        system_prompt = SYSTEM_PROMPT_QA
         # Return Q&A array: { "qa_pairs": [ { "question": ..., "answer": ... }, ... ] }
-        result = call_openai_structured(
-            model,
-            system_prompt,
-            user,
-            text_format=QAPairList,
-        )
-        return result
+        return SYSTEM_PROMPT_QA, user, "", QAPairList
 
     else:
         # Existing SAW (or other) branch
         user, source_code, _ = sft_saw.build_user_prompt(filename, code)
-        system_prompt = sft_saw.SYSTEM_PROMPT
-        result = call_openai_structured(
-            model,
-            system_prompt,
-            user,
-            source_code=source_code,
-            text_format=AlpacaRow,
-        )
+        return sft_saw.SYSTEM_PROMPT, user, source_code, AlpacaRow
+
+def build_prompt_call_openai_structured(
+    model: str,
+    input_mode: str,
+    filename: str,
+    lang: str,
+    code: str,
+) -> Dict[str, Any]:
+    system_prompt, user, source_code, text_format = build_prompt(input_mode, filename, lang, code)
+    return call_openai_structured(
+        model,
+        system_prompt,
+        user,
+        source_code=source_code,
+        text_format=text_format,
+    )
+
+# ----- Async engine -----
+class TokenBucket:
+    """
+    Continuously refilled bucket of `rate_per_min` units per minute, holding at most
+    one minute's worth. `acquire(n)` waits until n units are available.
+    """
+
+    def __init__(self, rate_per_min: float):
+        self.rate = rate_per_min / 60.0
+        self.capacity = float(rate_per_min)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1.0) -> None:
+        # A single request larger than the bucket could never fit; let it drain the bucket.
+        n = min(n, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def debit(self, n: float) -> None:
+        """Charge units after the fact (e.g. actual usage above the estimate); may go negative."""
+        self._refill()
+        self.tokens -= n
+
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min buckets plus a shared pause that a 429 sets for all
+    in-flight workers, so one `retry-after` backs off the whole engine.
+    """
+
+    def __init__(self, requests_per_min: Optional[float] = None, tokens_per_min: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_min) if requests_per_min else None
+        self.tokens = TokenBucket(tokens_per_min) if tokens_per_min else None
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int) -> None:
+        while True:
+            delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(tokens)
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        if self.tokens is not None and actual is not None and actual > estimated:
+            self.tokens.debit(actual - estimated)
+
+
+async def acall_openai_structured(
+    client,
+    limiter: RateLimiter,
+    model: str,
+    system: str,
+    user: str,
+    source_code: str = "",
+    text_format: type[BaseModel] = AlpacaRow,
+    max_retries: int = 6,
+    output_tokens_estimate: int = 0,
+) -> Dict[str, Any]:
+    """Async counterpart of call_openai_structured, paced by `limiter`."""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+    tokens = count_tokens_for_messages(messages)
+    estimated = tokens + output_tokens_estimate
+    for attempt in range(1, max_retries + 1):
+        await limiter.acquire(estimated)
+        try:
+            response = await client.responses.parse(
+                model=route_model(model, tokens),
+                input=messages,
+                text_format=text_format,
+                tools=FILE_SEARCH_TOOLS,
+            )
+            usage = getattr(response, "usage", None)
+            limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            return _parse_response(response, source_code)
+        except RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            wait_seconds = retry_after_seconds(e, attempt)
+            print(f"[warn] Rate limit hit, pausing {wait_seconds:.2f}s before retry #{attempt+1}: {e}")
+            limiter.pause(wait_seconds)
+        except (APIConnectionError, APIStatusError) as e:
+            status = getattr(e, "status_code", None)
+            if attempt == max_retries or (status is not None and status < 500 and status != 409):
+                raise
+            await asyncio.sleep(BACKOFF_BASE ** attempt)
+
+async def _agenerate(
+    rows: List[Dict[str, Any]],
+    model: str,
+    input_mode: str,
+    cache: FileKVCache,
+    max_concurrency: int,
+    requests_per_min: Optional[float],
+    tokens_per_min: Optional[float],
+    max_retries: int,
+    output_tokens_estimate: int,
+) -> List[Any]:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI()
+    limiter = RateLimiter(requests_per_min, tokens_per_min)
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+    done = 0
+
+    async def one(row: Dict[str, Any]) -> Dict[str, Any]:
+        nonlocal done
+        key = row["filename"]
+        async with sem:
+            cached = cache.get(key)
+            if cached is not False:
+                return cached
+            system, user, source_code, text_format = build_prompt(
+                input_mode, row["filename"], row["filetype"], row["content"],
+            )
+            result = await acall_openai_structured(
+                client, limiter, model, system, user,
+                source_code=source_code,
+                text_format=text_format,
+                max_retries=max_retries,
+                output_tokens_estimate=output_tokens_estimate,
+            )
+        # Persist as soon as it lands so an interrupted run keeps its progress.
+        await asyncio.to_thread(cache.set, key, result)
+        done += 1
+        if done % 50 == 0:
+            print(f"[info] {done} new results cached")
         return result
 
+    # One task per distinct filename; duplicate rows share its result.
+    tasks: Dict[str, asyncio.Task] = {}
+    for row in rows:
+        if row["filename"] not in tasks:
+            tasks[row["filename"]] = asyncio.ensure_future(one(row))
+    try:
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+    finally:
+        await client.close()
+    return [
+        tasks[row["filename"]].exception() or tasks[row["filename"]].result()
+        for row in rows
+    ]
+
+def _run_coroutine(coro):
+    """asyncio.run, or run it on a helper thread if this thread already has a loop (notebooks)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
 def iter_call_openai_structured(
     input_df: pd.DataFrame,
     model: str,
     input_mode: str,
-    file_cache_path: str
+    file_cache_path: str,
+    max_workers: int = 1,
+    requests_per_min: Optional[float] = None,
+    tokens_per_min: Optional[float] = None,
+    max_retries: int = 6,
+    output_tokens_estimate: int = 0,
+    skip_errors: bool = False,
 ) -> Iterable[Dict[str, Any]]:
+    """
+    Generate (or load from cache) one structured result per row, keyed by filename.
+
+    With max_workers == 1 and no rate limits, misses are sent one at a time on the
+    synchronous client. Otherwise an asyncio engine keeps up to `max_workers` requests
+    in flight, paced by `requests_per_min` / `tokens_per_min` (prompt tokens via
+    count_tokens_for_messages, plus `output_tokens_estimate`), retrying on 429/5xx.
+    Each result is written to the cache as it finishes.
+
+    If any request still fails, the first error is raised after the others complete
+    (their results are already cached); with skip_errors=True those rows are dropped.
+    """
     fileKVCache = FileKVCache(file_cache_path)
-    returned_rows = []
-    for _, row in input_df.iterrows():
-        result = fileKVCache.get_or_call(
-            row['filename'],
+    rows = [row for _, row in input_df.iterrows()]
+    if max_workers <= 1 and requests_per_min is None and tokens_per_min is None:
+        results = fileKVCache.map_or_call(
+            [row['filename'] for row in rows],
             build_prompt_call_openai_structured,
-            {
-                "model": model,
-                "input_mode": input_mode,
-                "filename": row['filename'],
-                "lang": row['filetype'],
-                "code": row['content'],
-            }
+            [
+                {
+                    "model": model,
+                    "input_mode": input_mode,
+                    "filename": row['filename'],
+                    "lang": row['filetype'],
+                    "code": row['content'],
+                }
+                for row in rows
+            ],
+            max_workers=1,
         )
+    else:
+        results = _run_coroutine(_agenerate(
+            [row.to_dict() for row in rows],
+            model,
+            input_mode,
+            fileKVCache,
+            max_concurrency=max_workers,
+            requests_per_min=requests_per_min,
+            tokens_per_min=tokens_per_min,
+            max_retries=max_retries,
+            output_tokens_estimate=output_tokens_estimate,
+        ))
+        errors = [(row['filename'], r) for row, r in zip(rows, results) if isinstance(r, BaseException)]
+        if errors:
+            print(f"[warn] {len(errors)} of {len(rows)} requests failed (first: {errors[0][0]}: {errors[0][1]})")
+            if not skip_errors:
+                raise errors[0][1]
+    returned_rows = []
+    for row, result in zip(rows, results):
+        if isinstance(result, BaseException):
+            continue
         returned_rows.append({
             "filename": row['filename'],
             "filetype": row['filetype'],
@@ -459,5 +705,350 @@ def iter_call_openai_structured(
         })
     return pd.DataFrame(returned_rows)
 
+# ----- Batch API mode -----
+BATCH_ENDPOINT = "/v1/responses"
+BATCH_MANIFEST = "batches.json"
+BATCH_MAX_REQUESTS = 50_000          # Batch API limit per input file
+BATCH_MAX_BYTES = 190 * 1024 * 1024  # stay under the 200 MB upload limit
+TEXT_FORMATS = {"AlpacaRow": AlpacaRow, "QAPairList": QAPairList}
+
+def _strict_schema(node: Any) -> Any:
+    """Make a pydantic JSON schema acceptable to strict structured outputs."""
+    if isinstance(node, list):
+        return [_strict_schema(v) for v in node]
+    if not isinstance(node, dict):
+        return node
+    out = {}
+    for k, v in node.items():
+        if k == "title":
+            continue
+        if k in ("properties", "$defs"):
+            out[k] = {name: _strict_schema(sub) for name, sub in v.items()}
+        else:
+            out[k] = _strict_schema(v)
+    if out.get("type") == "object" and "properties" in out:
+        out["required"] = list(out["properties"].keys())
+        out["additionalProperties"] = False
+    return out
+
+def batch_request_line(
+    custom_id: str,
+    model: str,
+    system: str,
+    user: str,
+    text_format: type[BaseModel],
+) -> Dict[str, Any]:
+    """One Batch API request equivalent to call_openai_structured(model, system, user, text_format=...)."""
+    tokens = count_tokens_for_messages([
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ])
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": route_model(model, tokens),
+            "input": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            "text": {
+                "format": {
+                    "type": "json_schema",
+                    "name": text_format.__name__,
+                    "schema": _strict_schema(text_format.model_json_schema()),
+                    "strict": True,
+                }
+            },
+            "tools": FILE_SEARCH_TOOLS,
+        },
+    }
+
+def _read_batch_manifest(out_dir: Path) -> Dict[str, Any]:
+    with open(out_dir / BATCH_MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_batch_manifest(out_dir: Path, manifest: Dict[str, Any]) -> None:
+    tmp = out_dir / (BATCH_MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, out_dir / BATCH_MANIFEST)
+
+def prepare_batches(
+    input_df: pd.DataFrame,
+    model: str,
+    input_mode: str,
+    out_dir: str,
+    file_cache_path: Optional[str] = None,
+    max_requests: int = BATCH_MAX_REQUESTS,
+    max_bytes: int = BATCH_MAX_BYTES,
+) -> List[Path]:
+    """
+    Write Batch API request files for every row not already in the cache.
+
+    out_dir/batch-00000.jsonl          requests (custom_id = filename)
+    out_dir/batch-00000.meta.jsonl     {custom_id, text_format, source_code} for collection
+    out_dir/batches.json               manifest updated by submit/collect
+
+    Files are split at `max_requests` lines or `max_bytes` bytes, whichever comes first.
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    if (out / BATCH_MANIFEST).exists():
+        running = [b["batch_id"] for b in _read_batch_manifest(out)["batches"]
+                   if b.get("batch_id") and not b.get("collected")]
+        if running:
+            raise ValueError(f"{out} has submitted batches not yet collected: {running}")
+    cache = FileKVCache(file_cache_path) if file_cache_path else None
+
+    batches: List[Dict[str, Any]] = []
+    req_f = meta_f = None
+    n_req = n_bytes = 0
+    seen = set()
+
+    def _open_next():
+        nonlocal req_f, meta_f, n_req, n_bytes
+        if req_f is not None:
+            req_f.close()
+            meta_f.close()
+        name = f"batch-{len(batches):05d}"
+        req_f = open(out / f"{name}.jsonl", "w", encoding="utf-8")
+        meta_f = open(out / f"{name}.meta.jsonl", "w", encoding="utf-8")
+        batches.append({"requests": f"{name}.jsonl", "meta": f"{name}.meta.jsonl", "n": 0})
+        n_req = n_bytes = 0
+
+    try:
+        for _, row in input_df.iterrows():
+            key = row["filename"]
+            if key in seen or (cache is not None and cache.has(key)):
+                continue
+            seen.add(key)
+            system, user, source_code, text_format = build_prompt(
+                input_mode, row["filename"], row["filetype"], row["content"],
+            )
+            line = json.dumps(batch_request_line(key, model, system, user, text_format), ensure_ascii=False) + "\n"
+            size = len(line.encode("utf-8"))
+            if req_f is None or n_req >= max_requests or (n_req > 0 and n_bytes + size > max_bytes):
+                _open_next()
+            req_f.write(line)
+            meta_f.write(json.dumps({
+                "custom_id": key,
+                "text_format": text_format.__name__,
+                "source_code": source_code,
+            }, ensure_ascii=False) + "\n")
+            n_req += 1
+            n_bytes += size
+            batches[-1]["n"] = n_req
+    finally:
+        if req_f is not None:
+            req_f.close()
+            meta_f.close()
+
+    _write_batch_manifest(out, {"version": 1, "model": model, "batches": batches})
+    print(f"[info] Wrote {sum(b['n'] for b in batches)} requests in {len(batches)} batch file(s) to {out}")
+    return [out / b["requests"] for b in batches]
+
+def submit_batches(out_dir: str, client=None, completion_window: str = "24h") -> List[Dict[str, Any]]:
+    """Upload and start every prepared batch in `out_dir` that has not been submitted yet."""
+    out = Path(out_dir)
+    client = client or get_openai_client()
+    manifest = _read_batch_manifest(out)
+    for b in manifest["batches"]:
+        if b.get("batch_id"):
+            continue
+        with open(out / b["requests"], "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=completion_window,
+        )
+        b["input_file_id"] = uploaded.id
+        b["batch_id"] = batch.id
+        b["status"] = batch.status
+        # Save after each submission so a failure midway doesn't resubmit finished ones.
+        _write_batch_manifest(out, manifest)
+        print(f"[info] Submitted {b['requests']} as {batch.id}")
+    return manifest["batches"]
+
+def _output_text(body: Dict[str, Any]) -> Optional[str]:
+    for item in body.get("output") or []:
+        if item.get("type") != "message":
+            continue
+        for part in item.get("content") or []:
+            if part.get("type") == "output_text":
+                return part.get("text")
+    return None
+
+def _file_text(content) -> str:
+    text = getattr(content, "text", None)
+    if text is None:
+        text = content.read() if hasattr(content, "read") else content
+    if callable(text):
+        text = text()
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return text
+
+def ingest_batch_results(
+    results_text: str,
+    meta: Dict[str, Dict[str, Any]],
+    cache: FileKVCache,
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Parse a Batch API output file and store each successful result in `cache` under its
+    custom_id, shaped exactly like call_openai_structured's return value.
+    Returns (number stored, list of failures).
+    """
+    stored = 0
+    failures: List[Dict[str, Any]] = []
+    for line in results_text.splitlines():
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        custom_id = rec.get("custom_id")
+        response = rec.get("response") or {}
+        if rec.get("error") or response.get("status_code") != 200:
+            failures.append({"custom_id": custom_id, "error": rec.get("error") or response.get("body")})
+            continue
+        info = meta.get(custom_id, {})
+        text_format = TEXT_FORMATS.get(info.get("text_format"), AlpacaRow)
+        try:
+            parsed = text_format.model_validate_json(_output_text(response["body"]) or "").model_dump()
+        except Exception as e:
+            failures.append({"custom_id": custom_id, "error": f"{type(e).__name__}: {e}"})
+            continue
+        source_code = info.get("source_code") or ""
+        if source_code and "instruction" in parsed:
+            parsed["instruction"] += f"\n\n# Source code:\n{source_code}"
+        cache.set(custom_id, parsed)
+        stored += 1
+    return stored, failures
+
+def collect_batches(
+    out_dir: str,
+    file_cache_path: str,
+    client=None,
+    wait: bool = False,
+    poll_interval: float = 60.0,
+) -> Dict[str, int]:
+    """
+    Download finished batches from `out_dir` into the FileKVCache at `file_cache_path`.
+    Failed requests are written to <batch>.errors.jsonl; re-running prepare_batches with the
+    same cache produces requests for exactly those rows.
+    With wait=True, polls until every submitted batch reaches a terminal state.
+    """
+    out = Path(out_dir)
+    client = client or get_openai_client()
+    cache = FileKVCache(file_cache_path)
+    manifest = _read_batch_manifest(out)
+    totals = {"stored": 0, "failed": 0, "pending": 0}
+    terminal = {"completed", "failed", "expired", "cancelled"}
+
+    while True:
+        pending = 0
+        for b in manifest["batches"]:
+            if not b.get("batch_id") or b.get("collected"):
+                continue
+            batch = client.batches.retrieve(b["batch_id"])
+            b["status"] = batch.status
+            if batch.status not in terminal:
+                pending += 1
+                continue
+            meta: Dict[str, Dict[str, Any]] = {}
+            with open(out / b["meta"], "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        m = json.loads(line)
+                        meta[m["custom_id"]] = m
+            failures: List[Dict[str, Any]] = []
+            if getattr(batch, "output_file_id", None):
+                stored, failures = ingest_batch_results(
+                    _file_text(client.files.content(batch.output_file_id)), meta, cache,
+                )
+                totals["stored"] += stored
+            if getattr(batch, "error_file_id", None):
+                for line in _file_text(client.files.content(batch.error_file_id)).splitlines():
+                    if line.strip():
+                        rec = json.loads(line)
+                        failures.append({"custom_id": rec.get("custom_id"), "error": rec.get("error") or rec.get("response")})
+            if failures:
+                errors_path = out / b["requests"].replace(".jsonl", ".errors.jsonl")
+                with open(errors_path, "w", encoding="utf-8") as f:
+                    for fail in failures:
+                        f.write(json.dumps(fail, ensure_ascii=False) + "\n")
+                print(f"[warn] {len(failures)} failed request(s) in {b['batch_id']} -> {errors_path}")
+            totals["failed"] += len(failures)
+            b["collected"] = True
+            _write_batch_manifest(out, manifest)
+        _write_batch_manifest(out, manifest)
+        totals["pending"] = pending
+        if not wait or pending == 0:
+            break
+        print(f"[info] {pending} batch(es) still running; checking again in {poll_interval:.0f}s")
+        time.sleep(poll_interval)
+
+    cache.flush()
+    print(f"[info] Collected {totals['stored']} results, {totals['failed']} failed, {totals['pending']} batch(es) pending")
+    return totals
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Generate SFT instructions with the OpenAI API (online or Batch API).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def _common_input(p):
+        p.add_argument("--input", required=True, help="JSONL (plain or sharded) with filename, filetype, content, set")
+        p.add_argument("--model", default=DEFAULT_MODEL)
+        p.add_argument("--input-mode", default="none", choices=["none", "excerpt", "full"])
+
+    p_gen = sub.add_parser("generate", help="Call the API directly and write the results")
+    _common_input(p_gen)
+    p_gen.add_argument("--out", required=True, help="Output JSONL")
+    p_gen.add_argument("--cache", required=True, help="FileKVCache path")
+    p_gen.add_argument("--workers", type=int, default=8, help="Max in-flight requests")
+    p_gen.add_argument("--rpm", type=float, default=None, help="Requests per minute limit")
+    p_gen.add_argument("--tpm", type=float, default=None, help="Tokens per minute limit")
+    p_gen.add_argument("--skip-errors", action="store_true")
+
+    p_prep = sub.add_parser("prepare", help="Write Batch API request files for rows not yet cached")
+    _common_input(p_prep)
+    p_prep.add_argument("--batch-dir", required=True)
+    p_prep.add_argument("--cache", default=None, help="Skip rows already in this FileKVCache")
+    p_prep.add_argument("--max-requests", type=int, default=BATCH_MAX_REQUESTS)
+    p_prep.add_argument("--max-mb", type=float, default=BATCH_MAX_BYTES / (1024 * 1024))
+
+    p_sub = sub.add_parser("submit", help="Upload and start prepared batches")
+    p_sub.add_argument("--batch-dir", required=True)
+
+    p_col = sub.add_parser("collect", help="Ingest finished batch results into the cache")
+    p_col.add_argument("--batch-dir", required=True)
+    p_col.add_argument("--cache", required=True)
+    p_col.add_argument("--wait", action="store_true", help="Poll until all batches finish")
+    p_col.add_argument("--poll-interval", type=float, default=60.0)
+
+    args = ap.parse_args(argv)
+    if args.cmd == "generate":
+        df = iter_call_openai_structured(
+            read_dataframe(args.input), args.model, args.input_mode, args.cache,
+            max_workers=args.workers,
+            requests_per_min=args.rpm,
+            tokens_per_min=args.tpm,
+            skip_errors=args.skip_errors,
+        )
+        write_jsonl(df.to_dict(orient="records"), args.out)
+        print(f"[info] Wrote {len(df)} rows to {args.out}")
+    elif args.cmd == "prepare":
+        prepare_batches(
+            read_dataframe(args.input), args.model, args.input_mode, args.batch_dir,
+            file_cache_path=args.cache,
+            max_requests=args.max_requests,
+            max_bytes=int(args.max_mb * 1024 * 1024),
+        )
+    elif args.cmd == "submit":
+        submit_batches(args.batch_dir)
+    elif args.cmd == "collect":
+        collect_batches(args.batch_dir, args.cache, wait=args.wait, poll_interval=args.poll_interval)
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    main()
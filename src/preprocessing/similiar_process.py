@@ -6,11 +6,22 @@ import os
 import sys
 import re
 import json
-from typing import Dict, Tuple, Iterable, Optional, List
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Tuple, Iterable, Optional, List, Sequence
 
 import numpy as np
 import pandas as pd
 from datasketch import MinHash, MinHashLSH
+from datasketch.hashfunc import sha1_hash32
+try:
+    from datasketch.hashfunc import sha1_hash64
+except ImportError:  # older datasketch only has the 32-bit variant
+    sha1_hash64 = None
+
+from src.util import cryptol_tokenizer
+from src.util.code_parser import canonical_key
 
 # ---------- defaults (configurable via run_from_dataframe args) ----------
 DEFAULT_NUM_PERM      = 512
@@ -18,38 +29,15 @@ DEFAULT_K_SHINGLE     = 5
 DEFAULT_LSH_THRESHOLD = 0.70
 DEFAULT_TOP_N_PRINT   = 20
 DEFAULT_OUT_DIR       = "minhash_outputs"
+DEFAULT_MINHASH_SEED  = 1      # datasketch's default; signatures are only comparable for equal seeds
+MINHASH_BATCH         = 4096   # shingles per update_batch call (bounds the batch x num_perm temp matrix)
 
 # ---------- helpers ----------
-def tokenize(code: str) -> List[str]:
-    # strip line & block comments
-    code = re.sub(r'--.*?$|//.*?$|/\*.*?\*/', '', code, flags=re.S | re.M)
-
-    token_pat = re.compile(r"""
-        # ---------- literals ----------
-        0x[0-9A-Fa-f]+            |   # hex
-        0b[01]+                   |   # binary
-        0o[0-7]+                  |   # octal
-        \d+                       |   # decimal
-        "(?:[^"\\]|\\.)*"        |   # strings (basic escapes)
-
-        # ---------- identifiers ----------
-        [A-Za-z_][A-Za-z_0-9']*   |   # allow prime in names (e.g., SubByte')
-
-        # ---------- multi-char operators (order matters: longest first) ----------
-        <<< | >>> | << | >>       |   # shifts/rotates
-        \^\^                      |   # polynomial/exponent
-        ::  | ->  | == | <= | >=  |   # comparisons/arrows
-        !=  | <-  | \.\. | \.\.\. |   # not-equal, generator, ranges
-        <\| | \|>                  |  # polynomial delimiters
-
-        # ---------- single-char punctuation / operators ----------
-        [{}()\[\];,:\.@!#\^+\-*/=<>\|`]
-    """, re.X)
-
-    toks = token_pat.findall(code)
-    return toks
-
-def shingles(tokens: List[str], k: int = 5) -> set:
+def tokenize(code: str) -> Tuple[str, ...]:
+    # single-pass, memoized tokenizer shared with quality_process / dataset_builder
+    return cryptol_tokenizer.tokenize(code)
+
+def shingles(tokens: Sequence[str], k: int = 5) -> set:
     n = len(tokens)
     if n < k:
         return set()
@@ -65,6 +53,427 @@ def to_minhash(sigset: Iterable[str], num_perm: int) -> MinHash:
         m.update(s.encode("utf-8"))
     return m
 
+# ---------- vectorized MinHash ----------
+# Same signatures as to_minhash, but each shingle is SHA1-hashed once into a uint64 array and
+# the permutations are applied with datasketch's own vectorized update_batch, in batches.
+
+def _prehashed(x):
+    return x
+
+def shingle_hashes(sigset: Iterable[str]) -> np.ndarray:
+    """
+    Sorted, unique uint64 hashes of the shingles: the first 8 bytes (little-endian) of each
+    shingle's SHA1. The low 32 bits are exactly datasketch's sha1_hash32 of the shingle.
+    """
+    sha1 = hashlib.sha1
+    buf = b"".join([sha1(s.encode("utf-8")).digest()[:8] for s in sigset])
+    return np.unique(np.frombuffer(buf, dtype="<u8").astype(np.uint64))
+
+@functools.lru_cache(maxsize=None)
+def _minhash_template(num_perm: int, seed: int) -> Tuple[MinHash, int]:
+    """Empty MinHash (permutations generated once per (num_perm, seed)) and its hash width."""
+    ref = MinHash(num_perm=num_perm, seed=seed)
+    if ref.hashfunc is sha1_hash32:
+        return ref, 32
+    if sha1_hash64 is not None and ref.hashfunc is sha1_hash64:
+        return ref, 64
+    raise ValueError(f"Unsupported default MinHash hashfunc: {ref.hashfunc!r}")
+
+def minhash_from_hashes(hashes: np.ndarray, num_perm: int, seed: int = DEFAULT_MINHASH_SEED) -> MinHash:
+    """MinHash of shingle_hashes(S); bit-identical to to_minhash(S, num_perm) for seed=1."""
+    ref, bits = _minhash_template(num_perm, seed)
+    m = ref.copy()
+    if len(hashes):
+        hv = hashes & np.uint64(0xFFFFFFFF) if bits == 32 else hashes
+        m.hashfunc = _prehashed
+        try:
+            for i in range(0, len(hv), MINHASH_BATCH):
+                m.update_batch(hv[i:i + MINHASH_BATCH].tolist())
+        finally:
+            m.hashfunc = ref.hashfunc
+    return m
+
+def _minhash_chunk(args) -> List[Tuple[np.ndarray, np.ndarray]]:
+    sigsets, num_perm, seed = args
+    out = []
+    for S in sigsets:
+        h = shingle_hashes(S)
+        out.append((h, minhash_from_hashes(h, num_perm, seed).hashvalues))
+    return out
+
+def batch_signatures(
+    sigsets: List[Iterable[str]],
+    num_perm: int,
+    seed: int = DEFAULT_MINHASH_SEED,
+    workers: int = 1,
+    chunksize: int = 64,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Shingle hashes and MinHash signatures for every set in `sigsets` (same order), fanning
+    chunks of files out over a process pool when workers > 1.
+
+    Returns (hashes, signatures): per-file sorted uint64 shingle hashes, and an
+    (n, num_perm) uint64 matrix whose rows match to_minhash(S, num_perm).hashvalues.
+    """
+    chunks = [(sigsets[i:i + chunksize], num_perm, seed) for i in range(0, len(sigsets), chunksize)]
+    if workers <= 1 or len(chunks) <= 1:
+        results = [r for c in chunks for r in _minhash_chunk(c)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = [r for rs in ex.map(_minhash_chunk, chunks) for r in rs]
+    hashes = [h for h, _ in results]
+    sigs = np.array([hv for _, hv in results], dtype=np.uint64).reshape(len(results), num_perm)
+    return hashes, sigs
+
+def batch_minhash(
+    sigsets: List[Iterable[str]],
+    num_perm: int,
+    seed: int = DEFAULT_MINHASH_SEED,
+    workers: int = 1,
+    chunksize: int = 64,
+) -> List[MinHash]:
+    """MinHash objects for every set in `sigsets`; output matches to_minhash per set."""
+    _, sigs = batch_signatures(sigsets, num_perm, seed=seed, workers=workers, chunksize=chunksize)
+    return [signature_to_minhash(hv, num_perm, seed) for hv in sigs]
+
+def signature_to_minhash(hashvalues: np.ndarray, num_perm: int, seed: int = DEFAULT_MINHASH_SEED) -> MinHash:
+    ref, _ = _minhash_template(num_perm, seed)
+    m = ref.copy()
+    m.hashvalues = np.asarray(hashvalues).astype(ref.hashvalues.dtype)
+    return m
+
+def hashed_jaccard(a: np.ndarray, b: np.ndarray) -> Tuple[float, int, int]:
+    """(jaccard, intersection, union) of two sorted, unique shingle-hash arrays."""
+    inter = len(np.intersect1d(a, b, assume_unique=True))
+    union = len(a) + len(b) - inter
+    return ((inter / union) if union else 0.0), inter, union
+
+def _pair_row(a: str, b: str, ha: np.ndarray, hb: np.ndarray) -> Dict:
+    s, inter, union = hashed_jaccard(ha, hb)
+    return {
+        "a": a,
+        "b": b,
+        "jaccard": s,
+        "a_shingles": len(ha),
+        "b_shingles": len(hb),
+        "union_shingles": union,
+        "intersect_shingles": inter,
+    }
+
+def _estimated_pair_row(a: str, b: str, la: int, lb: int, est: float) -> Dict:
+    inter = int(round(est * (la + lb) / (1.0 + est)))
+    return {
+        "a": a,
+        "b": b,
+        "jaccard": est,
+        "a_shingles": la,
+        "b_shingles": lb,
+        "union_shingles": la + lb - inter,
+        "intersect_shingles": inter,
+    }
+
+def _verify_chunk(pairs, get_hashes, get_sig, accept_above) -> List[Dict]:
+    rows = []
+    for a, b in pairs:
+        ha, hb = get_hashes(a), get_hashes(b)
+        if accept_above is not None and len(ha) and len(hb):  # empty sets all share one signature
+            est = float(np.mean(get_sig(a) == get_sig(b)))
+            if est >= accept_above:
+                row = _estimated_pair_row(a, b, len(ha), len(hb), est)
+                row["estimated"] = True
+                rows.append(row)
+                continue
+        row = _pair_row(a, b, ha, hb)
+        if accept_above is not None:
+            row["estimated"] = False
+        rows.append(row)
+    return rows
+
+def verify_pairs(
+    pairs: List[Tuple[str, str]],
+    get_hashes: Callable[[str], np.ndarray],
+    get_sig: Optional[Callable[[str], np.ndarray]] = None,
+    workers: int = 1,
+    chunksize: int = 2048,
+    accept_above: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Exact Jaccard rows for candidate (a, b) pairs, in input order, from sorted shingle-hash
+    arrays. Chunks of pairs run on a thread pool when workers > 1 (numpy's sort and
+    intersection release the GIL). With `accept_above`, pairs whose MinHash estimate is at
+    least that value skip the exact check; their counts are derived from the estimate and
+    rows carry estimated=True.
+    """
+    if accept_above is not None and get_sig is None:
+        raise ValueError("accept_above needs get_sig to compute MinHash estimates")
+    chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+    if workers <= 1 or len(chunks) <= 1:
+        return [r for c in chunks for r in _verify_chunk(c, get_hashes, get_sig, accept_above)]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        results = ex.map(lambda c: _verify_chunk(c, get_hashes, get_sig, accept_above), chunks)
+        return [r for rs in results for r in rs]
+
+# ---------- persistent LSH index ----------
+LSH_INDEX_VERSION = 2  # 2: signatures from the shared single-pass tokenizer
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME  = np.uint64(0x100000001B3)
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows per band) that MinHashLSH picks for this threshold and num_perm."""
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    return lsh.b, lsh.r
+
+def band_keys(sigs: np.ndarray, b: int, r: int) -> np.ndarray:
+    """(n, num_perm) signatures -> (n, b) uint64 bucket keys (FNV-1a over each band's values)."""
+    sigs = np.atleast_2d(np.asarray(sigs, dtype=np.uint64))
+    bands = sigs[:, : b * r].reshape(len(sigs), b, r)
+    keys = np.full((len(sigs), b), _FNV_OFFSET, dtype=np.uint64)
+    for i in range(r):
+        keys ^= bands[:, :, i]
+        keys *= _FNV_PRIME
+    return keys
+
+def _content_sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+class LSHIndex:
+    """
+    MinHash LSH index persisted under `index_dir` and grown one segment per add().
+
+    Each segment is a set of .npy files, memory-mapped on read:
+      seg-NNNNN.sig.npy       (rows, num_perm) MinHash signatures
+      seg-NNNNN.keys.npy      (b, rows) band keys, sorted per band
+      seg-NNNNN.order.npy     (b, rows) segment row of each sorted key
+      seg-NNNNN.shingles.npy  all rows' sorted shingle hashes, concatenated
+      seg-NNNNN.offsets.npy   (rows + 1,) start of each row in shingles.npy
+    meta.json holds the parameters, the segment list and, per filename, its row, content
+    sha1 and token/shingle counts. A changed file is signed into a new row; the old row
+    is ignored until compact() rewrites the index as a single segment.
+
+    Bands use MinHashLSH's (b, r) for the same threshold and num_perm, so query() returns
+    the candidates an in-memory MinHashLSH would (plus the rare 64-bit key collision).
+    An index written under another LSH_INDEX_VERSION (e.g. with older tokens) is refused.
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        num_perm: int = DEFAULT_NUM_PERM,
+        threshold: float = DEFAULT_LSH_THRESHOLD,
+        k_shingle: int = DEFAULT_K_SHINGLE,
+        seed: int = DEFAULT_MINHASH_SEED,
+    ):
+        self.dir = index_dir
+        self.meta_path = os.path.join(index_dir, "meta.json")
+        params = {"num_perm": num_perm, "threshold": threshold, "k_shingle": k_shingle, "seed": seed}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != LSH_INDEX_VERSION:
+                raise ValueError(f"Unsupported LSH index version in {self.meta_path}: {meta.get('version')!r} "
+                                 f"(expected {LSH_INDEX_VERSION}; delete {index_dir} to rebuild it)")
+            stored = {k: meta.get(k) for k in params}
+            if stored != params:
+                raise ValueError(f"LSH index {index_dir} was built with {stored}, not {params}")
+            self.meta = meta
+        else:
+            b, r = lsh_params(threshold, num_perm)
+            self.meta = {"version": LSH_INDEX_VERSION, **params, "b": b, "r": r,
+                         "rows": 0, "next_segment": 0, "segments": [], "files": {}}
+        self.num_perm = num_perm
+        self.k_shingle = k_shingle
+        self.seed = seed
+        self.b, self.r = self.meta["b"], self.meta["r"]
+        self._arrays: Dict[str, Dict[str, np.ndarray]] = {}
+        self._row_files: Optional[List[Optional[str]]] = None
+
+    # --- lookups ---
+    def __len__(self) -> int:
+        return len(self.meta["files"])
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.meta["files"]
+
+    def filenames(self) -> List[str]:
+        return list(self.meta["files"])
+
+    def info(self, filename: str) -> Dict:
+        """{'row', 'sha1', 'num_tokens', 'num_shingles'} for an indexed file."""
+        return self.meta["files"][filename]
+
+    def _segment(self, seg: Dict) -> Dict[str, np.ndarray]:
+        arrs = self._arrays.get(seg["name"])
+        if arrs is None:
+            base = os.path.join(self.dir, seg["name"])
+            arrs = {part: np.load(f"{base}.{part}.npy", mmap_mode="r")
+                    for part in ("sig", "keys", "order", "shingles", "offsets")}
+            self._arrays[seg["name"]] = arrs
+        return arrs
+
+    def _locate(self, row: int) -> Tuple[Dict[str, np.ndarray], int]:
+        for seg in self.meta["segments"]:
+            if seg["start"] <= row < seg["start"] + seg["rows"]:
+                return self._segment(seg), row - seg["start"]
+        raise KeyError(row)
+
+    def signature(self, filename: str) -> np.ndarray:
+        arrs, i = self._locate(self.info(filename)["row"])
+        return np.asarray(arrs["sig"][i])
+
+    def shingle_hashes(self, filename: str) -> np.ndarray:
+        arrs, i = self._locate(self.info(filename)["row"])
+        off = arrs["offsets"]
+        return np.asarray(arrs["shingles"][off[i]:off[i + 1]])
+
+    def minhash(self, filename: str) -> MinHash:
+        return signature_to_minhash(self.signature(filename), self.num_perm, self.seed)
+
+    def _row_to_file(self) -> List[Optional[str]]:
+        if self._row_files is None:
+            rows: List[Optional[str]] = [None] * self.meta["rows"]
+            for f, info in self.meta["files"].items():
+                rows[info["row"]] = f
+            self._row_files = rows
+        return self._row_files
+
+    def query(self, item) -> List[str]:
+        """
+        Indexed filenames sharing at least one band with `item`: an indexed filename
+        (excluded from its own result), a MinHash, or a signature array.
+        """
+        exclude = None
+        if isinstance(item, str):
+            sig, exclude = self.signature(item), item
+        elif isinstance(item, MinHash):
+            sig = item.hashvalues
+        else:
+            sig = np.asarray(item)
+        keys = band_keys(sig, self.b, self.r)[0]
+        hits = []
+        for seg in self.meta["segments"]:
+            arrs = self._segment(seg)
+            K, O = arrs["keys"], arrs["order"]
+            for j in range(self.b):
+                lo = np.searchsorted(K[j], keys[j], side="left")
+                hi = np.searchsorted(K[j], keys[j], side="right")
+                if hi > lo:
+                    hits.append(np.asarray(O[j, lo:hi]) + seg["start"])
+        if not hits:
+            return []
+        row_files = self._row_to_file()
+        out = []
+        for row in np.unique(np.concatenate(hits)):
+            f = row_files[row]
+            if f is not None and f != exclude:
+                out.append(f)
+        return out
+
+    # --- updates ---
+    def add(self, corpus: Dict[str, str], workers: int = 1) -> List[str]:
+        """
+        Sign and insert files of {filename -> text} that are new or whose content changed
+        since they were indexed. Returns those filenames; unchanged files are not touched.
+        """
+        todo: Dict[str, str] = {}
+        for path, text in corpus.items():
+            info = self.meta["files"].get(path)
+            h = _content_sha1(text)
+            if info is None or info["sha1"] != h:
+                todo[path] = h
+        if not todo:
+            return []
+
+        names = list(todo)
+        toks = [tokenize(corpus[p]) for p in names]
+        hashes, sigs = batch_signatures([shingles(t, k=self.k_shingle) for t in toks],
+                                        self.num_perm, seed=self.seed, workers=workers)
+        start = self.meta["rows"]
+        self._write_segment(sigs, hashes)
+        for i, p in enumerate(names):
+            self.meta["files"][p] = {"row": start + i, "sha1": todo[p],
+                                     "num_tokens": len(toks[i]), "num_shingles": len(hashes[i])}
+        self._save_meta()
+        return names
+
+    def _write_segment(self, sigs: np.ndarray, hashes: List[np.ndarray]) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        name = f"seg-{self.meta['next_segment']:05d}"
+        base = os.path.join(self.dir, name)
+        keys = band_keys(sigs, self.b, self.r).T
+        order = np.argsort(keys, axis=1, kind="stable")
+        offsets = np.zeros(len(hashes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(h) for h in hashes])
+        np.save(f"{base}.sig.npy", sigs.astype(np.uint64))
+        np.save(f"{base}.keys.npy", np.take_along_axis(keys, order, axis=1))
+        np.save(f"{base}.order.npy", order.astype(np.int64))
+        np.save(f"{base}.shingles.npy", np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64))
+        np.save(f"{base}.offsets.npy", offsets)
+        self.meta["segments"].append({"name": name, "start": self.meta["rows"], "rows": len(sigs)})
+        self.meta["rows"] += len(sigs)
+        self.meta["next_segment"] += 1
+        self._row_files = None
+
+    def _save_meta(self) -> None:
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def compact(self) -> None:
+        """Rewrite the live rows as one segment and delete the old segment files."""
+        old = list(self.meta["segments"])
+        if len(old) <= 1 and self.meta["rows"] == len(self.meta["files"]):
+            return
+        names = self.filenames()
+        sigs = np.array([self.signature(f) for f in names], dtype=np.uint64).reshape(len(names), self.num_perm)
+        hashes = [self.shingle_hashes(f) for f in names]
+        self.meta["segments"], self.meta["rows"] = [], 0
+        self._write_segment(sigs, hashes)
+        for i, f in enumerate(names):
+            self.meta["files"][f]["row"] = i
+        self._save_meta()
+        self._arrays.clear()
+        for seg in old:
+            for part in ("sig", "keys", "order", "shingles", "offsets"):
+                try:
+                    os.remove(os.path.join(self.dir, f"{seg['name']}.{part}.npy"))
+                except FileNotFoundError:
+                    pass
+
+def _incremental_pairs(
+    index: LSHIndex,
+    changed: List[str],
+    workers: int = 1,
+    accept_above: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Candidate pairs of the whole index, kept in <index_dir>/pairs.jsonl: pairs stored by
+    earlier runs are reused, pairs touching a changed file are recomputed by querying
+    only the changed files.
+    """
+    pairs_path = os.path.join(index.dir, "pairs.jsonl")
+    changed_set = set(changed)
+    rows: List[Dict] = []
+    if os.path.exists(pairs_path):
+        with open(pairs_path, "r", encoding="utf-8") as f:
+            for line in f:
+                r = json.loads(line)
+                if r["a"] not in changed_set and r["b"] not in changed_set:
+                    rows.append(r)
+    candidates = {}
+    for a in changed:
+        for b in index.query(a):
+            candidates[(a, b) if a < b else (b, a)] = None
+    rows.extend(verify_pairs(list(candidates), index.shingle_hashes, index.signature,
+                             workers=workers, accept_above=accept_above))
+    if changed:
+        tmp = pairs_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as w:
+            for r in rows:
+                w.write(json.dumps(r) + "\n")
+        os.replace(tmp, pairs_path)
+    return rows
+
 def _read_text_utf8_normalized(path: str) -> Optional[str]:
     """Open source file as UTF-8 (errors='replace') and normalize newlines to '\n'."""
     try:
@@ -124,6 +533,31 @@ def _load_corpus_from_df(
 
     return corpus
 
+def exact_dedup_corpus(corpus: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """
+    Collapse files with byte-identical (newline-normalized) content before MinHash.
+
+    Returns (deduped_corpus, aliases) where aliases maps each kept filename to the
+    sorted filenames of its exact copies. Only kept files with copies appear in aliases.
+    """
+    kept_by_sha1: Dict[str, str] = {}
+    members: Dict[str, List[str]] = {}
+    for path, text in corpus.items():
+        h = hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+        members.setdefault(h, []).append(path)
+        kept = kept_by_sha1.get(h)
+        if kept is None or canonical_key(path) < canonical_key(kept):
+            kept_by_sha1[h] = path
+
+    keep = set(kept_by_sha1.values())
+    deduped = {p: t for p, t in corpus.items() if p in keep}
+    aliases: Dict[str, List[str]] = {}
+    for h, paths in members.items():
+        if len(paths) > 1:
+            kept = kept_by_sha1[h]
+            aliases[kept] = sorted(p for p in paths if p != kept)
+    return deduped, aliases
+
 def _ensure_outdir(path: str):
     os.makedirs(path, exist_ok=True)
 
@@ -139,6 +573,10 @@ def run_from_dataframe(
     lsh_threshold: float = DEFAULT_LSH_THRESHOLD,
     top_n_print: int = DEFAULT_TOP_N_PRINT,
     save_parquet: bool = True,
+    exact_dedup: bool = False,
+    workers: int = 1,
+    index_dir: Optional[str] = None,
+    estimate_margin: Optional[float] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
     """
     Execute MinHash/LSH + exact Jaccard over files referenced in candidate_df.
@@ -154,6 +592,14 @@ def run_from_dataframe(
     lsh_threshold: LSH candidate threshold.
     top_n_print  : How many top pairs to preview in logs.
     save_parquet : Save parquet alongside CSV.
+    exact_dedup  : Collapse exact duplicate contents before MinHash; dropped copies are
+                   listed in df_files['aliases'] and written to exact_duplicates.csv.
+    workers      : Processes for MinHash signatures and threads for pair verification.
+    index_dir    : Persistent LSHIndex directory. Only new or changed files are signed and
+                   queried; pairs among unchanged files come from the index's pairs.jsonl.
+    estimate_margin : If set, candidate pairs whose MinHash estimate is at least
+                   lsh_threshold + estimate_margin keep the estimate instead of an exact
+                   Jaccard check (df_pairs then has an 'estimated' column).
 
     Returns
     -------
@@ -176,58 +622,85 @@ def run_from_dataframe(
 
     print(f"[info] loaded {len(corpus)} files from candidate_df")
 
-    # Build LSH and per-file signatures
-    lsh = MinHashLSH(threshold=lsh_threshold, num_perm=num_perm)
+    aliases: Dict[str, List[str]] = {}
+    if exact_dedup:
+        corpus, aliases = exact_dedup_corpus(corpus)
+        n_dupes = sum(len(v) for v in aliases.values())
+        print(f"[info] exact duplicates collapsed: {n_dupes} (remaining files: {len(corpus)})")
+
     file_rows = []
-    file_sigs: Dict[str, Tuple[set, MinHash]] = {}
+    accept_above = None if estimate_margin is None else lsh_threshold + estimate_margin
+
+    if index_dir is not None:
+        # Persistent index: sign only new/changed files and query only those
+        index = LSHIndex(index_dir, num_perm=num_perm, threshold=lsh_threshold, k_shingle=k_shingle)
+        changed = index.add(corpus, workers=workers)
+        print(f"[info] LSH index {index_dir}: {len(changed)} new/changed files signed, {len(index)} indexed")
+        for path in corpus:
+            info = index.info(path)
+            file_rows.append({
+                "filename": path,
+                "num_tokens": info["num_tokens"],
+                "num_shingles": info["num_shingles"],
+                "num_perm": num_perm,
+                "k_shingle": k_shingle,
+                "minhash_hashvalues": index.signature(path).astype(np.uint64).tolist(),
+            })
+        pair_rows = [
+            r for r in _incremental_pairs(index, changed, workers=workers, accept_above=accept_above)
+            if r["a"] in corpus and r["b"] in corpus
+        ]
+    else:
+        # Per-file shingle hashes (sorted uint64) and signatures
+        keys = list(corpus.keys())
+        num_tokens, sigsets = [], []
+        for path in keys:
+            toks = tokenize(corpus[path])
+            num_tokens.append(len(toks))
+            sigsets.append(shingles(toks, k=k_shingle))
+        hashes, sigs = batch_signatures(sigsets, num_perm, workers=workers)
+        del sigsets
+        file_hashes = dict(zip(keys, hashes))
+        file_sig = dict(zip(keys, sigs))
+
+        lsh = MinHashLSH(threshold=lsh_threshold, num_perm=num_perm)
+        file_mh = {path: signature_to_minhash(hv, num_perm) for path, hv in zip(keys, sigs)}
+        for path in keys:
+            lsh.insert(path, file_mh[path])
+
+        for path, n_tok in zip(keys, num_tokens):
+            file_rows.append({
+                "filename": path,
+                "num_tokens": n_tok,
+                "num_shingles": len(file_hashes[path]),
+                "num_perm": num_perm,
+                "k_shingle": k_shingle,
+                "minhash_hashvalues": file_sig[path].tolist(),
+            })
 
-    for path, text in corpus.items():
-        toks = tokenize(text)
-        S = shingles(toks, k=k_shingle)
-        mh = to_minhash(S, num_perm)
-        lsh.insert(path, mh)
-        file_sigs[path] = (S, mh)
-
-        hashvalues = mh.hashvalues.astype(np.uint64).tolist()
-        file_rows.append({
-            "filename": path,
-            "num_tokens": len(toks),
-            "num_shingles": len(S),
-            "num_perm": num_perm,
-            "k_shingle": k_shingle,
-            "minhash_hashvalues": hashvalues,
-        })
+        # Candidate pairs: LSH, then exact Jaccard over shingle hashes
+        candidates = []
+        for a in keys:
+            for b in lsh.query(file_mh[a]):
+                if b <= a:  # avoid (a,a) and dup pair directions by lexicographic order
+                    continue
+                candidates.append((a, b))
+        pair_rows = verify_pairs(candidates, file_hashes.__getitem__, file_sig.__getitem__,
+                                 workers=workers, accept_above=accept_above)
 
-    df_files = pd.DataFrame(file_rows).sort_values("filename").reset_index(drop=True)
-    print(f"[info] files indexed   : {len(df_files)}")
+    similar_files = list(dict.fromkeys(f for r in pair_rows for f in (r["a"], r["b"])))
 
-    # Candidate pairs: LSH + exact Jaccard
-    pair_rows = []
-    keys = list(corpus.keys())
-    similar_files: List[str] = []
+    if exact_dedup:
+        for row in file_rows:
+            row["aliases"] = aliases.get(row["filename"], [])
 
-    for a in keys:
-        S_a, mh_a = file_sigs[a]
-        for b in lsh.query(mh_a):
-            if b <= a:  # avoid (a,a) and dup pair directions by lexicographic order
-                continue
-            S_b, _ = file_sigs[b]
-            s = jaccard(S_a, S_b)
-            pair_rows.append({
-                "a": a,
-                "b": b,
-                "jaccard": s,
-                "a_shingles": len(S_a),
-                "b_shingles": len(S_b),
-                "union_shingles": len(S_a | S_b),
-                "intersect_shingles": len(S_a & S_b),
-            })
-            if a not in similar_files:
-                similar_files.append(a)
-            if b not in similar_files:
-                similar_files.append(b)
+    df_files = pd.DataFrame(file_rows).sort_values("filename").reset_index(drop=True)
+    print(f"[info] files indexed   : {len(df_files)}")
 
-    df_pairs = pd.DataFrame(pair_rows).sort_values("jaccard", ascending=False).reset_index(drop=True)
+    pair_cols = ["a", "b", "jaccard", "a_shingles", "b_shingles", "union_shingles", "intersect_shingles"]
+    if accept_above is not None:
+        pair_cols.append("estimated")
+    df_pairs = pd.DataFrame(pair_rows, columns=pair_cols).sort_values("jaccard", ascending=False).reset_index(drop=True)
     keep_t = lsh_threshold
     print(f"[diag] total candidate pairs: {len(df_pairs)}")
     print(f"[diag] pairs with jaccard >= {keep_t}: {(df_pairs['jaccard'] >= keep_t).sum()}")
@@ -242,6 +715,13 @@ def run_from_dataframe(
     df_files.to_csv(files_csv, index=False)
     df_pairs.to_csv(pairs_csv, index=False)
 
+    if exact_dedup:
+        dupes_csv = os.path.join(out_dir, "exact_duplicates.csv")
+        pd.DataFrame(
+            [{"filename": d, "duplicate_of": k} for k, ds in aliases.items() for d in ds],
+            columns=["filename", "duplicate_of"],
+        ).to_csv(dupes_csv, index=False)
+
     if save_parquet:
         try:
             df_files.to_parquet(files_parquet, index=False)
@@ -250,7 +730,7 @@ def run_from_dataframe(
         except Exception as e:
             print(f"[warn] parquet save failed ({e}); CSVs were still written to {out_dir}/")
 
-    # JSONL of signatures for later reuse
+    # JSONL of signatures for later reuse; only compare rows with the same tokenizer_version
     with open(sig_jsonl_path, "w", encoding="utf-8") as w:
         for _, row in df_files.iterrows():
             out = {
@@ -260,6 +740,7 @@ def run_from_dataframe(
                 "num_perm":     int(row["num_perm"]),
                 "k_shingle":    int(row["k_shingle"]),
                 "minhash_hashvalues": row["minhash_hashvalues"],
+                "tokenizer_version": cryptol_tokenizer.TOKENIZER_VERSION,
             }
             w.write(json.dumps(out) + "\n")
 
@@ -269,7 +750,7 @@ def run_from_dataframe(
     print(f"[info] files loaded  : {len(corpus)}")
     print(f"[info] files indexed : {len(df_files)}")
 
-    zero_shingle = sum(1 for (_, (S, _)) in file_sigs.items() if not S)
+    zero_shingle = int((df_files["num_shingles"] == 0).sum())
     print(f"[info] files with 0 shingles (tokens < {k_shingle}): {zero_shingle}")
 
     print(f"[info] candidate pairs (from LSH) : {len(df_pairs)}")
@@ -307,6 +788,11 @@ if __name__ == "__main__":
     p.add_argument("--k-shingle", type=int, default=DEFAULT_K_SHINGLE)
     p.add_argument("--lsh-threshold", type=float, default=DEFAULT_LSH_THRESHOLD)
     p.add_argument("--no-parquet", action="store_true")
+    p.add_argument("--exact-dedup", action="store_true")
+    p.add_argument("--workers", type=int, default=1, help="Processes for MinHash signatures")
+    p.add_argument("--index-dir", default=None, help="Persistent LSH index for incremental runs")
+    p.add_argument("--estimate-margin", type=float, default=None,
+                   help="Accept MinHash estimates >= lsh_threshold + margin without exact Jaccard")
     args = p.parse_args()
 
     # Load df
@@ -327,4 +813,8 @@ if __name__ == "__main__":
         k_shingle=args.k_shingle,
         lsh_threshold=args.lsh_threshold,
         save_parquet=not args.no_parquet,
+        exact_dedup=args.exact_dedup,
+        workers=args.workers,
+        index_dir=args.index_dir,
+        estimate_margin=args.estimate_margin,
     )
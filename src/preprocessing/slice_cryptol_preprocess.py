@@ -4,22 +4,33 @@ slice_cryptol_preprocess.py
 Pipeline for:
   * Reading Cryptol slices from REPO_ROOT/sliced_files
   * Checking them with the existing interpreter_process helpers
-  * Greedily minimizing imports (when possible)
+  * Minimizing imports (greedy or bisection, optionally after a static pre-pass)
+  * Optionally on a pool of server connections, checkpointing each slice to JSONL
   * Returning a pandas DataFrame of passing, minimized snippets.
 
-This module DOES NOT modify interpreter_process.py.
+The server-side pieces (CryptolServerPool, VerificationCache, load_with_cryptol_server)
+live in interpreter_process.py; this module only drives them.
 """
 
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Callable, Iterable
 
 import pandas as pd
 
 from .interpreter_process import (
+    CryptolServerPool,
+    VerificationCache,
+    error_info,
+    is_transport_error,
     load_with_cryptol_server,
+    resolve_cryptol_module,
 )
 
 
@@ -120,10 +131,15 @@ def check_code_with_interpreter(
     host_mount_dir: Path,
     server_url: str,
     reset_server: bool = False,
+    cache: Optional[VerificationCache] = None,
+    connection=None,
 ) -> Tuple[bool, Any]:
     """
     Write `code` into MOUNT_DIR / rel_path, ask the Cryptol remote server
-    to load it, then delete the file.
+    to load it, then delete the file. With `cache`, unchanged code (and
+    unchanged imports) is answered from the cache instead of the server.
+    With `connection`, that session is reused instead of opening a new one; a
+    _SlotConnection is reconnected and the load retried once if the connection fails.
 
     Returns (ok, load_info).
     """
@@ -135,11 +151,26 @@ def check_code_with_interpreter(
     )
 
     try:
-        load_info = load_with_cryptol_server(
-            container_relpath=container_relpath,
-            server_url=server_url,
-            reset_server=reset_server,
-        )
+        for attempt in (0, 1):
+            try:
+                load_info = load_with_cryptol_server(
+                    container_relpath=container_relpath,
+                    server_url=server_url,
+                    reset_server=reset_server,
+                    connection=connection,
+                    cache=cache,
+                )
+            except Exception as exc:  # network / server / parse, etc.
+                load_info = exc
+            failure = connection_failure(load_info)
+            if failure is None or attempt or not isinstance(connection, _SlotConnection):
+                break
+            print(f"  [warn] Cryptol connection {connection.worker_id} lost ({failure}); reconnecting")
+            try:
+                connection.reconnect()
+            except Exception as exc:
+                load_info = exc
+                break
         print("  [debug] load_info:", repr(load_info))
 
         ok = False
@@ -150,10 +181,6 @@ def check_code_with_interpreter(
                 ok = bool(load_info["success"])
         # fallback: if no dict/flag, consider as failure unless you want otherwise
 
-    except Exception as exc:  # network / server / parse, etc.
-        ok = False
-        load_info = exc
-
     finally:
         # Delete the slice file, keep the directory structure
         try:
@@ -164,29 +191,220 @@ def check_code_with_interpreter(
     return ok, load_info
 
 
+def connection_failure(load_info: Any) -> Optional[BaseException]:
+    """
+    The exception if `load_info` (from check_code_with_interpreter) means the server
+    could not be asked, as opposed to Cryptol rejecting the code; else None.
+    """
+    if isinstance(load_info, BaseException):
+        return load_info  # raised outside the load itself, e.g. reset on a dropped session
+    error = load_info.get("error") if isinstance(load_info, dict) else None
+    return error if is_transport_error(error) else None
+
+
+class ConnectionLost(RuntimeError):
+    """A load during import minimization could not reach the server."""
+
+
+class _SlotConnection:
+    """
+    The connection of one CryptolServerPool slot. It is used like the connection
+    itself, and reconnect() swaps in a fresh one (also for later slices of the slot).
+    """
+
+    def __init__(self, pool: CryptolServerPool, worker_id: int, conn):
+        self.pool = pool
+        self.worker_id = worker_id
+        self.conn = conn
+
+    def reconnect(self) -> None:
+        self.conn = self.pool.reconnect(self.worker_id)
+
+    def __getattr__(self, name: str):
+        return getattr(self.conn, name)
+
+
 # ---------------------------------------------------------------------------
 # Import minimization (all in THIS module)
 # ---------------------------------------------------------------------------
 
+_IMPORT_HEAD_RE = re.compile(
+    r"^\s*import\s+(?:submodule\s+)?(?P<module>[A-Za-z_][\w']*(?:::[A-Za-z_][\w']*)*)"
+    r"(?:\s+as\s+(?P<alias>[A-Za-z_][\w']*(?:::[A-Za-z_][\w']*)*))?"
+    r"(?P<rest>.*)$"
+)
+_IDENT_RE = re.compile(r"[A-Za-z_][\w']*(?:::[A-Za-z_][\w']*)*")
+_OPERATOR_RE = re.compile(r"[!#$%&*+./<=>?@\\^|~:-]+")
+_LINE_COMMENT_RE = re.compile(r"//.*?$", re.MULTILINE)
+_BLOCK_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+_TOP_DECL_RE = re.compile(
+    r"^(?:private\s+)?(?:"
+    r"(?:type\s+(?:constraint\s+)?|newtype\s+|enum\s+|property\s+|primitive\s+(?:type\s+)?)?"
+    r"(?P<name>[A-Za-z_][\w']*)"
+    r"|\((?P<op>[^)\s]+)\)"
+    r")",
+    re.MULTILINE,
+)
+_DECL_KEYWORDS = {"module", "import", "where", "private", "parameter", "interface", "submodule",
+                  "type", "newtype", "enum", "property", "primitive", "infixl", "infixr", "infix"}
+
+
+def parse_import_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse one Cryptol import line into {module, alias, names, hiding}.
+    `names` is the explicit import list (None when the whole module is imported).
+    Returns None for lines it does not understand (multi-line lists, etc.).
+    """
+    m = _IMPORT_HEAD_RE.match(line)
+    if not m:
+        return None
+    rest = _LINE_COMMENT_RE.sub("", m.group("rest")).strip()
+    hiding = rest.startswith("hiding")
+    if hiding:
+        rest = rest[len("hiding"):].strip()
+    names = None
+    if rest:
+        if not (rest.startswith("(") and rest.endswith(")")):
+            return None
+        inner = rest[1:-1]
+        names = set(_IDENT_RE.findall(inner)) | set(_OPERATOR_RE.findall(inner.replace(",", " ")))
+    return {"module": m.group("module"), "alias": m.group("alias"), "names": names, "hiding": hiding}
+
+
+def _strip_comments(text: str) -> str:
+    return _LINE_COMMENT_RE.sub("", _BLOCK_COMMENT_RE.sub("", text))
+
+
+def module_top_level_names(path: Path) -> Tuple[set, set]:
+    """(identifiers, operators) declared at column 0 of a Cryptol module file."""
+    try:
+        text = _strip_comments(path.read_text(encoding="utf-8", errors="replace"))
+    except OSError:
+        return set(), set()
+    names, ops = set(), set()
+    for m in _TOP_DECL_RE.finditer(text):
+        if m.group("name") and m.group("name") not in _DECL_KEYWORDS:
+            names.add(m.group("name"))
+        elif m.group("op"):
+            ops.add(m.group("op"))
+    return names, ops
+
+
+def prepass_unused_imports(
+    header: List[str],
+    imports: List[str],
+    body: List[str],
+    module_dir: Path,
+    mount_root: Path,
+    file_deps: Optional[List[Any]] = None,
+) -> List[int]:
+    """
+    Indices of import lines that are clearly unused, without asking the server:
+
+      * `import M as Q`        : nothing in the slice is written `Q::...`
+      * `import M (x, y)`      : none of x, y appear in the slice
+      * `import M`             : M resolves to a file under the mount (and, if given,
+                                 appears in the server's `file_deps`) and none of its
+                                 top-level names or operators appear in the slice.
+
+    Anything that cannot be decided (stdlib modules, `hiding`, multi-line lists)
+    is kept. The caller still verifies the result with one load.
+    """
+    text = _strip_comments("\n".join(header + body))
+    tokens = set(_IDENT_RE.findall(text))
+    simple = {t for t in tokens if "::" not in t}
+    qualifiers = {t.rsplit("::", 1)[0] for t in tokens if "::" in t}
+    loaded = {d for d in (file_deps or []) if isinstance(d, str)}
+
+    drop: List[int] = []
+    for idx, line in enumerate(imports):
+        if not line.lstrip().startswith("import "):
+            continue
+        imp = parse_import_line(line)
+        if imp is None:
+            continue
+        if imp["alias"]:
+            if imp["alias"] not in qualifiers:
+                drop.append(idx)
+            continue
+        if imp["names"] is not None and not imp["hiding"]:
+            if not any(n in simple or (not n[0].isalnum() and n in text) for n in imp["names"]):
+                drop.append(idx)
+            continue
+        if imp["hiding"] or (loaded and imp["module"] not in loaded):
+            continue
+        path = resolve_cryptol_module(imp["module"], module_dir, mount_root)
+        if path is None:
+            continue
+        names, ops = module_top_level_names(path)
+        if not names and not ops:
+            continue
+        if not (names & simple) and not any(op in text for op in ops):
+            drop.append(idx)
+    return drop
+
+
+def bisect_needed(items: List[int], test: Callable[[List[int]], bool]) -> List[int]:
+    """
+    Smallest subset of `items` for which `test(subset)` is True, found by recursive
+    bisection (the divide-and-conquer form of delta debugging, as in QuickXplain).
+
+    Assumes `test` is monotone (adding imports never breaks a load that passed) and
+    that test(items) is True. Whole halves that are not needed are dropped with one
+    load, so d needed imports out of k cost about 2*d*log2(k/d) loads, and a slice that
+    needs none of them costs one. Classic ddmin needs several times more loads here.
+    """
+    def _split(base: List[int], base_changed: bool, cands: List[int]) -> List[int]:
+        if base_changed and test(base):
+            return []
+        if len(cands) == 1:
+            return cands
+        half = len(cands) // 2
+        left, right = cands[:half], cands[half:]
+        needed_right = _split(base + left, True, right)
+        needed_left = _split(base + needed_right, bool(needed_right), left)
+        return needed_left + needed_right
+
+    if not items or test([]):
+        return []
+    return sorted(_split([], False, list(items)))
+
+
 def minimize_imports(
     code: str,
     file_relpath: Path,
     host_mount_dir: Path,
     server_url: str,
+    cache: Optional[VerificationCache] = None,
+    strategy: str = "greedy",
+    prepass: bool = False,
+    file_deps: Optional[List[Any]] = None,
+    connection=None,
 ) -> Tuple[str, int, int]:
     """
-    Greedy import minimization:
+    Import minimization.
 
       1. Split into (header, imports, body).
-      2. For each import line, try dropping it:
+      2. Optional pre-pass: drop imports that are obviously unused (see
+         prepass_unused_imports), confirmed with one load and reverted if it fails.
+      3. strategy="greedy": for each remaining import line, try dropping it:
            * Build candidate code.
            * Check via Cryptol interpreter.
            * If it still loads, keep it removed.
            * Otherwise, leave it in.
+         strategy="bisect": drop groups of imports per load (bisect_needed);
+         much cheaper than greedy when most imports are unneeded. If the bisected
+         set does not load (imports interacting non-monotonically), falls back
+         to greedy.
+
+    A load that fails because the server could not be reached raises ConnectionLost
+    instead of counting as "import needed", so no non-minimal result is returned.
 
     Returns:
       (final_code, n_imports_original, n_imports_final)
     """
+    if strategy not in ("greedy", "bisect"):
+        raise ValueError(f"Unknown strategy {strategy!r}; use 'greedy' or 'bisect'")
     header, imports, body = split_import_blocks(code)
     n_orig = count_real_imports(imports)
 
@@ -194,35 +412,82 @@ def minimize_imports(
         # No imports to minimize
         return code, 0, 0
 
-    print(f"  [imports] Starting minimization for {file_relpath!r}")
+    print(f"  [imports] Starting minimization for {file_relpath!r} ({strategy})")
     print(f"  [imports] Original imports: {n_orig}")
 
-    # Greedy removal loop
-    for idx, imp_line in enumerate(imports):
-        if not imp_line.lstrip().startswith("import "):
-            continue  # skip blanks or comments
+    loads = 0
+    tested: Dict[frozenset, bool] = {}
 
-        trial_imports = imports.copy()
-        trial_imports[idx] = ""  # remove this import line in candidate
-        candidate_code = "\n".join(header + trial_imports + body) + "\n"
+    def _candidate(dropped: set) -> List[str]:
+        # Dropped lines become blank so line numbers in errors stay comparable.
+        return ["" if i in dropped else line for i, line in enumerate(imports)]
 
-        print(f"    [try] Removing import at line {idx}: {imp_line!r}")
+    def _check(candidate_imports: List[str]) -> bool:
+        nonlocal loads
+        key = frozenset(i for i, line in enumerate(candidate_imports) if line)
+        if key in tested:
+            return tested[key]
+        loads += 1
+        candidate_code = "\n".join(header + candidate_imports + body) + "\n"
         ok, _info = check_code_with_interpreter(
             code=candidate_code,
             rel_path=file_relpath,
             host_mount_dir=host_mount_dir,
             server_url=server_url,
             reset_server=False,
+            cache=cache,
+            connection=connection,
+        )
+        if not ok:
+            failure = connection_failure(_info)
+            if failure is not None:
+                raise ConnectionLost(f"{file_relpath}: {failure}") from failure
+        tested[key] = ok
+        return ok
+
+    if prepass:
+        host_mount_dir = Path(host_mount_dir).resolve()
+        unused = prepass_unused_imports(
+            header, imports, body,
+            module_dir=(host_mount_dir / file_relpath).parent,
+            mount_root=host_mount_dir,
+            file_deps=file_deps,
         )
+        if unused:
+            trial_imports = _candidate(set(unused))
+            if _check(trial_imports):
+                print(f"    [prepass] Dropped {len(unused)} unused import(s)")
+                imports = trial_imports
+            else:
+                print(f"    [prepass] Reverted: slice does not load without {len(unused)} import(s)")
+
+    import_idx = [i for i, line in enumerate(imports) if line.lstrip().startswith("import ")]
+
+    if strategy == "bisect" and import_idx:
+        keep = set(bisect_needed(import_idx, lambda subset: _check(_candidate(set(import_idx) - set(subset)))))
+        trial_imports = _candidate(set(import_idx) - keep)
+        if _check(trial_imports):
+            imports = trial_imports
+            import_idx = []
+        else:
+            print("    [bisect] Result does not load; falling back to greedy")
+
+    # Greedy removal loop (also the fallback when bisection fails)
+    for idx in import_idx:
+        imp_line = imports[idx]
+        trial_imports = imports.copy()
+        trial_imports[idx] = ""  # remove this import line in candidate
+
+        print(f"    [try] Removing import at line {idx}: {imp_line!r}")
+        ok = _check(trial_imports)
         if ok:
             print("    [keep removed] OK without this import")
             imports = trial_imports
-            code = candidate_code
         else:
             print("    [revert] Need this import")
 
     n_final = count_real_imports(imports)
-    print(f"  [imports] Done. Final imports: {n_final}")
+    print(f"  [imports] Done. Final imports: {n_final} ({loads} loads)")
 
     final_code = "\n".join(header + imports + body) + "\n"
     return final_code, n_orig, n_final
@@ -232,10 +497,193 @@ def minimize_imports(
 # High-level pipeline → DataFrame
 # ---------------------------------------------------------------------------
 
+SLICE_ROW_COLUMNS = [
+    "original_filename",
+    "filename",
+    "code_final",
+    "n_imports_original",
+    "n_imports_final",
+]
+
+
+def worker_relpath(file_relpath: Path, worker_id: Optional[int]) -> Path:
+    """
+    Where a worker writes a slice: the original module's directory, with a
+    per-worker file name (067_test512b.w3.cry) so concurrent workers never
+    overwrite each other. Staying in the module's directory keeps Cryptol's
+    import resolution identical to the serial run.
+    """
+    if worker_id is None:
+        return file_relpath
+    return file_relpath.with_name(f"{file_relpath.stem}.w{worker_id}{file_relpath.suffix}")
+
+
+def process_slice(
+    slice_path: Path,
+    sliced_root: Path,
+    mount_dir: Path,
+    server_url: str,
+    cache: Optional[VerificationCache] = None,
+    strategy: str = "greedy",
+    prepass: bool = False,
+    connection=None,
+    worker_id: Optional[int] = None,
+    reset_server: bool = False,
+) -> Dict[str, Any]:
+    """
+    Check and minimize one slice. Returns a checkpoint record:
+    {slice, sha1, ok, error, original_filename, filename, code_final,
+     n_imports_original, n_imports_final}, plus transient=True when the server could
+    not be reached (such records are not checkpointed).
+    """
+    print("\n=== Processing slice ===")
+    print("Slice:", slice_path)
+
+    # Relative path of the slice under sliced_root, e.g.
+    #   cryptol-specs/Primitive/Symmetric/Cipher/Block/Threefish.cry/067_test512b.cry
+    rel = slice_path.relative_to(sliced_root)
+    filename = slice_path.name
+
+    # Directory where the original module lives:
+    #   cryptol-specs/Primitive/Symmetric/Cipher/Block
+    original_dir = rel.parent.parent
+
+    # Where we want to place the temp test file inside the mounted repo:
+    #   cryptol-specs/Primitive/Symmetric/Cipher/Block/067_test512b.cry
+    file_relpath = worker_relpath(original_dir / filename, worker_id)
+
+    record = _slice_record(slice_path, sliced_root)
+
+    try:
+        raw = slice_path.read_bytes()
+        record["sha1"] = hashlib.sha1(raw).hexdigest()
+        code = raw.decode("utf-8")
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"  [error] Could not read file: {e}")
+        record["error"] = {"type": type(e).__name__, "message": str(e)}
+        return record
+
+    print("  [check] Initial Cryptol load")
+    ok, info = check_code_with_interpreter(
+        code=code,
+        rel_path=file_relpath,
+        host_mount_dir=mount_dir,
+        server_url=server_url,
+        reset_server=reset_server,
+        cache=cache,
+        connection=connection,
+    )
+
+    if not ok:
+        print("  [skip] Initial load failed; skipping this slice.")
+        print("  [debug] load_info:", repr(info))
+        record["error"] = error_info(info.get("error") if isinstance(info, dict) else info)
+        record["transient"] = connection_failure(info) is not None
+        return record
+
+    try:
+        final_code, n_orig, n_final = minimize_imports(
+            code=code,
+            file_relpath=file_relpath,
+            host_mount_dir=mount_dir,
+            server_url=server_url,
+            cache=cache,
+            strategy=strategy,
+            prepass=prepass,
+            file_deps=info.get("file_deps") if isinstance(info, dict) else None,
+            connection=connection,
+        )
+    except ConnectionLost as e:
+        print(f"  [error] Minimization aborted: {e}")
+        record["error"] = error_info(e.__cause__ or e)
+        record["transient"] = True
+        return record
+    record.update(
+        ok=True,
+        code_final=final_code,
+        n_imports_original=n_orig,
+        n_imports_final=n_final,
+    )
+    return record
+
+
+def _slice_record(slice_path: Path, sliced_root: Path) -> Dict[str, Any]:
+    """A not-yet-passing checkpoint record for `slice_path` (see process_slice)."""
+    rel = slice_path.relative_to(sliced_root)
+    return {
+        "slice": rel.as_posix(),
+        "sha1": None,
+        "ok": False,
+        "error": None,
+        # For the DataFrame, keep track of the original module path (the .cry file),
+        # relative to sliced_root: cryptol-specs/.../Threefish.cry
+        "original_filename": str(rel.parent),
+        "filename": slice_path.name,
+        "code_final": None,
+        "n_imports_original": None,
+        "n_imports_final": None,
+    }
+
+
+def _failed_record(slice_path: Path, sliced_root: Path, exc: BaseException) -> Dict[str, Any]:
+    """Record for a slice whose processing raised; sha1 stays None, so a re-run retries it."""
+    print(f"[pipeline] Failed on {slice_path}: {exc!r}")
+    record = _slice_record(slice_path, sliced_root)
+    record["error"] = error_info(exc)
+    record["transient"] = is_transport_error(exc)
+    return record
+
+
+def load_slice_checkpoint(checkpoint_path: Path) -> Dict[str, Dict[str, Any]]:
+    """Records from a checkpoint JSONL, keyed by slice relpath (later lines win)."""
+    done: Dict[str, Dict[str, Any]] = {}
+    if not Path(checkpoint_path).exists():
+        return done
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            done[rec["slice"]] = rec
+    return done
+
+
+def _slice_sha1(path: Path) -> Optional[str]:
+    try:
+        return hashlib.sha1(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+def _rows_to_df(records: Iterable[Dict[str, Any]]) -> pd.DataFrame:
+    rows = [{c: rec[c] for c in SLICE_ROW_COLUMNS} for rec in records if rec.get("ok")]
+    return pd.DataFrame(rows, columns=SLICE_ROW_COLUMNS)
+
+
+def checkpoint_to_df(checkpoint_path: str) -> pd.DataFrame:
+    """
+    DataFrame of the passing slices recorded so far in a checkpoint (same columns as
+    process_sliced_files_to_df). Safe to call while a run is still appending to it.
+    """
+    done = load_slice_checkpoint(Path(checkpoint_path))
+    return _rows_to_df(done[k] for k in sorted(done))
+
+
 def process_sliced_files_to_df(
     sliced_root: Optional[Path] = None,
     mount_dir: Optional[Path] = None,
     server_url: Optional[str] = None,
+    cache_path: Optional[str] = None,
+    strategy: str = "greedy",
+    prepass: bool = False,
+    workers: int = 1,
+    checkpoint_path: Optional[str] = None,
+    on_partial: Optional[Callable[[pd.DataFrame], None]] = None,
+    partial_every: int = 100,
 ) -> pd.DataFrame:
     """
     Main entry point.
@@ -258,6 +706,29 @@ def process_sliced_files_to_df(
          }
 
     Only files that PASS the initial load check are included in the DataFrame.
+
+    `strategy` and `prepass` are passed to minimize_imports; the pre-pass uses
+    the file_deps reported by the initial load.
+
+    With `cache_path`, every load check (initial and during minimization) goes
+    through a VerificationCache, so re-runs only contact the server for slices
+    whose code or imported modules changed.
+
+    With workers > 1, slices are processed on a thread pool; each worker holds its
+    own connection from a CryptolServerPool and writes its slice next to the
+    original module under a per-worker name (see worker_relpath).
+
+    With `checkpoint_path`, one record per finished slice (see process_slice) is
+    appended to that JSONL as soon as it completes, keyed by the slice's relative
+    path and the sha1 of its content. A re-run skips slices whose content is
+    unchanged since they were recorded (pass or fail) and reloads their rows;
+    edited slices are processed again. Slices that failed on a connection error
+    (including one during minimization) are not recorded; a worker whose connection
+    dropped reconnects. An exception while processing one slice becomes a failed
+    record for that slice (retried on the next run) instead of ending the run.
+
+    With `on_partial`, it is called with the DataFrame of passing slices so far
+    (checkpointed ones included) after every `partial_every` newly finished slices.
     """
     if mount_dir is None:
         mount_dir = get_mount_dir()
@@ -265,7 +736,7 @@ def process_sliced_files_to_df(
         mount_dir = Path(mount_dir).resolve()
 
     if sliced_root is None:
-        pass
+        sliced_root = mount_dir / "sliced_files"
     else:
         sliced_root = Path(sliced_root).resolve()
 
@@ -276,90 +747,94 @@ def process_sliced_files_to_df(
     print("[pipeline] SLICED_ROOT :", sliced_root)
     print("[pipeline] SERVER_URL  :", server_url)
 
-    rows: List[Dict[str, Any]] = []
-
-    # NEW: counters for sanity check
-    total_files = 0
-    n_pass = 0
-    n_fail = 0
-
-    # Reset server only for the FIRST file we check, then reuse session.
-    first_reset = True
-
-    for slice_path in sorted(sliced_root.rglob("*.cry")):
-        total_files += 1
-
-        print("\n=== Processing slice ===")
-        print("Slice:", slice_path)
-
-        # Relative path of the slice under sliced_root, e.g.
-        #   cryptol-specs/Primitive/Symmetric/Cipher/Block/Threefish.cry/067_test512b.cry
-        rel = slice_path.relative_to(sliced_root)
-        filename = slice_path.name
-
-        # Directory where the original module lives:
-        #   cryptol-specs/Primitive/Symmetric/Cipher/Block
-        original_dir = rel.parent.parent
-
-        # Where we want to place the temp test file inside the mounted repo:
-        #   cryptol-specs/Primitive/Symmetric/Cipher/Block/067_test512b.cry
-        file_relpath = original_dir / filename
-
-        # For the DataFrame, keep track of the original module path (the .cry file)
-        original_filename = rel.parent  # cryptol-specs/.../Threefish.cry
-
-        try:
-            code = slice_path.read_text(encoding="utf-8")
-        except OSError as e:
-            
-            print(f"  [error] Could not read file: {e}")
-            n_fail += 1
-            continue
-
-        print("  [check] Initial Cryptol load")
-        ok, info = check_code_with_interpreter(
-            code=code,
-            rel_path=file_relpath,      # ✅ use cleaned path
-            host_mount_dir=mount_dir,
-            server_url=server_url,
-            reset_server=first_reset,
-        )
-        first_reset = False  # only reset the first time
-
-        if not ok:
-            n_fail += 1
-            print("  [skip] Initial load failed; skipping this slice.")
-            print("  [debug] load_info:", repr(info))
-            continue
+    cache = VerificationCache(cache_path, str(mount_dir), server_url=server_url) if cache_path else None
+
+    # Slices live in directories named after their module (Threefish.cry/), so skip dirs.
+    slice_paths = sorted(p for p in sliced_root.rglob("*.cry") if p.is_file())
+    results: Dict[str, Dict[str, Any]] = {}
+    if checkpoint_path:
+        checkpoint_path = Path(checkpoint_path)
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        results = load_slice_checkpoint(checkpoint_path)
+    todo = []
+    for p in slice_paths:
+        rec = results.get(p.relative_to(sliced_root).as_posix())
+        if rec is None or rec.get("sha1") is None or rec["sha1"] != _slice_sha1(p):
+            todo.append(p)
+    if results:
+        print(f"[pipeline] Resuming: {len(slice_paths) - len(todo)} slices unchanged since checkpoint")
+
+    ckpt = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+
+    n_new = 0
+
+    def _ordered_records() -> List[Dict[str, Any]]:
+        keys = (p.relative_to(sliced_root).as_posix() for p in slice_paths)
+        return [results[k] for k in keys if k in results]
+
+    def _record(rec: Dict[str, Any]) -> None:
+        nonlocal n_new
+        results[rec["slice"]] = rec
+        if ckpt is not None and not rec.pop("transient", False):
+            ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            ckpt.flush()
+        n_new += 1
+        if on_partial is not None and partial_every > 0 and n_new % partial_every == 0:
+            on_partial(_rows_to_df(_ordered_records()))
+
+    common = dict(
+        sliced_root=sliced_root,
+        mount_dir=mount_dir,
+        server_url=server_url,
+        cache=cache,
+        strategy=strategy,
+        prepass=prepass,
+    )
+    try:
+        if workers <= 1:
+            # Reset server only for the FIRST file we check, then reuse session.
+            first_reset = True
+            for slice_path in todo:
+                try:
+                    rec = process_slice(slice_path, reset_server=first_reset, **common)
+                except Exception as e:
+                    rec = _failed_record(slice_path, sliced_root, e)
+                _record(rec)
+                first_reset = False  # only reset the first time
         else:
-            n_pass += 1
-
-        final_code, n_orig, n_final = minimize_imports(
-            code=code,
-            file_relpath=file_relpath,  # ✅ same cleaned path
-            host_mount_dir=mount_dir,
-            server_url=server_url,
-        )
-
+            with CryptolServerPool(server_url, size=workers) as pool:
+
+                def _run(slice_path: Path) -> Dict[str, Any]:
+                    with pool.slot() as (worker_id, conn):
+                        conn = _SlotConnection(pool, worker_id, conn)
+                        return process_slice(slice_path, connection=conn, worker_id=worker_id, **common)
+
+                with ThreadPoolExecutor(max_workers=workers) as ex:
+                    futures = {ex.submit(_run, p): p for p in todo}
+                    for fut in as_completed(futures):
+                        try:
+                            rec = fut.result()
+                        except Exception as e:
+                            rec = _failed_record(futures[fut], sliced_root, e)
+                        _record(rec)
+    finally:
+        if ckpt is not None:
+            ckpt.close()
 
-        rows.append(
-            {
-                "original_filename": str(original_filename),   # relative path under sliced_root
-                "filename": filename,
-                "code_final": final_code,
-                "n_imports_original": n_orig,
-                "n_imports_final": n_final,
-            }
-        )
+    records = _ordered_records()
+    n_pass = sum(1 for rec in records if rec["ok"])
+    n_fail = len(records) - n_pass
 
-    df = pd.DataFrame(rows)
+    df = _rows_to_df(records)
 
     # NEW: sanity-check summary
     print("\n[pipeline] Completed.")
-    print("  Total files seen   :", total_files)
+    print("  Total files seen   :", len(slice_paths))
     print("  Initial load PASS  :", n_pass)
     print("  Initial load FAIL  :", n_fail)
     print("  Rows in DataFrame  :", len(df))
+    if cache is not None:
+        print("  Cache hits/misses  :", cache.hits, "/", cache.misses)
 
     return df
 
@@ -3,9 +3,11 @@ import random
 from openai import OpenAI
 import time
 from openai import RateLimitError
-import os
 import hashlib
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional
 
 import pandas as pd
 
@@ -97,21 +99,133 @@ def append_to_cache(cache_path: str, hash_key: str, processed: str):
     with open(cache_path, "a", encoding="utf-8") as f:
         f.write(json.dumps(rec, ensure_ascii=False) + "\n")
 
+class TextCache:
+    """
+    In-process view of the JSONL text cache: the file is read once, lookups hit the
+    in-memory index, and new entries are appended to the file (thread-safe).
+    """
+
+    def __init__(self, cache_path: str = CACHE_PATH):
+        self.cache_path = cache_path
+        self._index = load_cache_index(cache_path)
+        self._lock = threading.Lock()
+
+    def get(self, hash_key: str) -> Optional[str]:
+        return self._index.get(hash_key)
+
+    def __contains__(self, hash_key: str) -> bool:
+        return hash_key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def missing(self, hashes: Iterable[str]) -> list:
+        """Distinct hashes not yet cached, in first-seen order."""
+        return [h for h in dict.fromkeys(hashes) if h not in self._index]
+
+    def add(self, hash_key: str, processed: str) -> None:
+        with self._lock:
+            if hash_key in self._index:
+                return
+            dirname = os.path.dirname(self.cache_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            append_to_cache(self.cache_path, hash_key, processed)
+            self._index[hash_key] = processed
+
+
+_caches: Dict[str, TextCache] = {}
+_clients: Dict[Optional[str], OpenAI] = {}
+_registry_lock = threading.Lock()
+
+def get_text_cache(cache_path: str = CACHE_PATH) -> TextCache:
+    """Shared TextCache per cache file, loaded on first use."""
+    with _registry_lock:
+        cache = _caches.get(cache_path)
+        if cache is None:
+            cache = _caches[cache_path] = TextCache(cache_path)
+        return cache
+
+def get_client(key: str = None) -> OpenAI:
+    """Shared OpenAI client per API key (None -> OPENAI_API_KEY)."""
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = OpenAI(
+                api_key=key if key is not None else os.getenv("OPENAI_API_KEY"),
+            )
+        return client
+
 def get_or_process_text(raw_text: str, model: str = "gpt-4.1-mini", key: str = None) -> str:
     """
     If raw_text is in cache, return cached processed. Otherwise, call
     preprocess_text_via_openai, cache the result, and return it.
     """
     h = compute_hash(raw_text)
-    cache = load_cache_index(CACHE_PATH)
-    if h in cache:
-        return (h, cache[h])
+    cache = get_text_cache(CACHE_PATH)
+    processed = cache.get(h)
+    if processed is not None:
+        return (h, processed)
     # Not in cache — call the OpenAI preprocessing
     processed = preprocess_text_via_openai(raw_text, model=model, key=key)
     # Optionally: ensure processed is non-empty or valid
-    append_to_cache(CACHE_PATH, h, processed)
+    cache.add(h, processed)
     return (h, processed)
 
+def process_texts(
+    df: pd.DataFrame,
+    model: str = "gpt-4.1-mini",
+    key: str = None,
+    max_workers: int = 8,
+    exclude: Optional[Iterable[str]] = None,
+    cache_path: str = CACHE_PATH,
+) -> pd.DataFrame:
+    """
+    Process every row's 'content' at once. Hashes are checked against the cache in
+    bulk and only distinct misses are sent to OpenAI, on up to `max_workers` threads;
+    each result is appended to the cache as it arrives.
+
+    Rows whose filename is in `exclude` pass through unchanged with hash None.
+    Returns a DataFrame with columns filename, hash, input, processed (row order kept).
+    """
+    cache = get_text_cache(cache_path)
+    excluded = set(exclude or ())
+    hashes = [
+        None if row["filename"] in excluded else compute_hash(row["content"])
+        for _, row in df.iterrows()
+    ]
+    raw_by_hash = {h: raw for h, raw in zip(hashes, df["content"]) if h is not None}
+    todo = cache.missing(h for h in hashes if h is not None)
+    print(f"[info] {len(raw_by_hash) - len(todo)} texts cached, {len(todo)} to process")
+
+    errors = {}
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+            futures = {
+                ex.submit(preprocess_text_via_openai, raw_by_hash[h], model, key): h
+                for h in todo
+            }
+            for i, fut in enumerate(as_completed(futures), 1):
+                h = futures[fut]
+                try:
+                    cache.add(h, fut.result())
+                except Exception as e:
+                    errors[h] = e
+                    print(f"[warn] Text processing failed for {h[:12]}: {e}")
+                if i % 25 == 0:
+                    print(f"[info] Processed {i} / {len(todo)}")
+    if errors:
+        raise next(iter(errors.values()))
+
+    records = []
+    for (_, row), h in zip(df.iterrows(), hashes):
+        records.append({
+            "filename": row["filename"],
+            "hash": h,
+            "input": row["content"],
+            "processed": row["content"] if h is None else cache.get(h),
+        })
+    return pd.DataFrame(records)
 
 
 def call_with_retry(func, *args, max_retries=5, base_delay=1.0, max_delay=60.0, **kwargs):
@@ -141,9 +255,7 @@ def preprocess_text_via_openai(raw_text: str, model: str = "gpt-4.1-mini", key:
     Send raw_text to the OpenAI API using the prompt template and return the cleaned snippet.
     """
     prompt = PROMPT_TEMPLATE.format(raw_text=raw_text)
-    client = OpenAI(
-    api_key=key if key is not None else os.getenv("OPENAI_API_KEY"),
-)
+    client = get_client(key)
 
     response = call_with_retry(client.chat.completions.create,
         model=model,
@@ -7,27 +7,82 @@ Each line in the JSONL has:
   - filename: absolute file path (or stripped path if --strip is provided)
   - filetype: 'cry' or 'saw'
   - content: file contents as UTF-8 (with replacement for invalid bytes)
+  - sha1: sha1 of 'content', used for exact deduplication
+  - aliases: (only with --dedup) filenames of exact copies collapsed into this record
+
+Roots are walked with os.scandir and files are read on a thread pool (--workers).
+With --manifest, a JSON manifest of (path, size, mtime, sha1) is kept between runs so
+only new or changed files are re-read and written; combine with --append to update an
+existing output in place (superseded records can be dropped on load, see
+jsonl_to_dataframe(dedupe_on="filename")). Without --append the output is rewritten, so
+every file is crawled and the manifest is only refreshed. Appending never removes
+records: files deleted since the last run keep their old records in the output (the run
+reports how many); re-run without --append to drop them. With --dedup, exact copies of
+the same content (e.g. vendored cryptol-specs) are collapsed into a single record; with
+--append that only covers the files written by this run (see collapse_exact_duplicates).
+
+--compression/--max-shard-mb write zstd/gzip shards plus an index instead of one file
+(see src/util/jsonl_io.py); jsonl_to_dataframe reads either layout.
 
 Usage:
   python code_parser.py /path/to/repo [/another/root ...] --out data/sources.jsonl --strip /path/to
+  python code_parser.py /path/to/repo ... -o data/sources.jsonl --manifest data/sources.manifest.json --append
+  python code_parser.py /path/to/repo ... -o data/sources.jsonl --compression zstd --max-shard-mb 256
 
 If --out is omitted, defaults to ./data/cryptol_sources.jsonl
 """
 from __future__ import annotations
+import os
 import sys
 import argparse
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable, Iterator, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from src.util.jsonl_io import ShardedJsonlWriter, index_path_for, iter_records
+except ImportError:  # run as a script (python src/util/code_parser.py): src/util is on sys.path
+    from jsonl_io import ShardedJsonlWriter, index_path_for, iter_records
+
+DEFAULT_EXTS = (".cry", ".saw")
+DEFAULT_WORKERS = 8
+MANIFEST_VERSION = 1
 
 # --- Helpers -----------------------------------------------------------------
 
-def iter_source_files(root: Path, exts: Iterable[str]=(".cry", ".saw")) -> Iterator[Path]:
-    """Yield Path objects for files under `root` matching any extension in `exts` (case-insensitive)."""
+def scan_source_files(root: Path, exts: Iterable[str]=DEFAULT_EXTS) -> List[Tuple[str, int, int]]:
+    """
+    Walk `root` with os.scandir and return sorted (path, size, mtime_ns) tuples for files
+    matching any extension in `exts` (case-insensitive). Symlinked directories are not
+    followed (same as Path.rglob); unreadable directories are skipped with a warning.
+    """
     exts_lower = {e.lower() for e in exts}
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in exts_lower:
-            yield p
+    found: List[Tuple[str, int, int]] = []
+    stack = [str(root)]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in exts_lower:
+                            st = entry.stat()
+                            found.append((entry.path, st.st_size, st.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"[WARN] Could not scan {d}: {e}", file=sys.stderr)
+    found.sort()
+    return found
+
+def iter_source_files(root: Path, exts: Iterable[str]=DEFAULT_EXTS) -> Iterator[Path]:
+    """Yield Path objects for files under `root` matching any extension in `exts` (case-insensitive)."""
+    for path, _, _ in scan_source_files(root, exts):
+        yield Path(path)
 
 def ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
@@ -36,6 +91,13 @@ def read_text_safe(p: Path) -> str:
     # Read as UTF-8, replacing undecodable bytes so we never crash
     return p.read_text(encoding="utf-8", errors="replace")
 
+def decode_text_safe(data: bytes) -> str:
+    """Decode bytes exactly like read_text_safe (UTF-8 with replacement, universal newlines)."""
+    return data.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
+def sha1_text(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
 def strip_prefix(full: Path, prefix: Optional[Path]) -> str:
     """
     If `prefix` is provided and is a real prefix of `full`, return the relative string path.
@@ -51,20 +113,173 @@ def strip_prefix(full: Path, prefix: Optional[Path]) -> str:
         # Not a prefix; fall back to absolute
         return full.as_posix()
 
+# --- Manifest ----------------------------------------------------------------
+
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Load {path -> {"size", "mtime_ns", "sha1"}} written by save_manifest.
+    A missing or unreadable manifest yields an empty dict (i.e. a full crawl).
+    """
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[WARN] Could not read manifest {path}: {e}; doing a full crawl", file=sys.stderr)
+        return {}
+    if obj.get("version") != MANIFEST_VERSION:
+        return {}
+    return dict(obj.get("files", {}))
+
+def save_manifest(path: Path, manifest: Dict[str, Dict[str, Any]]) -> None:
+    """Atomically write the manifest (tmp file + os.replace)."""
+    ensure_parent(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": manifest}, f, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# --- Crawl -------------------------------------------------------------------
+
+def _read_entry(entry: Tuple[str, int, int]) -> Tuple[str, int, int, Optional[bytes], Optional[str]]:
+    path, size, mtime_ns = entry
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        return path, size, mtime_ns, data, None
+    except OSError as e:
+        return path, size, mtime_ns, None, str(e)
+
+def crawl(
+    roots: Iterable[Path],
+    *,
+    exts: Iterable[str]=DEFAULT_EXTS,
+    strip_path: Optional[Path]=None,
+    manifest: Optional[Dict[str, Dict[str, Any]]]=None,
+    workers: int=DEFAULT_WORKERS,
+    stats: Optional[Dict[str, Any]]=None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Walk all `roots` in parallel and yield {filename, filetype, content, sha1} records,
+    in root order and sorted path order within each root.
+
+    If `manifest` is given it is consulted and updated in place: files whose size and
+    mtime match their manifest entry are not re-read, and files whose content sha1 is
+    unchanged are not yielded. Entries for files that disappeared from the crawled
+    roots are removed. Counters are written to `stats` if provided.
+    """
+    roots = [Path(r).resolve() for r in roots]
+    exts = tuple(exts)
+    if stats is None:
+        stats = {}
+    stats.update({"seen": 0, "read": 0, "unchanged": 0, "written": 0, "removed": 0, "errors": []})
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        scanned = list(ex.map(lambda r: scan_source_files(r, exts), roots))
+
+        for root, entries in zip(roots, scanned):
+            stats["seen"] += len(entries)
+            if manifest is None:
+                to_read = entries
+            else:
+                to_read = []
+                for path, size, mtime_ns in entries:
+                    prev = manifest.get(path)
+                    if prev and prev.get("size") == size and prev.get("mtime_ns") == mtime_ns:
+                        stats["unchanged"] += 1
+                    else:
+                        to_read.append((path, size, mtime_ns))
+
+                # Forget files that were deleted under this root since the last run
+                present = {path for path, _, _ in entries}
+                prefix = str(root) + os.sep
+                for path in [p for p in manifest if p.startswith(prefix) and p not in present]:
+                    del manifest[path]
+                    stats["removed"] += 1
+
+            for path, size, mtime_ns, data, err in ex.map(_read_entry, to_read):
+                if data is None:
+                    print(f"[WARN] Could not read {path}: {err}", file=sys.stderr)
+                    stats["errors"].append(path)
+                    continue
+                stats["read"] += 1
+
+                digest = hashlib.sha1(data).hexdigest()
+                if manifest is not None:
+                    prev = manifest.get(path)
+                    manifest[path] = {"size": size, "mtime_ns": mtime_ns, "sha1": digest}
+                    if prev and prev.get("sha1") == digest:
+                        # touched but not modified (e.g. git checkout)
+                        stats["unchanged"] += 1
+                        continue
+
+                p = Path(path)
+                content = decode_text_safe(data)
+                stats["written"] += 1
+                yield {
+                    # filename with optional strip
+                    "filename": strip_prefix(p, strip_path),
+                    # filetype from suffix
+                    "filetype": p.suffix.lower().lstrip("."),
+                    "content": content,
+                    "sha1": sha1_text(content),
+                }
+
+def canonical_key(filename: str) -> Tuple[int, str]:
+    """
+    Sort key for picking which copy of duplicated content to keep: the shallowest path,
+    so an upstream copy wins over one vendored under deps/ (ties broken lexicographically).
+    """
+    return filename.count("/"), filename
+
+def collapse_exact_duplicates(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Collapse records with identical content into one record per sha1.
+
+    The kept record is the lowest canonical_key (shallowest path) and gets an 'aliases'
+    list with the filenames of the other copies. A later copy can still replace the kept
+    one, so nothing is yielded until the input is exhausted: one record per distinct
+    content is held in memory until then. Records are yielded in order of first appearance.
+
+    Only the records passed in are compared. With --manifest --append that is just the
+    new or changed files: copies of content already in the output are not collapsed, and
+    alias lists written by earlier runs are not updated when copies change or disappear.
+    Re-run without --append for a fully deduplicated output.
+    """
+    by_sha1: Dict[str, Dict[str, Any]] = {}
+    for rec in records:
+        digest = rec.get("sha1") or sha1_text(rec["content"])
+        kept = by_sha1.get(digest)
+        if kept is None:
+            by_sha1[digest] = {**rec, "sha1": digest, "aliases": []}
+            continue
+        if canonical_key(rec["filename"]) < canonical_key(kept["filename"]):
+            kept["aliases"].append(kept["filename"])
+            kept["filename"] = rec["filename"]
+        else:
+            kept["aliases"].append(rec["filename"])
+    for rec in by_sha1.values():
+        rec["aliases"].sort()
+        yield rec
+
 # --- Optional utility ---------------------------------------------------------
 
-def jsonl_to_dataframe(absolute_path: str):
+def jsonl_to_dataframe(absolute_path: str, dedupe_on: Optional[str] = None):
     """
-    Load a JSONL file into a pandas DataFrame. (Optional utility.)
+    Load a JSONL file (plain or sharded) into a pandas DataFrame. (Optional utility.)
     Expects per-line dicts with at least: filename, relpath, filetype, content, root.
+
+    If `dedupe_on` is given (e.g. "filename"), only the last record per value is kept,
+    which drops records superseded by an incremental --append crawl.
     """
     import pandas as pd
-    records = []
-    with open(absolute_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                records.append(json.loads(line))
-    return pd.DataFrame.from_records(records)
+    df = pd.DataFrame.from_records(list(iter_records(absolute_path, workers=4)))
+    if dedupe_on is not None and dedupe_on in df.columns:
+        df = df.drop_duplicates(subset=dedupe_on, keep="last").reset_index(drop=True)
+    return df
 
 # --- Main --------------------------------------------------------------------
 
@@ -94,49 +309,84 @@ def main(argv=None):
         action="store_true",
         help="Append to the JSONL instead of overwriting."
     )
+    parser.add_argument(
+        "--manifest",
+        metavar="PATH",
+        type=str,
+        default=None,
+        help="Manifest of (path, size, mtime, sha1) from the previous run; with --append only new or "
+             "changed files are written (without it, everything is re-crawled and the manifest refreshed)."
+    )
+    parser.add_argument(
+        "--workers", "-j",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Threads used to walk roots and read files (default: {DEFAULT_WORKERS})."
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Collapse files with identical content into one record with an 'aliases' list "
+             "(applies to the files written by this run; with --append, earlier records are untouched)."
+    )
+    parser.add_argument(
+        "--compression",
+        choices=("gzip", "zstd"),
+        default=None,
+        help="Write compressed shards plus an index file instead of a single JSONL."
+    )
+    parser.add_argument(
+        "--max-shard-mb",
+        type=float,
+        default=None,
+        help="Split output into shards of at most this many MB of uncompressed JSONL."
+    )
 
     args = parser.parse_args(argv)
 
     roots = [Path(r).expanduser().resolve() for r in args.roots]
     out_path = Path(args.out).expanduser().resolve()
     strip_path = Path(args.strip).expanduser().resolve() if args.strip else None
+    manifest_path = Path(args.manifest).expanduser().resolve() if args.manifest else None
 
     ensure_parent(out_path)
 
-    mode = "a" if args.append and out_path.exists() else "w"
-    total = 0
-    errors: list[str] = []
-
-    with open(out_path, mode, encoding="utf-8") as out_f:
-        for root in roots:
-            root = root.resolve()
-            for p in iter_source_files(root, exts=(".cry", ".saw")):
-                try:
-                    content = read_text_safe(p)
-                except Exception as e:
-                    print(f"[WARN] Could not read {p}: {e}", file=sys.stderr)
-                    errors.append(str(p))
-                    continue
+    max_shard_bytes = int(args.max_shard_mb * (1 << 20)) if args.max_shard_mb else None
+    sharded = args.compression is not None or max_shard_bytes is not None
+    out_exists = index_path_for(out_path).exists() if sharded else out_path.exists()
+    mode = "a" if args.append and out_exists else "w"
 
-                # filetype from suffix
-                suff = p.suffix.lower()
-                if suff not in (".cry", ".saw"):
-                    # Defensive: should not happen due to filter above
-                    continue
-                filetype = suff.lstrip(".")
+    manifest = None
+    if manifest_path is not None:
+        manifest = load_manifest(manifest_path)
+        if mode == "w" and manifest:
+            # A fresh output must hold every file, not just the ones changed since the manifest.
+            why = "does not exist" if args.append else "is rewritten without --append"
+            print(f"[INFO] {out_path} {why}; ignoring manifest and crawling everything")
+            manifest = {}
 
-                # filename with optional strip, relpath always relative to current root
-                filename = strip_prefix(p, strip_path)
-                record = {
-                    "filename": filename,
-                    "filetype": filetype,
-                    "content": content,
-                }
+    stats: Dict[str, Any] = {}
+    records = crawl(roots, strip_path=strip_path, manifest=manifest,
+                    workers=args.workers, stats=stats)
+    if args.dedup:
+        records = collapse_exact_duplicates(records)
+
+    with ShardedJsonlWriter(out_path, compression=args.compression,
+                            max_shard_bytes=max_shard_bytes, append=(mode == "a")) as out_f:
+        n_records = out_f.write_many(records)
 
-                out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
-                total += 1
+    if manifest_path is not None:
+        save_manifest(manifest_path, manifest)
+        print(f"[INFO] Seen {stats['seen']} files: {stats['unchanged']} unchanged, "
+              f"{stats['read']} read, {stats['removed']} removed since last run")
+        if mode == "a" and stats["removed"]:
+            print(f"[WARN] {stats['removed']} removed files still have records in {out_path}; "
+                  f"re-run without --append to drop them")
 
-    print(f"Wrote {total} files (.cry/.saw) to {out_path}")
+    errors = stats["errors"]
+    print(f"Wrote {stats['written']} files (.cry/.saw) to {out_path}")
+    if args.dedup:
+        print(f"[INFO] {stats['written'] - n_records} exact duplicates collapsed into {n_records} records")
     if errors:
         print(f"[INFO] {len(errors)} files could not be read. First few:", errors[:5])
 
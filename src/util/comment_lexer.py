@@ -0,0 +1,140 @@
+"""
+comment_lexer: single-pass comment scanner for Cryptol, SAW, C-like and other sources.
+
+scan_comments(text, lang) walks the text once, left to right, and returns non-overlapping
+comment spans (comment_text, (start, end), kind) in order, with kind one of
+'block', '//', '#', '--', ';'. String literals are skipped, so comment markers inside
+them are not comments, and nothing inside a comment can start another one.
+
+Languages:
+  - cryptol / saw : // and nested /* */; "..." strings; '...' char literals, except that a
+                    ' right after an identifier character is a prime (x', SubByte').
+  - c             : // and /* */ (not nested); "..." strings and '...' char literals.
+                    Also used for C++, Java, JS/TS, Go, Rust and CSS.
+  - generic       : what dataset_builder's regex stack recognised: /* */ anywhere, and
+                    //, # (not #!), -- and ; at line start or after whitespace; "..." and
+                    '...' strings, but only when the quote doesn't follow a word character
+                    (5", don't) and the string closes on the same line.
+Strings never span lines (except via a backslash escape), so a stray quote can hide at most
+the rest of its line. Unterminated block comments and strings are not treated as such (the
+marker is skipped). Inside a block comment a "..." on one line is skipped when looking for
+the closing */, so /* doc "*/" */ is one comment.
+
+Example:
+    scan_comments('t = "/*"; x /* real */ y = "z"', "cryptol")
+    # -> [('/* real */', (12, 22), 'block')]; the /* inside the string opens nothing
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, List, Tuple
+
+Span = Tuple[str, Tuple[int, int], str]
+
+_STRING_RE = re.compile(r'"(?:[^"\\\n]|\\[\s\S])*"')
+_SQ_STRING_RE = re.compile(r"'(?:[^'\\\n]|\\[\s\S])*'")
+_CHAR_RE = re.compile(r"'(?:[^'\\\n]|\\[^\n][^'\n]{0,8})'")
+_BLOCK_MARK_RE = re.compile(r'/\*|\*/|"')
+_IDENT_CHAR_RE = re.compile(r"[A-Za-z0-9_']")
+_WORD_CHAR_RE = re.compile(r"\w")
+
+_START_RE = {
+    "cryptol": re.compile(r"(?P<line>//)|(?P<block>/\*)|(?P<str>\")|(?P<chr>')"),
+    "c": re.compile(r"(?P<line>//)|(?P<block>/\*)|(?P<str>\")|(?P<chr>')"),
+    "generic": re.compile(r"(?P<line>(?:^|(?<=\s))(?://|#(?!!)|--|;))|(?P<block>/\*)|(?P<str>\")|(?P<chr>')", re.M),
+}
+_NESTED_BLOCKS = {"cryptol": True, "c": False, "generic": False}
+_PRIMES = {"cryptol": True, "c": False, "generic": False}
+_LOOSE_QUOTES = {"cryptol": False, "c": False, "generic": True}
+
+LANG_LEXER: Dict[str, str] = {
+    "cryptol": "cryptol", "saw": "cryptol",
+    "c": "c", "cpp": "c", "java": "c", "javascript": "c", "typescript": "c",
+    "go": "c", "rust": "c", "css": "c",
+}
+
+
+def lexer_for(lang: str | None) -> str:
+    return LANG_LEXER.get((lang or "").lower(), "generic")
+
+
+def _nested_block_scan(text: str, start: int, ends: Dict[int, int], unclosed: set) -> None:
+    """
+    Match the /* at `start` (a real opener reached by scan_comments) with nesting. Every
+    opener met on the way is recorded too: in `ends` (opener -> end offset of its */) or,
+    if the text runs out first, in `unclosed`. Inside the comment a one-line "..." is
+    skipped, so a quoted */ doesn't close it. Later openers already covered by a scan
+    are answered from these maps, so unterminated comments don't rescan to EOF each time.
+    """
+    stack = [start]
+    pos = start + 2
+    while stack:
+        m = _BLOCK_MARK_RE.search(text, pos)
+        if m is None:
+            unclosed.update(stack)
+            return
+        mark, pos = m.group(0), m.end()
+        if mark == "/*":
+            stack.append(m.start())
+        elif mark == "*/":
+            ends[stack.pop()] = pos
+        else:  # '"' inside the comment
+            sm = _STRING_RE.match(text, m.start())
+            if sm:
+                pos = sm.end()
+
+
+def _block_end(text: str, start: int) -> int:
+    """End offset of the (non-nested) block comment opened at `start`, or -1 if it never closes."""
+    e = text.find("*/", start + 2)
+    return -1 if e < 0 else e + 2
+
+
+def scan_comments(text: str, lang: str | None = "generic") -> List[Span]:
+    """Comment spans of `text` in order; see the module docstring for the per-language rules."""
+    lexer = lexer_for(lang)
+    start_re = _START_RE[lexer]
+    nested, primes, loose = _NESTED_BLOCKS[lexer], _PRIMES[lexer], _LOOSE_QUOTES[lexer]
+    n = len(text)
+    nested_ends: Dict[int, int] = {}
+    nested_unclosed: set = set()
+    spans: List[Span] = []
+    pos = 0
+    while True:
+        m = start_re.search(text, pos)
+        if m is None:
+            break
+        kind, s = m.lastgroup, m.start()
+        if kind == "line":
+            e = text.find("\n", s)
+            e = n if e < 0 else e
+            spans.append((text[s:e], (s, e), m.group("line")))
+            pos = e
+        elif kind == "block":
+            if not nested:
+                e = _block_end(text, s)
+            else:
+                if s not in nested_ends and s not in nested_unclosed:
+                    _nested_block_scan(text, s, nested_ends, nested_unclosed)
+                e = nested_ends.get(s, -1)
+            if e < 0:
+                pos = s + 2
+                continue
+            spans.append((text[s:e], (s, e), "block"))
+            pos = e
+        elif loose:  # generic "..." / '...': not after a word character (5", don't)
+            if s > 0 and _WORD_CHAR_RE.match(text, s - 1):
+                pos = s + 1
+                continue
+            sm = (_STRING_RE if kind == "str" else _SQ_STRING_RE).match(text, s)
+            pos = sm.end() if sm else s + 1
+        elif kind == "str":
+            sm = _STRING_RE.match(text, s)
+            pos = sm.end() if sm else s + 1
+        else:  # chr
+            if primes and s > 0 and _IDENT_CHAR_RE.match(text, s - 1):
+                pos = s + 1
+                continue
+            cm = _CHAR_RE.match(text, s)
+            pos = cm.end() if cm else s + 1
+    return spans
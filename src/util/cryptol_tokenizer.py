@@ -0,0 +1,117 @@
+"""
+cryptol_tokenizer: the light Cryptol/SAW tokenizer shared by the similarity, quality and
+dataset stages.
+
+One compiled pattern strips comments and emits tokens in a single left-to-right pass:
+comment alternatives (--, //, /* */) come first, so comment text never yields tokens, and
+the token alternatives are the ones similiar_process / quality_process used before, in
+the same order, so token sequences are unchanged. Unlike the old strip-then-tokenize
+pair, comment markers inside a string literal stay part of the string, and a block
+comment between two tokens no longer glues them together.
+
+Results are memoized by the sha1 of the text, so every stage that tokenizes the same
+file pays for it once per process.
+
+Example:
+    toks = tokenize(code)            # tuple of token strings (shared, don't mutate)
+    ids  = token_hashes(code)        # np.uint64 array, one hash per token
+"""
+
+from __future__ import annotations
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"""
+    # ---------- comments (matched, never emitted) ----------
+    (?:--[^\n]* | //[^\n]* | /\*[\s\S]*?\*/)
+    |
+    (
+      # ---------- literals ----------
+      0x[0-9A-Fa-f]+            |   # hex
+      0b[01]+                   |   # binary
+      0o[0-7]+                  |   # octal
+      \d+                       |   # decimal
+      "(?:[^"\\]|\\.)*"         |   # strings (basic escapes)
+
+      # ---------- identifiers ----------
+      [A-Za-z_][A-Za-z_0-9']*   |   # allow prime in names (e.g., SubByte')
+
+      # ---------- multi-char operators (order matters: longest first) ----------
+      <<< | >>> | << | >>       |   # shifts/rotates
+      \^\^                      |   # polynomial/exponent
+      ::  | ->  | == | <= | >=  |   # comparisons/arrows
+      !=  | <-(?!-) | \.\. | \.\.\. | # not-equal, generator (not "<--": that's "<" + comment), ranges
+      <\| | \|>                 |   # polynomial delimiters
+
+      # ---------- single-char punctuation / operators ----------
+      [{}()\[\];,:\.@!#\^+\-*/=<>\|`]
+    )
+""", re.X)
+
+# Bump whenever token output changes, so persisted signatures/indexes built from older tokens
+# are not mixed with new ones. 1: the old strip-then-tokenize pair; 2: this single pass.
+TOKENIZER_VERSION = 2
+
+DEFAULT_CACHE_SIZE = 4096   # files kept in the memo (least recently used evicted first)
+
+_cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+_cache_size = DEFAULT_CACHE_SIZE
+_lock = threading.Lock()
+_token_hash: Dict[str, int] = {}
+
+
+def content_sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def _scan(code: str) -> Tuple[str, ...]:
+    # findall yields "" for comment matches (the token group didn't participate)
+    return tuple(t for t in TOKEN_RE.findall(code) if t)
+
+
+def tokenize(code: str, sha1: Optional[str] = None) -> Tuple[str, ...]:
+    """Tokens of `code` with comments removed; memoized by content sha1 (pass it if known)."""
+    key = sha1 or content_sha1(code)
+    with _lock:
+        toks = _cache.get(key)
+        if toks is not None:
+            _cache.move_to_end(key)
+            return toks
+    toks = _scan(code)
+    with _lock:
+        _cache[key] = toks
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+    return toks
+
+
+def token_hashes(code: str, sha1: Optional[str] = None) -> np.ndarray:
+    """One uint64 per token (first 8 bytes of the token's sha1), in token order."""
+    toks = tokenize(code, sha1)
+    out = np.empty(len(toks), dtype=np.uint64)
+    for i, t in enumerate(toks):
+        h = _token_hash.get(t)
+        if h is None:
+            h = _token_hash[t] = int.from_bytes(hashlib.sha1(t.encode("utf-8")).digest()[:8], "little")
+        out[i] = h
+    return out
+
+
+def set_cache_size(n: int) -> None:
+    """Change how many files' tokens are memoized (0 disables the memo)."""
+    global _cache_size
+    with _lock:
+        _cache_size = max(0, n)
+        while len(_cache) > _cache_size:
+            _cache.popitem(last=False)
+
+
+def clear_cache() -> None:
+    with _lock:
+        _cache.clear()
+        _token_hash.clear()
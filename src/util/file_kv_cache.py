@@ -2,8 +2,18 @@
 
 - Backed by a single JSONL file for durability and easy inspection.
 - Get semantics: return the value if present; otherwise return False (per user request).
-- Put semantics: append a new record immediately and fsync to avoid losing work.
-- Maintains an in-memory index (key -> last value) rebuilt on start.
+- Put semantics: append a new record immediately; fsync every `fsync_every` writes
+  (default 1, i.e. every write) so batched runs can group-commit.
+- Maintains an in-memory index (key -> byte offset of the latest record). The index is
+  persisted next to the data file (<path>.idx) so startup only scans records appended
+  since the index was last saved instead of re-parsing the whole file. Values are read
+  lazily by offset on first `get`.
+- `compact()` rewrites the file keeping only the latest value per key.
+- Safe to share between threads and processes: appends and index refreshes take an
+  flock on <path>.lock, and records appended by other processes are picked up on the
+  next miss. `get_or_call` is single-flight: concurrent callers asking for the same key
+  (threads, or processes via per-key lock files in <path>.locks/) wait on one computation.
+  `map_or_call` fans the misses of a batch of keys out over a thread pool.
 
 Each line in the file is a JSON object: {"key": <key>, "value": <value>, "ts": "<iso8601>"}
 You can store any JSON-serializable "value".
@@ -14,80 +24,444 @@ Example:
     if v is False:
         v = heavy_compute()
         cache.set("some-key", v)  # appended + flushed immediately
+
+    with FileKVCache("cache/results.jsonl", fsync_every=64) as cache:
+        for k in keys:
+            cache.get_or_call(k, heavy_compute, {"k": k})
+    # index saved and pending writes fsynced on exit
+
+    results = cache.map_or_call(filenames, fetch, max_workers=8)  # fetch(filename) per miss
 """
 
 from __future__ import annotations
+import atexit
+import contextlib
 import functools
+import threading
+import weakref
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 import os
 import json
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # not POSIX: only thread-level locking
+    fcntl = None
+
+INDEX_VERSION = 1
+_KEY_LOCK_SLOTS = 1024
+
+def _close_at_exit(ref: "weakref.ref[FileKVCache]") -> None:
+    cache = ref()
+    if cache is not None:
+        cache.close()
+
 @dataclass
 class FileKVCache:
     path: Path
 
-    def __init__(self, path: str | Path):
+    def __init__(self, path: str | Path, *, fsync_every: int = 1, persist_index: bool = True):
         self.path = Path(path)
         self.path.parent.mkdir(parents=True, exist_ok=True)
         if not self.path.exists():
             self.path.touch()
-        self._index: Dict[str, Any] = {}
-        self._build_index()
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.fsync_every = max(1, int(fsync_every))
+        self.persist_index = persist_index
+
+        self._offsets: Dict[str, Tuple[int, int]] = {}   # key -> (offset, length) of latest record
+        self._values: Dict[str, Any] = {}                # values already decoded or written
+        self._size = 0                                   # bytes of the data file covered by _offsets
+        self._n_records = 0
+        self._needs_newline = False                      # file ends in a torn (partial) line
+        self._pending_fsync = 0
+        self._index_dirty = False
+
+        self._fh = None
+        self._rfd: Optional[int] = None
+        self._ino: Optional[int] = None
+
+        self._lock = threading.RLock()
+        self._inflight: Dict[str, Future] = {}
+        self._lock_fd: Optional[int] = None
+        if fcntl is not None:
+            self._lock_fd = os.open(self.path.with_name(self.path.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+
+        with self._lock, self._file_lock(shared=True):
+            self._open_index()
+        atexit.register(_close_at_exit, weakref.ref(self))
 
     def get(self, key: str) -> Any | bool:
         """Return cached value for 'key' if present; else return False."""
-        return self._index.get(key, False)
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            loc = self._offsets.get(key)
+            if loc is None:
+                # may have been written by another process since we last looked
+                with self._file_lock(shared=True):
+                    self._refresh()
+                loc = self._offsets.get(key)
+                if loc is None:
+                    return False
+            obj = self._read_record(*loc)
+            value = obj.get("value", None) if obj is not None else None
+            self._values[key] = value
+            return value
 
     def get_or_false(self, key: str) -> Any | bool:
         return self.get(key)
 
     def get_or_call(self, key: str, fn: functools.partial, kwargs: dict) -> Any:
-        """Return cached value for 'key' if present; else call fn(), cache, and return."""
+        """
+        Return cached value for 'key' if present; else call fn(), cache, and return.
+        Concurrent callers for the same key wait for the first caller's result
+        (or its exception) instead of calling fn() again.
+        """
         v = self.get(key)
         if v is not False:
             return v
-        v = fn(**kwargs)
-        self.set(key, v)
-        return v
+
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+        if not owner:
+            return fut.result()
+
+        try:
+            with self._key_lock(key):
+                v = self.get(key)  # another process may have finished it meanwhile
+                if v is False:
+                    v = fn(**kwargs)
+                    self.set(key, v)
+            fut.set_result(v)
+            return v
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def map_or_call(
+        self,
+        keys: Sequence[str],
+        fn: Callable[..., Any],
+        kwargs_list: Optional[Sequence[dict]] = None,
+        max_workers: int = 8,
+    ) -> List[Any]:
+        """
+        Bulk get_or_call: return values for `keys` in order, computing misses on a
+        thread pool of `max_workers`. Each miss calls fn(**kwargs_list[i]), or fn(key)
+        when kwargs_list is None. The first exception raised by fn is re-raised after
+        the other misses finish; their results stay cached.
+        """
+        if kwargs_list is not None and len(kwargs_list) != len(keys):
+            raise ValueError("kwargs_list must have one entry per key")
+        results: List[Any] = [None] * len(keys)
+        misses: List[int] = []
+        for i, k in enumerate(keys):
+            v = self.get(k)
+            if v is False:
+                misses.append(i)
+            else:
+                results[i] = v
+        if not misses:
+            return results
+
+        def _call(i: int) -> Any:
+            if kwargs_list is None:
+                return self.get_or_call(keys[i], functools.partial(fn, keys[i]), {})
+            return self.get_or_call(keys[i], fn, kwargs_list[i])
+
+        first_err: Optional[BaseException] = None
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+            futs = {ex.submit(_call, i): i for i in misses}
+            for fut, i in futs.items():
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    if first_err is None:
+                        first_err = e
+        if first_err is not None:
+            raise first_err
+        return results
 
     def has(self, key: str) -> bool:
-        return key in self._index
+        with self._lock:
+            return key in self._offsets
 
     def set(self, key: str, value: Any) -> None:
-        """Append {key,value,ts} to the JSONL file, fsync, and update index."""
+        """Append {key,value,ts} to the JSONL file, fsync (every `fsync_every` writes), and update index."""
         rec = {
             "key": key,
             "value": value,
             "ts": datetime.utcnow().isoformat(timespec="seconds") + "Z",
         }
-        line = json.dumps(rec, ensure_ascii=False)
-        with open(self.path, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-            f.flush()
-            os.fsync(f.fileno())
-        self._index[key] = value
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, self._file_lock():
+            # catch up with appends from other processes so our offset is the true EOF
+            self._refresh()
+            fh = self._writer()
+            if self._needs_newline:
+                fh.write(b"\n")
+                self._size += 1
+                self._needs_newline = False
+            offset = self._size
+            fh.write(line)
+            fh.flush()
+            self._pending_fsync += 1
+            if self._pending_fsync >= self.fsync_every:
+                os.fsync(fh.fileno())
+                self._pending_fsync = 0
+
+            self._size += len(line)
+            self._n_records += 1
+            self._offsets[key] = (offset, len(line))
+            self._values[key] = value
+            self._index_dirty = True
 
     def keys(self):
-        return list(self._index.keys())
+        with self._lock:
+            return list(self._offsets.keys())
 
     def to_dict(self) -> Dict[str, Any]:
-        return dict(self._index)
+        return {k: self.get(k) for k in self.keys()}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._offsets)
+
+    # --- durability ---
+    def flush(self) -> None:
+        """fsync pending writes and persist the offset index."""
+        with self._lock:
+            if self._fh is not None and self._pending_fsync:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+                self._pending_fsync = 0
+            if self.persist_index and self._index_dirty:
+                with self._file_lock():
+                    # our offsets may predate a compact()/append by another process
+                    self._refresh()
+                    self._save_index()
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._close_handles()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def __enter__(self) -> "FileKVCache":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def compact(self) -> int:
+        """
+        Rewrite the data file keeping only the latest record per key (in write order).
+        Returns the number of superseded records dropped. Other processes notice the
+        new file on their next refresh and reload their index.
+        """
+        with self._lock:
+            self.flush()
+            with self._file_lock():
+                self._refresh()
+                tmp = self.path.with_name(self.path.name + f".compact.{os.getpid()}.tmp")
+                new_offsets: Dict[str, Tuple[int, int]] = {}
+                pos = 0
+                with open(tmp, "wb") as out:
+                    for key, (off, length) in sorted(self._offsets.items(), key=lambda kv: kv[1][0]):
+                        line = self._read_raw(off, length).rstrip(b"\n") + b"\n"
+                        out.write(line)
+                        new_offsets[key] = (pos, len(line))
+                        pos += len(line)
+                    out.flush()
+                    os.fsync(out.fileno())
+
+                self._close_handles()
+                os.replace(tmp, self.path)
+                dropped = self._n_records - len(new_offsets)
+                self._offsets = new_offsets
+                self._size = pos
+                self._n_records = len(new_offsets)
+                self._needs_newline = False
+                self._ino = os.stat(self.path).st_ino
+                self._index_dirty = True
+                if self.persist_index:
+                    self._save_index()
+            return dropped
+
+    # --- internals ---
+    @contextlib.contextmanager
+    def _file_lock(self, shared: bool = False) -> Iterator[None]:
+        """
+        Cross-process flock on <path>.lock (shared for reads, exclusive for writes).
+        Always taken while holding self._lock, so one fd per cache is enough.
+        """
+        if self._lock_fd is None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def _key_lock(self, key: str) -> Iterator[None]:
+        """
+        Cross-process single-flight: an exclusive flock on <path>.locks/<slot>.lock, with
+        the slot chosen by the key's crc32. Each acquisition opens its own fd so threads
+        never share (or silently release) each other's locks; threads asking for the
+        same key are already deduplicated via _inflight.
+        """
+        if fcntl is None:
+            yield
+            return
+        lock_dir = self.path.with_name(self.path.name + ".locks")
+        lock_dir.mkdir(exist_ok=True)
+        slot = zlib.crc32(key.encode("utf-8")) % _KEY_LOCK_SLOTS
+        fd = os.open(lock_dir / f"{slot:04d}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the flock
+
+    def _writer(self):
+        if self._fh is None:
+            self._fh = open(self.path, "ab")
+        return self._fh
+
+    def _close_handles(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._rfd is not None:
+            os.close(self._rfd)
+            self._rfd = None
+
+    def _open_index(self) -> None:
+        self._ino = os.stat(self.path).st_ino
+        if not (self.persist_index and self._load_index()):
+            self._build_index()
+
+    def _refresh(self) -> None:
+        """Pick up records appended (or a compaction done) by other processes. Caller holds the locks."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._ino:
+            # replaced by compact() elsewhere: our offsets describe the old file
+            if self._fh is not None and self._pending_fsync:
+                os.fsync(self._fh.fileno())
+                self._pending_fsync = 0
+            self._close_handles()
+            self._values.clear()
+            self._open_index()
+        elif st.st_size > self._size:
+            self._scan(self._size)
+
+    def _read_raw(self, offset: int, length: int) -> bytes:
+        if self._rfd is None:
+            self._rfd = os.open(self.path, os.O_RDONLY)
+        return os.pread(self._rfd, length, offset)
+
+    def _read_record(self, offset: int, length: int) -> Optional[dict]:
+        try:
+            return json.loads(self._read_raw(offset, length).decode("utf-8", errors="replace"))
+        except json.JSONDecodeError:
+            return None
+
+    def _scan(self, start: int) -> None:
+        """Index records from byte `start` to EOF (later records win)."""
+        pos = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for raw in f:
+                length = len(raw)
+                if not raw.endswith(b"\n"):
+                    # torn final write; leave it unindexed and start the next write on a new line
+                    self._needs_newline = True
+                    pos += length
+                    break
+                self._needs_newline = False
+                line = raw.strip()
+                if line:
+                    try:
+                        obj = json.loads(line.decode("utf-8", errors="replace"))
+                        k = obj.get("key", None)
+                        if k is not None:
+                            self._offsets[k] = (pos, length)
+                            self._values.pop(k, None)
+                            self._n_records += 1
+                    except (json.JSONDecodeError, AttributeError):
+                        pass
+                pos += length
+        if pos != start:
+            self._index_dirty = True
+        self._size = pos
 
     def _build_index(self) -> None:
-        self._index.clear()
-        with open(self.path, "r", encoding="utf-8", errors="replace") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    k = obj.get("key", None)
-                    if k is None:
-                        continue
-                    self._index[k] = obj.get("value", None)
-                except json.JSONDecodeError:
-                    continue
+        self._offsets.clear()
+        self._values.clear()
+        self._n_records = 0
+        self._needs_newline = False
+        self._scan(0)
+
+    def _load_index(self) -> bool:
+        """Load <path>.idx and scan only the tail appended since; False if it must be rebuilt."""
+        if not self.index_path.exists():
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+            if obj.get("version") != INDEX_VERSION:
+                return False
+            st = os.stat(self.path)
+            data_size = int(obj["data_size"])
+            if obj.get("data_ino") != st.st_ino or st.st_size < data_size:
+                return False  # data file replaced or truncated since the index was saved
+            offsets = {k: (int(v[0]), int(v[1])) for k, v in obj["entries"].items()}
+        except (OSError, ValueError, KeyError, TypeError, json.JSONDecodeError):
+            return False
+
+        # Spot-check the newest indexed record still holds its key
+        if offsets:
+            key, loc = max(offsets.items(), key=lambda kv: kv[1][0])
+            rec = self._read_record(*loc)
+            if not isinstance(rec, dict) or rec.get("key") != key:
+                return False
+
+        self._offsets = offsets
+        self._n_records = int(obj.get("records", len(offsets)))
+        self._index_dirty = False
+        self._scan(data_size)
+        return True
+
+    def _save_index(self) -> None:
+        obj = {
+            "version": INDEX_VERSION,
+            "data_size": self._size,
+            "data_ino": self._ino,  # the file our offsets describe, not whatever is there now
+            "records": self._n_records,
+            "entries": {k: list(v) for k, v in self._offsets.items()},
+        }
+        tmp = self.index_path.with_name(self.index_path.name + f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+        self._index_dirty = False
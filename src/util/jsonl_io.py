@@ -0,0 +1,405 @@
+"""jsonl_io: sharded, optionally compressed JSONL shared by the pipeline stages.
+
+- Plain mode (no compression, no shard limit) writes exactly one .jsonl file at the
+  requested path, byte-for-byte what the stages wrote before.
+- Sharded mode splits output into <stem>-00000.jsonl[.gz|.zst], <stem>-00001..., each
+  holding at most `max_shard_bytes` of uncompressed JSONL, and writes an index
+  <stem>.index.json listing the shards and their record counts.
+- Readers accept the original .jsonl path, the index path, or a single shard and
+  stream records or pandas chunks, optionally reading shards in parallel.
+
+zstd needs the optional `zstandard` package; without it the writer falls back to gzip.
+
+Example:
+    with ShardedJsonlWriter("data/dataset_hybrid.jsonl", compression="zstd",
+                            max_shard_bytes=256 << 20) as w:
+        for rec in records:
+            w.write(rec)
+
+    for chunk in iter_dataframes("data/dataset_hybrid.jsonl", chunksize=5000):
+        ...
+"""
+
+from __future__ import annotations
+import gzip
+import io
+import json
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _stem(path: Path) -> Path:
+    """'out/dataset.jsonl' -> 'out/dataset' (also strips .gz/.zst)."""
+    name = path.name
+    for suffix in (".zst", ".gz"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+    if name.endswith(".jsonl"):
+        name = name[: -len(".jsonl")]
+    return path.with_name(name)
+
+
+def index_path_for(path: str | Path) -> Path:
+    path = Path(path)
+    if path.name.endswith(INDEX_SUFFIX):
+        return path
+    stem = _stem(path)
+    return stem.with_name(stem.name + INDEX_SUFFIX)
+
+
+def _dump_line(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ShardedJsonlWriter:
+    """
+    Write JSONL records to one file or to size-limited, compressed shards plus an index.
+
+    compression     : None, "gzip" or "zstd".
+    max_shard_bytes : Uncompressed bytes per shard; None means a single shard.
+    append          : Add to an existing output instead of overwriting it. In sharded
+                      mode new records go to new shards listed after the existing ones.
+
+    An output has one layout at a time: closing an overwrite removes the plain file or the
+    index and shards left by an earlier run in the other layout (readers would otherwise
+    keep finding the stale one), and appending when the other layout exists is an error.
+
+    Readers keep seeing the previous output until close(): an overwrite writes the plain
+    file under a temporary name, and new shards never reuse a name the current index
+    lists. If the `with` body raises, abort() discards what this writer wrote and leaves
+    the previous output (and its index) untouched.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        *,
+        compression: Optional[str] = None,
+        max_shard_bytes: Optional[int] = None,
+        append: bool = False,
+        level: Optional[int] = None,
+    ):
+        if compression not in COMPRESSION_SUFFIX:
+            raise ValueError(f"Unknown compression {compression!r}; use one of None, 'gzip', 'zstd'")
+        if compression == "zstd" and zstd is None:
+            warnings.warn("zstandard not installed — writing gzip shards instead.")
+            compression = "gzip"
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.compression = compression
+        self.max_shard_bytes = max_shard_bytes
+        self.level = level
+        self.sharded = compression is not None or max_shard_bytes is not None
+        self.index_path = index_path_for(self.path)
+
+        self._shards: List[Dict[str, Any]] = []
+        self._fh = None
+        self._raw = None
+        self._cur: Optional[Dict[str, Any]] = None
+        self.records_written = 0
+        self.append = append
+        self._old_shards: List[str] = []   # names listed by the index being replaced
+        self._n_kept = 0                   # leading entries of _shards from the existing index
+        self._plain_tmp: Optional[Path] = None
+        self._plain_start = 0
+
+        if append and self._other_layout_exists():
+            raise ValueError(f"{self.path} already exists in the other (plain/sharded) layout; "
+                             f"rewrite it instead of appending")
+
+        if not self.sharded:
+            if append:
+                self._fh = open(self.path, "ab")
+                self._plain_start = self._fh.tell()
+            else:
+                self._plain_tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+                self._fh = open(self._plain_tmp, "wb")
+            return
+
+        if self.index_path.exists():
+            old = read_index(self.index_path)["shards"]
+            if append:
+                self._shards = old
+                self._n_kept = len(old)
+            else:
+                # Overwrite: the old shards stay readable until close() swaps the index
+                self._old_shards = [sh["path"] for sh in old]
+
+    def _plain_path(self) -> Optional[Path]:
+        # the path itself, unless the caller named the index
+        return None if self.path == self.index_path else self.path
+
+    def _other_layout_exists(self) -> bool:
+        if self.sharded:
+            plain = self._plain_path()
+            return plain is not None and plain.exists()
+        return self.index_path.exists()
+
+    def _remove_other_layout(self) -> None:
+        if self.sharded:
+            plain = self._plain_path()
+            if plain is not None and plain.exists():
+                plain.unlink()
+        elif self.index_path.exists():
+            _remove_shards(self.index_path)
+            self.index_path.unlink()
+
+    # --- shard management ---
+    def _open_next_shard(self) -> None:
+        self._close_shard()
+        stem = _stem(self.path)
+        suffix = COMPRESSION_SUFFIX[self.compression]
+        name = f"{stem.name}-{len(self._shards):05d}.jsonl{suffix}"
+        if name in self._old_shards:
+            # still listed by the index readers use; alternate names between runs
+            name = f"{stem.name}-{len(self._shards):05d}-{os.getpid():x}.jsonl{suffix}"
+        shard_path = stem.with_name(name)
+        if self.compression == "gzip":
+            self._fh = gzip.open(shard_path, "wb", compresslevel=self.level or 6)
+        elif self.compression == "zstd":
+            self._raw = open(shard_path, "wb")
+            cctx = zstd.ZstdCompressor(level=self.level or 3)
+            self._fh = cctx.stream_writer(self._raw)
+        else:
+            self._fh = open(shard_path, "wb")
+        self._cur = {"path": name, "records": 0, "bytes": 0}
+        self._shards.append(self._cur)
+
+    def _close_shard(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    # --- public API ---
+    def write(self, record: Dict[str, Any]) -> None:
+        line = _dump_line(record)
+        if self.sharded:
+            cur = self._cur
+            if (
+                cur is None
+                or (
+                    self.max_shard_bytes is not None
+                    and cur["records"] > 0
+                    and cur["bytes"] + len(line) > self.max_shard_bytes
+                )
+            ):
+                self._open_next_shard()
+                cur = self._cur
+            cur["records"] += 1
+            cur["bytes"] += len(line)
+        self._fh.write(line)
+        self.records_written += 1
+
+    def write_many(self, records: Iterable[Dict[str, Any]]) -> int:
+        n = 0
+        for rec in records:
+            self.write(rec)
+            n += 1
+        return n
+
+    def close(self) -> None:
+        """Finish the output: write the index (or move the plain file into place), then
+        remove shards and other-layout files the new output no longer uses."""
+        self._close_shard()
+        if self.sharded:
+            _write_index(self.index_path, self.compression, self._shards)
+            listed = {sh["path"] for sh in self._shards}
+            for name in self._old_shards:
+                if name not in listed:
+                    try:
+                        (self.index_path.parent / name).unlink()
+                    except FileNotFoundError:
+                        pass
+        elif self._plain_tmp is not None:
+            os.replace(self._plain_tmp, self.path)
+            self._plain_tmp = None
+        if not self.append:
+            self._remove_other_layout()
+
+    def abort(self) -> None:
+        """Discard this writer's records and leave the previous output as it was."""
+        self._close_shard()
+        if self.sharded:
+            for sh in self._shards[self._n_kept:]:
+                try:
+                    (self.index_path.parent / sh["path"]).unlink()
+                except FileNotFoundError:
+                    pass
+            self._shards = self._shards[: self._n_kept]
+        elif self._plain_tmp is not None:
+            try:
+                self._plain_tmp.unlink()
+            except FileNotFoundError:
+                pass
+            self._plain_tmp = None
+        elif self.append:
+            os.truncate(self.path, self._plain_start)
+
+    def shard_paths(self) -> List[Path]:
+        if not self.sharded:
+            return [self.path]
+        return [self.index_path.parent / s["path"] for s in self._shards]
+
+    def __enter__(self) -> "ShardedJsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def _remove_shards(index_path: Path) -> None:
+    for shard in read_index(index_path)["shards"]:
+        try:
+            (index_path.parent / shard["path"]).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _write_index(index_path: Path, compression: Optional[str], shards: List[Dict[str, Any]]) -> None:
+    obj = {
+        "version": INDEX_VERSION,
+        "compression": compression,
+        "records": sum(s["records"] for s in shards),
+        "shards": shards,
+    }
+    tmp = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, index_path)
+
+
+def read_index(index_path: str | Path) -> Dict[str, Any]:
+    with open(index_path, "r", encoding="utf-8") as f:
+        obj = json.load(f)
+    if obj.get("version") != INDEX_VERSION:
+        raise ValueError(f"Unsupported shard index version in {index_path}: {obj.get('version')!r}")
+    return obj
+
+
+def write_jsonl(
+    rows: Iterable[Dict[str, Any]],
+    path: str | Path,
+    *,
+    compression: Optional[str] = None,
+    max_shard_bytes: Optional[int] = None,
+    append: bool = False,
+) -> List[Path]:
+    """Write `rows` (plain or sharded) and return the files written."""
+    with ShardedJsonlWriter(path, compression=compression, max_shard_bytes=max_shard_bytes,
+                            append=append) as w:
+        w.write_many(rows)
+    return w.shard_paths()
+
+
+# --- Reading -----------------------------------------------------------------
+
+def resolve_shards(path: str | Path) -> List[Path]:
+    """
+    Return the files backing `path`: the shards listed in its index if one exists,
+    otherwise the file itself.
+    """
+    path = Path(path)
+    idx = index_path_for(path)
+    if path.name.endswith(INDEX_SUFFIX) or (idx.exists() and not path.exists()):
+        return [idx.parent / s["path"] for s in read_index(idx)["shards"]]
+    if path.exists():
+        return [path]
+    raise FileNotFoundError(f"No JSONL file or shard index found for {path}")
+
+
+def _open_text(path: Path) -> io.TextIOBase:
+    name = path.name
+    if name.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if name.endswith(".zst"):
+        if zstd is None:
+            raise ImportError(f"zstandard is required to read {path}")
+        raw = open(path, "rb")
+        reader = zstd.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_shard_records(path: str | Path) -> Iterator[Dict[str, Any]]:
+    with _open_text(Path(path)) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_shard(path: Path) -> List[Dict[str, Any]]:
+    return list(iter_shard_records(path))
+
+
+def iter_records(path: str | Path, *, workers: int = 1) -> Iterator[Dict[str, Any]]:
+    """
+    Stream records from a plain or sharded JSONL output, in shard order.
+
+    With workers > 1, up to `workers` shards are decoded ahead in a thread pool;
+    memory is then bounded by `workers` shards rather than the whole dataset.
+    """
+    shards = resolve_shards(path)
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            yield from iter_shard_records(shard)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        pending = [ex.submit(_read_shard, s) for s in shards[:workers]]
+        next_i = len(pending)
+        while pending:
+            recs = pending.pop(0).result()
+            if next_i < len(shards):
+                pending.append(ex.submit(_read_shard, shards[next_i]))
+                next_i += 1
+            yield from recs
+
+
+def iter_dataframes(path: str | Path, chunksize: int = 10_000, *, workers: int = 1):
+    """Yield pandas DataFrames of at most `chunksize` records."""
+    import pandas as pd
+    buf: List[Dict[str, Any]] = []
+    for rec in iter_records(path, workers=workers):
+        buf.append(rec)
+        if len(buf) >= chunksize:
+            yield pd.DataFrame.from_records(buf)
+            buf = []
+    if buf:
+        yield pd.DataFrame.from_records(buf)
+
+
+def read_dataframe(path: str | Path, *, workers: int = 4, columns: Optional[List[str]] = None):
+    """Load a plain or sharded JSONL output into one DataFrame, reading shards in parallel."""
+    import pandas as pd
+
+    def _load(shard: Path):
+        df = pd.DataFrame.from_records(_read_shard(shard))
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        return df
+
+    shards = resolve_shards(path)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        frames = list(ex.map(_load, shards))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)